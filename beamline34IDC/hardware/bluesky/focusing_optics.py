@@ -83,6 +83,8 @@ class __BlueskyFocusingOptics(AbstractHardwareFocusingOptics):
     def move_hkb_motor_1_2_bender(self, pos_upstream, pos_downstream, movement=Movement.ABSOLUTE, units=DistanceUnits.MICRON): pass
     def get_hkb_motor_1_2_bender(self, units=DistanceUnits.MICRON): pass
 
+    def move_many(self, positions, movement=Movement.ABSOLUTE, **kwargs): pass
+
     # PROTECTED GENERIC MOTOR METHODS
     
     def get_beam_scan(self, direction=Directions.HORIZONTAL): pass
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import asyncio
+import threading
+
+import numpy
+
+from beamline34IDC.hardware.epics.pv_names import ImageMode
+from beamline34IDC.hardware.epics.pv_registry import get_plugin_counter
+
+#############################################################################
+# Event-driven acquisition of the detector counts: the end of the acquisition
+# is tracked by the monitors of cam1:Acquire and of the ArrayCounter_RBV of the
+# plugin of the counts, so the call returns as soon as the last frame is
+# processed, with no dead time from sleeping and polling.
+#
+# The frames are clocked by the plugin counter: the counts post a monitor event
+# only when they change, and are matched to the frames by the IOC timestamps.
+#
+
+ACQUIRE_TIMEOUT_MARGIN = 5.0 # s, on top of the exposure of all the frames
+
+def get_frame_counts(frame_timestamps, totals, exposure_time):
+    '''
+    frame_timestamps: IOC timestamps of the events of the plugin counter, one per frame
+    totals: (IOC timestamp, counts) of the events of the counts, with the counts before the first frame at -inf
+    returns the counts of each frame: the last ones posted up to its counter (the same update of the plugin has
+    the same timestamp, within half an exposure of it), the previous ones if they did not change
+    '''
+    totals = numpy.array(sorted(totals), dtype=float)
+
+    return totals[numpy.searchsorted(totals[:, 0], numpy.asarray(frame_timestamps, dtype=float) + 0.5*exposure_time, side="right") - 1, 1]
+
+class _Acquisition():
+    def __init__(self, n_frames, start_counter, start_counts):
+        self.n_frames      = n_frames
+        self.start_counter = start_counter
+        self.frames        = [] # IOC timestamps
+        self.totals        = [(-numpy.inf, start_counts)] # (IOC timestamp, counts)
+        self.started       = False
+        self.stopped       = False
+        self.done          = threading.Event()
+        self.on_done       = None
+
+    def on_acquire(self, value=None, **kwargs):
+        if value == 1:                    self.started = True
+        elif value == 0 and self.started: self.stopped = True
+        self.__check_done()
+
+    def on_counter(self, value=None, timestamp=None, **kwargs):
+        if value > self.start_counter and len(self.frames) < self.n_frames:
+            self.frames.append(timestamp)
+            self.started = True
+        self.__check_done()
+
+    def on_counts(self, value=None, timestamp=None, **kwargs):
+        self.totals.append((timestamp, value))
+
+    def __check_done(self):
+        if self.stopped and len(self.frames) >= self.n_frames and not self.done.is_set():
+            self.done.set()
+            if not self.on_done is None: self.on_done()
+
+def _start(pvs, detector, counts, n_frames, exposure_time):
+    if n_frames < 1: raise ValueError("At least one frame is needed")
+
+    if not exposure_time is None: pvs.put(detector + ":AcquireTime", exposure_time)
+    if n_frames == 1:
+        pvs.put(detector + ":ImageMode", ImageMode.SINGLE)
+    else:
+        pvs.put(detector + ":ImageMode", ImageMode.MULTIPLE)
+        pvs.put(detector + ":NumImages", n_frames)
+
+    counter     = get_plugin_counter(counts)
+    acquisition = _Acquisition(n_frames, pvs.get(counter), pvs.get(counts))
+    callbacks   = [(detector + ":Acquire", pvs.add_callback(detector + ":Acquire", acquisition.on_acquire)),
+                   (counter,                pvs.add_callback(counter,                acquisition.on_counter)),
+                   (counts,                 pvs.add_callback(counts,                 acquisition.on_counts))]
+
+    return acquisition, callbacks
+
+def _get_timeout(pvs, detector, n_frames, timeout):
+    return n_frames * pvs.get(detector + ":AcquireTime") + ACQUIRE_TIMEOUT_MARGIN if timeout is None else timeout
+
+def _remove_callbacks(pvs, callbacks):
+    for name, index in callbacks: pvs.remove_callback(name, index)
+
+def _get_frames(pvs, detector, acquisition, timeout):
+    if not acquisition.done.is_set(): raise TimeoutError("Acquisition of " + detector + " not completed after " + str(timeout) + " s")
+
+    return get_frame_counts(acquisition.frames, acquisition.totals, pvs.get(detector + ":AcquireTime"))
+
+def acquire_frames(pvs, detector, counts, n_frames=1, exposure_time=None, timeout=None):
+    '''
+    pvs: PVRegistry, with the detector added (add_detector)
+    detector: cam1 prefix, counts: the counts PV (Stats plugin Total_RBV)
+    returns the counts of the n_frames frames (Single image mode for one frame, Multiple otherwise).
+    raises TimeoutError if the frames are not read out after timeout (default: exposure of all the frames + margin)
+    '''
+    acquisition, callbacks = _start(pvs, detector, counts, n_frames, exposure_time)
+    timeout                = _get_timeout(pvs, detector, n_frames, timeout)
+
+    try:
+        pvs.put(detector + ":Acquire", 1)
+        acquisition.done.wait(timeout=timeout)
+    finally:
+        _remove_callbacks(pvs, callbacks)
+
+    return _get_frames(pvs, detector, acquisition, timeout)
+
+def acquire_counts(pvs, detector, counts, n_frames=1, exposure_time=None, timeout=None):
+    '''
+    counts averaged over n_frames frames
+    '''
+    return acquire_frames(pvs, detector, counts, n_frames, exposure_time, timeout).mean()
+
+async def async_acquire_frames(pvs, detector, counts, n_frames=1, exposure_time=None, timeout=None):
+    '''
+    as acquire_frames, awaiting the monitor events without blocking the event loop
+    '''
+    loop                   = asyncio.get_running_loop()
+    done                   = loop.create_future()
+    acquisition, callbacks = _start(pvs, detector, counts, n_frames, exposure_time)
+    acquisition.on_done    = lambda: loop.call_soon_threadsafe(lambda: done.done() or done.set_result(True))
+    timeout                = _get_timeout(pvs, detector, n_frames, timeout)
+
+    try:
+        pvs.put(detector + ":Acquire", 1)
+        await asyncio.wait_for(asyncio.shield(done), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        _remove_callbacks(pvs, callbacks)
+
+    return _get_frames(pvs, detector, acquisition, timeout)
+
+async def async_acquire_counts(pvs, detector, counts, n_frames=1, exposure_time=None, timeout=None):
+    '''
+    as acquire_counts, awaiting the monitor events without blocking the event loop
+    '''
+    return (await async_acquire_frames(pvs, detector, counts, n_frames, exposure_time, timeout)).mean()
@@ -47,13 +47,17 @@
 
 import os, numpy, time
 
-from epics import caget, caput
-
+from beamline34IDC.util.common import get_image_info
 from beamline34IDC.util.initializer import AlreadyInitializedError, register_ini_instance, get_registered_ini_instance, IniMode
 
 from beamline34IDC.facade.focusing_optics_interface import AngularUnits, DistanceUnits, Movement
 from beamline34IDC.hardware.facade import Beamline
-from beamline34IDC.hardware.facade.focusing_optics_interface import AbstractHardwareFocusingOptics, Directions
+from beamline34IDC.hardware.epics.pv_names import Scan, Motors, ImageMode, Image
+from beamline34IDC.hardware.epics.pv_registry import PVRegistry, get_plugin_counter
+from beamline34IDC.hardware.epics.motion import move_records, MOVE_TIMEOUT
+from beamline34IDC.hardware.epics.acquisition import acquire_counts, get_frame_counts
+from beamline34IDC.hardware.epics.image import acquire_image
+from beamline34IDC.hardware.facade.focusing_optics_interface import AbstractHardwareFocusingOptics, Directions, ScanMode
 
 def epics_focusing_optics_factory_method(**kwargs):
     try: register_ini_instance(ini_mode=IniMode.LOCAL_FILE, application_name="motors configuration", ini_file_name="motors_configuration.ini")
@@ -61,33 +65,6 @@ def epics_focusing_optics_factory_method(**kwargs):
 
     return __EpicsFocusingOptics(**kwargs)
 
-class Scan:
-    SHUTTER  = {Beamline.REAL : '34idc:FastShutterState',     Beamline.VIRTUAL : '34idSim:FastShutterState'}
-    DETECTOR = {Beamline.REAL : '34idcTIM2:cam1',             Beamline.VIRTUAL : '34idSimTIM2:cam1'}
-    COUNTS   = {Beamline.REAL : '34idcTIM2:Stats5:Total_RBV', Beamline.VIRTUAL : '34idSimTIM2:Stats5:Total_RBV'}
-
-
-class Motors:
-    COH_SLITS_H_CENTER   = {Beamline.REAL : '34idc:m58:c2:m5', Beamline.VIRTUAL : '34idSim:m58:c2:m5'}
-    COH_SLITS_H_APERTURE = {Beamline.REAL : '34idc:m58:c2:m6', Beamline.VIRTUAL : '34idSim:m58:c2:m6'}
-    COH_SLITS_V_CENTER   = {Beamline.REAL : '34idc:m58:c2:m7', Beamline.VIRTUAL : '34idSim:m58:c2:m7'}
-    COH_SLITS_V_APERTURE = {Beamline.REAL : '34idc:m58:c2:m8', Beamline.VIRTUAL : '34idSim:m58:c2:m8'}
-
-    VKB_MOTOR_1 = {Beamline.REAL : '34idc:m58:c1:m3', Beamline.VIRTUAL : '34idSim:m58:c1:m3'} # upstream force micron
-    VKB_MOTOR_2 = {Beamline.REAL : '34idc:m58:c1:m4', Beamline.VIRTUAL : '34idSim:m58:c1:m4'} # downstream force micron
-    VKB_MOTOR_3 = {Beamline.REAL : '34idc:m58:c1:m2', Beamline.VIRTUAL : '34idSim:m58:c1:m2'} # pitch mrad
-    VKB_MOTOR_4 = {Beamline.REAL : '34idc:m58:c1:m1', Beamline.VIRTUAL : '34idSim:m58:c1:m1'} # translation micron
-
-    HKB_MOTOR_1 = {Beamline.REAL : '34idc:m58:c1:m7', Beamline.VIRTUAL : '34idSim:m58:c1:m7'}
-    HKB_MOTOR_2 = {Beamline.REAL : '34idc:m58:c1:m8', Beamline.VIRTUAL : '34idSim:m58:c1:m8'}
-    HKB_MOTOR_3 = {Beamline.REAL : '34idc:m58:c1:m6', Beamline.VIRTUAL : '34idSim:m58:c1:m6'}
-    HKB_MOTOR_4 = {Beamline.REAL : '34idc:m58:c1:m5', Beamline.VIRTUAL : '34idSim:m58:c1:m5'}
-
-    SAMPLE_STAGE_X        = {Beamline.REAL : '34idc:lab:m1'   , Beamline.VIRTUAL : '34idSim:lab:m1'   }
-    SAMPLE_STAGE_Y        = {Beamline.REAL : '34idc:lab:m2'   , Beamline.VIRTUAL : '34idSim:lab:m2'   }
-    SAMPLE_STAGE_Z        = {Beamline.REAL : '34idc:lab:m3'   , Beamline.VIRTUAL : '34idSim:lab:m3'   } # fine Z motion
-    SAMPLE_STAGE_Z_COARSE = {Beamline.REAL : '34idc:mxv:c0:m1', Beamline.VIRTUAL : '34idSim:mxv:c0:m1'} # coarse Z motion
-
 class __EpicsFocusingOptics(AbstractHardwareFocusingOptics):
     
     def __init__(self, **kwargs):
@@ -95,13 +72,30 @@ class __EpicsFocusingOptics(AbstractHardwareFocusingOptics):
         except: beamline = Beamline.REAL
         
         self.__beamline = beamline
+        self.__pvs      = None
 
     def initialize(self, **kwargs):
+        try:    ca_address_list = kwargs["ca_address_list"] # e.g. "127.0.0.1" for simulated_ioc.py
+        except: ca_address_list = None
+        try:    connection_timeout = kwargs["connection_timeout"]
+        except: connection_timeout = 5.0
+
         os.environ["PATH"] = os.environ["PATH"] + ":" + "/Users/lrebuffi/Documents/Workspace/External_Codes/EPICS/epics-base/bin/darwin-x86/"
 
-        if self.__beamline   == Beamline.VIRTUAL: os.environ["EPICS_CA_ADDR_LIST"] = "164.54.138.190"
+        if not ca_address_list is None:           os.environ["EPICS_CA_ADDR_LIST"] = ca_address_list
+        elif self.__beamline == Beamline.VIRTUAL: os.environ["EPICS_CA_ADDR_LIST"] = "164.54.138.190"
         elif self.__beamline == Beamline.REAL:    os.environ["EPICS_CA_ADDR_LIST"] = "boh"
 
+        # connections are opened once, all together, and kept for the lifetime of the object
+        if not self.__pvs is None: self.__pvs.disconnect()
+        self.__pvs = PVRegistry(connection_timeout=connection_timeout)
+
+        for motor_name in [name for name in vars(Motors).keys() if not name.startswith("_")]: self.__pvs.add_motor(getattr(Motors, motor_name)[self.__beamline])
+        self.__pvs.add_detector(Scan.DETECTOR[self.__beamline], Scan.COUNTS[self.__beamline])
+        self.__pvs.add(Scan.SHUTTER[self.__beamline])
+
+        self.__pvs.wait_for_connection()
+
     #####################################################################################
     # This methods represent the run-time interface, to interact with the optical system
     # in real time, like in the real beamline
@@ -111,20 +105,23 @@ class __EpicsFocusingOptics(AbstractHardwareFocusingOptics):
         elif units == DistanceUnits.MILLIMETERS: factor = 1e3
         else: raise ValueError("Distance units not recognized")
 
-        if not coh_slits_h_center is None:   caput(Motors.COH_SLITS_H_CENTER[self.__beamline] + ".VAL",   factor*coh_slits_h_center)
-        if not coh_slits_v_center is None:   caput(Motors.COH_SLITS_V_CENTER[self.__beamline] + ".VAL",   factor*coh_slits_v_center)
-        if not coh_slits_h_aperture is None: caput(Motors.COH_SLITS_H_APERTURE[self.__beamline] + ".VAL", factor*coh_slits_h_aperture)
-        if not coh_slits_v_aperture is None: caput(Motors.COH_SLITS_V_APERTURE[self.__beamline] + ".VAL", factor*coh_slits_v_aperture)
+        positions = {}
+        if not coh_slits_h_center is None:   positions["COH_SLITS_H_CENTER"]   = factor*coh_slits_h_center
+        if not coh_slits_v_center is None:   positions["COH_SLITS_V_CENTER"]   = factor*coh_slits_v_center
+        if not coh_slits_h_aperture is None: positions["COH_SLITS_H_APERTURE"] = factor*coh_slits_h_aperture
+        if not coh_slits_v_aperture is None: positions["COH_SLITS_V_APERTURE"] = factor*coh_slits_v_aperture
+
+        if len(positions) > 0: self.move_many(positions)
 
     def get_coherence_slits_parameters(self, units=DistanceUnits.MICRON):
         if units == DistanceUnits.MICRON:        factor = 1.0
         elif units == DistanceUnits.MILLIMETERS: factor = 1e-3
         else: raise ValueError("Distance units not recognized")
 
-        return factor*caget(Motors.COH_SLITS_H_CENTER[self.__beamline] + ".VAL"), \
-               factor*caget(Motors.COH_SLITS_V_CENTER[self.__beamline] + ".VAL"), \
-               factor*caget(Motors.COH_SLITS_H_APERTURE[self.__beamline] + ".VAL"), \
-               factor*caget(Motors.COH_SLITS_V_APERTURE[self.__beamline] + ".VAL")
+        return factor*self.__pvs.get(Motors.COH_SLITS_H_CENTER[self.__beamline] + ".VAL"), \
+               factor*self.__pvs.get(Motors.COH_SLITS_V_CENTER[self.__beamline] + ".VAL"), \
+               factor*self.__pvs.get(Motors.COH_SLITS_H_APERTURE[self.__beamline] + ".VAL"), \
+               factor*self.__pvs.get(Motors.COH_SLITS_V_APERTURE[self.__beamline] + ".VAL")
 
     # V-KB -----------------------
 
@@ -178,40 +175,57 @@ class __EpicsFocusingOptics(AbstractHardwareFocusingOptics):
     def get_hkb_motor_4_translation(self, units=DistanceUnits.MICRON): 
         return self.__get_translational_motor_position(Motors.HKB_MOTOR_4[self.__beamline], units)
 
+    # All motors together -----------------------
+
+    def move_many(self, positions, movement=Movement.ABSOLUTE, timeout=MOVE_TIMEOUT):
+        '''
+        positions: {motor: position}, motors as named in Motors (e.g. "HKB_MOTOR_3"), positions in the units of
+        the records (micron, mrad). All the motors start together and the call returns when the slowest one is
+        done moving, with {motor: settle time [s]}
+        '''
+        records = dict([(self.__get_motor_record(motor), motor) for motor in positions.keys()])
+        field   = self.__get_movement_field(movement)
+
+        settle_times = move_records(self.__pvs, dict([(self.__get_motor_record(motor), (field, position)) for motor, position in positions.items()]), timeout)
+
+        return dict([(records[record], settle_time) for record, settle_time in settle_times.items()])
+
     # PRIVATE METHODS
-    
+
+    def __get_motor_record(self, motor):
+        try:    return getattr(Motors, motor.upper())[self.__beamline]
+        except AttributeError: raise ValueError("Motor not recognized: " + str(motor))
+
     @classmethod
-    def __move_translational_motor(cls, motor, pos, movement=Movement.ABSOLUTE, units=DistanceUnits.MICRON):
+    def __get_movement_field(cls, movement):
+        if movement   == Movement.ABSOLUTE: return ".VAL"
+        elif movement == Movement.RELATIVE: return ".RLV"
+        else: raise ValueError("Movement not recognized")
+    
+    def __move_translational_motor(self, motor, pos, movement=Movement.ABSOLUTE, units=DistanceUnits.MICRON):
         if units == DistanceUnits.MILLIMETERS: pos *= 1e3
         elif units == DistanceUnits.MICRON: pass
         else: raise ValueError("Distance units not recognized")
 
-        if movement   == Movement.ABSOLUTE: caput(motor + ".VAL", pos)
-        elif movement == Movement.RELATIVE: caput(motor + ".RLV", pos)
-        else: raise ValueError("Movement not recognized")
+        move_records(self.__pvs, {motor : (self.__get_movement_field(movement), pos)})
 
-    @classmethod
-    def __move_rotational_motor(cls, motor, angle, movement=Movement.ABSOLUTE, units=AngularUnits.MILLIRADIANS):
+    def __move_rotational_motor(self, motor, angle, movement=Movement.ABSOLUTE, units=AngularUnits.MILLIRADIANS):
         if units == AngularUnits.MILLIRADIANS: pass
         elif units == AngularUnits.DEGREES:    angle = 1e3 * numpy.radians(angle)
         elif units == AngularUnits.RADIANS:    angle = 1e3 * angle
         else: raise ValueError("Angular units not recognized")
 
-        if movement   == Movement.ABSOLUTE: caput(motor + ".VAL", angle)
-        elif movement == Movement.RELATIVE: caput(motor + ".RLV", angle)
-        else:  raise ValueError("Movement not recognized")
+        move_records(self.__pvs, {motor : (self.__get_movement_field(movement), angle)})
 
-    @classmethod
-    def __get_translational_motor_position(cls, motor, units=DistanceUnits.MICRON):
-        if units == DistanceUnits.MICRON:        return caget(motor + ".VAL")
-        elif units == DistanceUnits.MILLIMETERS: return 1e-3*caget(motor + ".VAL")
+    def __get_translational_motor_position(self, motor, units=DistanceUnits.MICRON):
+        if units == DistanceUnits.MICRON:        return self.__pvs.get(motor + ".VAL")
+        elif units == DistanceUnits.MILLIMETERS: return 1e-3*self.__pvs.get(motor + ".VAL")
         else: raise ValueError("Distance units not recognized")
 
-    @classmethod
-    def __get_rotational_motor_angle(cls, motor, units=AngularUnits.MILLIRADIANS):
-        if units == AngularUnits.MILLIRADIANS:  return caget(motor)
-        elif units == AngularUnits.DEGREES:     return numpy.degrees(caget(motor)*1e-3)
-        elif units == AngularUnits.RADIANS:     return caget(motor)*1e-3
+    def __get_rotational_motor_angle(self, motor, units=AngularUnits.MILLIRADIANS):
+        if units == AngularUnits.MILLIRADIANS:  return self.__pvs.get(motor + ".VAL")
+        elif units == AngularUnits.DEGREES:     return numpy.degrees(self.__pvs.get(motor + ".VAL")*1e-3)
+        elif units == AngularUnits.RADIANS:     return self.__pvs.get(motor + ".VAL")*1e-3
         else: raise ValueError("Angular units not recognized")
 
         
@@ -222,20 +236,56 @@ class __EpicsFocusingOptics(AbstractHardwareFocusingOptics):
         except: direction = Directions.BOTH
         try:    parameters = kwargs["parameters"]
         except: parameters = [[-2, 2, 40], [-2, 2, 40]] if direction==Directions.BOTH else [-2, 2, 40]
-        
+        try:    scan_mode = kwargs["scan_mode"]
+        except: scan_mode = ScanMode.STEP
+        try:    exposure_time = kwargs["exposure_time"]
+        except: exposure_time = 0.3
+        try:    n_frames = kwargs["n_frames"]
+        except: n_frames = 1
+
+        # single image: same output of the analysis of the simulated beams (get_info)
+        if scan_mode == ScanMode.IMAGE:
+            try:    pixel_size = kwargs["pixel_size"]
+            except: pixel_size = Image.PIXEL_SIZE[self.__beamline]
+            try:    roi = kwargs["roi"]
+            except: roi = None
+            try:    background = kwargs["background"]
+            except: background = None
+            try:    do_gaussian_fit = kwargs["do_gaussian_fit"]
+            except: do_gaussian_fit = False
+
+            return self.__get_image_info(exposure_time, n_frames, pixel_size, roi, background, do_gaussian_fit)
+
+        if scan_mode == ScanMode.STEP:  scan = self.__step_scan
+        elif scan_mode == ScanMode.FLY: scan = self.__fly_scan
+        else: raise ValueError("Scan mode not recognized")
+
         data_h = None
         data_v = None
         
-        if direction == Directions.HORIZONTAL: data_h = self.__scan(Motors.SAMPLE_STAGE_X[self.__beamline], parameters[0], parameters[1], parameters[2])
-        elif direction == Directions.VERTICAL: data_v = self.__scan(Motors.SAMPLE_STAGE_Z[self.__beamline], parameters[0], parameters[1], parameters[2])
+        if direction == Directions.HORIZONTAL: data_h = scan(Motors.SAMPLE_STAGE_X[self.__beamline], parameters[0], parameters[1], parameters[2], exposure_time, n_frames)
+        elif direction == Directions.VERTICAL: data_v = scan(Motors.SAMPLE_STAGE_Z[self.__beamline], parameters[0], parameters[1], parameters[2], exposure_time, n_frames)
         elif direction == Directions.BOTH:
-            data_h = self.__scan(Motors.SAMPLE_STAGE_X[self.__beamline], parameters[0][0], parameters[0][1], parameters[0][2])
-            data_v = self.__scan(Motors.SAMPLE_STAGE_Z[self.__beamline], parameters[1][0], parameters[1][1], parameters[1][2])
+            data_h = scan(Motors.SAMPLE_STAGE_X[self.__beamline], parameters[0][0], parameters[0][1], parameters[0][2], exposure_time, n_frames)
+            data_v = scan(Motors.SAMPLE_STAGE_Z[self.__beamline], parameters[1][0], parameters[1][1], parameters[1][2], exposure_time, n_frames)
         
         return data_h, data_v
 
-    def __scan(self, motor_name, first, final, steps):
-        current = caget(motor_name + ".VAL")
+    def __get_image_info(self, exposure_time, n_frames, pixel_size, roi, background, do_gaussian_fit):
+        if pixel_size is None: raise ValueError("Pixel size of the detector not known: pixel_size is needed")
+
+        DETECTOR = Scan.DETECTOR[self.__beamline]
+        PLUGIN   = Image.PLUGIN[self.__beamline]
+
+        self.__pvs.add_image(PLUGIN) # on first use: the image plugin is not needed by the scans
+        self.__pvs.put(Scan.SHUTTER[self.__beamline], 1)
+
+        image = acquire_image(self.__pvs, DETECTOR, PLUGIN, n_frames=n_frames, exposure_time=exposure_time)
+
+        return get_image_info(image, pixel_size, roi, background, do_gaussian_fit)
+
+    def __step_scan(self, motor_name, first, final, steps, exposure_time, n_frames):
+        current = self.__pvs.get(motor_name + ".VAL")
         stepsize = (final - first) / float(steps)
         first = current + first
 
@@ -244,21 +294,92 @@ class __EpicsFocusingOptics(AbstractHardwareFocusingOptics):
         DETECTOR = Scan.DETECTOR[self.__beamline]
         COUNTS   = Scan.COUNTS[self.__beamline]
 
-        caput(Scan.SHUTTER[self.__beamline], 1)
-        caput(DETECTOR + ':AcquireTime', 0.3)
+        self.__pvs.put(Scan.SHUTTER[self.__beamline], 1)
 
         for i in range(steps):
-            caput(motor_name + ".VAL", first + i * stepsize)
-            caput(DETECTOR + ':Acquire', 1)
+            move_records(self.__pvs, {motor_name : (".VAL", first + i * stepsize)})
 
-            time.sleep(0.2)
-
-            while (caget(DETECTOR + ':Acquire') != 0): time.sleep(0.1)
-    
             data[i, 0] = i * stepsize + first
-            data[i, 1] = caget(COUNTS)
+            data[i, 1] = acquire_counts(self.__pvs, DETECTOR, COUNTS, n_frames=n_frames, exposure_time=exposure_time)
+
+        # put the motor on the peak!
+        move_records(self.__pvs, {motor_name : (".VAL", data[numpy.argmax(data[:, 1]), 0])})
+
+        return data
+
+    def __fly_scan(self, motor_name, first, final, steps, exposure_time, n_frames):
+        '''
+        same points of the step scan: the stage moves continuously, one step per n_frames exposures, while the detector
+        acquires continuously. The frames are placed at the stage position in the middle of their exposure
+        (monitored readback and plugin counter, timestamped at arrival) and averaged in the bins of the points.
+        The counts are matched to the frames as in the acquisition (get_frame_counts).
+        '''
+        current  = self.__pvs.get(motor_name + ".VAL")
+        stepsize = (final - first) / float(steps)
+        first    = current + first
+
+        data = numpy.zeros((steps, 2), float)
+        data[:, 0] = first + numpy.arange(steps) * stepsize
+
+        DETECTOR       = Scan.DETECTOR[self.__beamline]
+        COUNTS         = Scan.COUNTS[self.__beamline]
+        COUNTS_COUNTER = get_plugin_counter(COUNTS)
+
+        frames         = [] # (arrival time, IOC timestamp), one per frame
+        totals         = [] # (IOC timestamp, counts), only when the counts change
+        stage_track    = [] # (arrival time, position)
+        velocity       = self.__pvs.get(motor_name + ".VELO")
+        image_mode     = self.__pvs.get(DETECTOR + ':ImageMode')
+        counter_index  = self.__pvs.add_callback(COUNTS_COUNTER, lambda timestamp=None, **kwargs: frames.append((time.monotonic(), timestamp)))
+        counts_index   = self.__pvs.add_callback(COUNTS, lambda value=None, timestamp=None, **kwargs: totals.append((timestamp, value)))
+        position_index = self.__pvs.add_callback(motor_name + ".RBV", lambda value=None, **kwargs: stage_track.append((time.monotonic(), value)))
+
+        self.__pvs.put(Scan.SHUTTER[self.__beamline], 1)
+        self.__pvs.put(DETECTOR + ':AcquireTime', exposure_time)
+        self.__pvs.put(DETECTOR + ':ImageMode', ImageMode.CONTINUOUS)
+
+        try:
+            # from half a step before the first point to half a step after the last one
+            move_records(self.__pvs, {motor_name : (".VAL", data[0, 0] - 0.5*stepsize)})
+            self.__pvs.put(motor_name + ".VELO", abs(stepsize) / (n_frames*exposure_time))
+
+            stage_track.append((time.monotonic(), self.__pvs.get(motor_name + ".RBV")))
+            frames.clear()
+            totals.clear()
+            totals.append((-numpy.inf, self.__pvs.get(COUNTS))) # the first frames may not change the counts
+
+            self.__pvs.put(DETECTOR + ':Acquire', 1)
+            move_records(self.__pvs, {motor_name : (".VAL", data[-1, 0] + 0.5*stepsize)}, timeout=MOVE_TIMEOUT + (steps + 1)*n_frames*exposure_time)
+            self.__pvs.put(DETECTOR + ':Acquire', 0)
+            time.sleep(exposure_time) # the frame in progress ends after the stop
+
+            stage_track.append((time.monotonic(), self.__pvs.get(motor_name + ".RBV")))
+        finally:
+            self.__pvs.remove_callback(COUNTS_COUNTER, counter_index)
+            self.__pvs.remove_callback(COUNTS, counts_index)
+            self.__pvs.remove_callback(motor_name + ".RBV", position_index)
+            self.__pvs.put(motor_name + ".VELO", velocity)
+            self.__pvs.put(DETECTOR + ':ImageMode', image_mode)
+
+        if len(frames) == 0: raise RuntimeError("No frames acquired during the fly scan of " + motor_name)
+
+        stage_track     = numpy.array(sorted(stage_track))
+        frames          = numpy.array(frames)
+        frame_counts    = get_frame_counts(frames[:, 1], totals, exposure_time)
+        frame_positions = numpy.interp(frames[:, 0] - 0.5*exposure_time, stage_track[:, 0], stage_track[:, 1])
+        frame_bins      = numpy.rint((frame_positions - data[0, 0]) / stepsize).astype(int)
+        in_scan         = numpy.logical_and(frame_bins >= 0, frame_bins < steps)
+
+        counts           = numpy.bincount(frame_bins[in_scan], weights=frame_counts[in_scan], minlength=steps)
+        frames_per_point = numpy.bincount(frame_bins[in_scan], minlength=steps)
+        filled           = frames_per_point > 0
+
+        # points without frames (detector slower than the stage) are interpolated
+        data[filled, 1]  = counts[filled] / frames_per_point[filled]
+        data[~filled, 1] = numpy.interp(data[~filled, 0], frame_positions, frame_counts) if stepsize > 0 else \
+                           numpy.interp(data[~filled, 0], frame_positions[::-1], frame_counts[::-1])
 
         # put the motor on the peak!
-        caput(motor_name + ".VAL", data[numpy.argmax(data[:, 1]), 0])
+        move_records(self.__pvs, {motor_name : (".VAL", data[numpy.argmax(data[:, 1]), 0])})
 
         return data
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+
+from beamline34IDC.hardware.epics.acquisition import acquire_frames
+
+#############################################################################
+# Images of the area detector, from the image plugin: the flat waveform
+# (ArrayData) is reshaped with the size PVs into a 2D array (rows: vertical,
+# columns: horizontal) without copies.
+#
+# Large images need EPICS_CA_MAX_ARRAY_BYTES in the client (and in the IOC)
+# larger than the array, e.g. 4 * width * height for 32-bit pixels.
+#
+
+def read_image(pvs, plugin, timeout=None):
+    '''
+    the last image of the plugin, as a view on the waveform
+    '''
+    n_dimensions = pvs.get(plugin + ":NDimensions_RBV")
+    if n_dimensions != 2: raise ValueError("Only 2D (mono) images are supported: " + plugin + " has " + str(n_dimensions) + " dimensions")
+
+    size_h = int(pvs.get(plugin + ":ArraySize0_RBV"))
+    size_v = int(pvs.get(plugin + ":ArraySize1_RBV"))
+
+    data = pvs.get_pv(plugin + ":ArrayData").get(count=size_h * size_v, as_numpy=True, timeout=timeout)
+    if data is None: raise TimeoutError("No value from " + plugin + ":ArrayData")
+
+    return numpy.asarray(data).reshape((size_v, size_h))
+
+def acquire_image(pvs, detector, plugin, n_frames=1, exposure_time=None, timeout=None):
+    '''
+    pvs: PVRegistry, with the detector and the image plugin added (add_detector, add_image)
+    returns the image of one acquisition, or the average of n_frames acquisitions
+    '''
+    acquire_frames(pvs, detector, plugin + ":ArrayCounter_RBV", 1, exposure_time, timeout)
+    if n_frames == 1: return read_image(pvs, plugin, timeout)
+
+    image = read_image(pvs, plugin, timeout).astype(float)
+    for _ in range(n_frames - 1):
+        acquire_frames(pvs, detector, plugin + ":ArrayCounter_RBV", 1, exposure_time, timeout)
+        image += read_image(pvs, plugin, timeout)
+
+    return image / n_frames
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import time
+import threading
+
+#############################################################################
+# Concurrent motion of motor records: all the puts are issued at once, then
+# the end of every motion is tracked by the monitor of its .DMOV (done moving)
+# field, so several motors take the time of the slowest one.
+#
+
+MOVE_TIMEOUT       = 60.0 # s
+DMOV_START_TIMEOUT = 0.2  # s: a motor already at the target may not report a motion
+
+class _Motion():
+    def __init__(self, record):
+        self.record      = record
+        self.start_time  = None
+        self.settle_time = None
+        self.started     = False
+        self.done        = threading.Event()
+
+    def on_done_moving(self, value=None, **kwargs):
+        if value == 0:
+            self.started = True
+        elif value == 1 and self.started and not self.done.is_set():
+            self.settle_time = time.monotonic() - self.start_time
+            self.done.set()
+
+def move_records(pvs, moves, timeout=MOVE_TIMEOUT):
+    '''
+    pvs: PVRegistry
+    moves: {motor record: (field, value)}, with field ".VAL" (absolute) or ".RLV" (relative)
+    returns {motor record: settle time [s]}, from the put to the end of the motion.
+    raises TimeoutError if some motors are still moving after timeout
+    '''
+    motions   = dict([(record, _Motion(record)) for record in moves.keys()])
+    callbacks = dict([(record, pvs.add_callback(record + ".DMOV", motion.on_done_moving)) for record, motion in motions.items()])
+
+    try:
+        for record, (field, value) in moves.items():
+            motions[record].start_time = time.monotonic()
+            pvs.put(record + field, value)
+
+        deadline = time.monotonic() + timeout
+
+        for record, motion in motions.items():
+            if motion.done.wait(timeout=min(DMOV_START_TIMEOUT, max(deadline - time.monotonic(), 0.0))): continue
+
+            if not motion.started and pvs.get(record + ".DMOV") == 1:
+                motion.settle_time = time.monotonic() - motion.start_time
+                motion.done.set()
+            else:
+                motion.done.wait(timeout=max(deadline - time.monotonic(), 0.0))
+
+        still_moving = [record for record, motion in motions.items() if not motion.done.is_set()]
+        if len(still_moving) > 0: raise TimeoutError("Motors still moving after " + str(timeout) + " s: " + ", ".join(still_moving))
+
+        return dict([(record, motion.settle_time) for record, motion in motions.items()])
+    finally:
+        for record, index in callbacks.items(): pvs.remove_callback(record + ".DMOV", index)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import time
+import threading
+
+from epics import PV
+
+#############################################################################
+# Persistent Channel Access connections: one epics.PV per process variable,
+# created (and connected) once and reused by every get and put, instead of the
+# search and connection paid by each caget/caput.
+#
+# Monitored PVs (readbacks, done-moving and detector state) are served from the
+# latest value received from the IOC. After a put to a record, its monitored
+# fields are read from the IOC until a newer monitor event arrives, so a get
+# never returns a value older than the last put.
+#
+
+# fields of the motor records
+MOTOR_FIELDS           = [".VAL", ".RLV", ".RBV", ".DMOV", ".VELO"]
+MONITORED_MOTOR_FIELDS = [".VAL", ".RBV", ".DMOV"]
+
+class PVRegistry():
+    def __init__(self, connection_timeout=5.0, timeout=5.0):
+        self.__connection_timeout = connection_timeout
+        self.__timeout            = timeout
+        self.__pvs                = {}
+        self.__last_update        = {} # name   -> local time of the last monitor event
+        self.__last_put           = {} # record -> local time of the last put
+        self.__lock               = threading.Lock()
+
+    def add(self, name, monitor=False):
+        '''
+        the PV of name, created on first use
+        '''
+        with self.__lock:
+            try:
+                pv = self.__pvs[name]
+
+                if monitor and not pv.auto_monitor: raise ValueError(name + " is already registered without monitor")
+            except KeyError:
+                pv = PV(name, auto_monitor=monitor, connection_timeout=self.__connection_timeout)
+                if monitor: pv.add_callback(self.__on_monitor_event)
+                self.__pvs[name] = pv
+
+            return pv
+
+    def add_motor(self, motor):
+        for field in MOTOR_FIELDS: self.add(motor + field, monitor=field in MONITORED_MOTOR_FIELDS)
+
+    def add_detector(self, detector, counts):
+        self.add(detector + ":Acquire", monitor=True)
+        self.add(detector + ":AcquireTime")
+        self.add(detector + ":ImageMode")
+        self.add(detector + ":NumImages")
+        self.add(detector + ":ArrayCounter_RBV", monitor=True)
+        self.add(counts, monitor=True)
+        self.add(get_plugin_counter(counts), monitor=True)
+
+    def add_image(self, plugin):
+        self.add(plugin + ":ArrayData") # waveform: read on demand
+        self.add(plugin + ":NDimensions_RBV")
+        self.add(plugin + ":ArraySize0_RBV")
+        self.add(plugin + ":ArraySize1_RBV")
+        self.add(plugin + ":ArrayCounter_RBV", monitor=True)
+
+    def add_callback(self, name, callback):
+        '''
+        callback(pvname=..., value=..., ...) on every monitor event of name: returns the index to remove it
+        '''
+        return self.add(name, monitor=True).add_callback(callback)
+
+    def remove_callback(self, name, index):
+        self.add(name).remove_callback(index)
+
+    def get_pv(self, name):
+        return self.add(name)
+
+    def get_names(self):
+        with self.__lock: return sorted(self.__pvs.keys())
+
+    def wait_for_connection(self, timeout=None):
+        '''
+        raises ConnectionError with the names of the PVs not connected within timeout
+        '''
+        timeout = self.__connection_timeout if timeout is None else timeout
+
+        with self.__lock: pvs = list(self.__pvs.values())
+
+        deadline = time.monotonic() + timeout
+        for pv in pvs: pv.wait_for_connection(timeout=max(deadline - time.monotonic(), 0.0))
+
+        not_connected = [pv.pvname for pv in pvs if not pv.connected]
+        if len(not_connected) > 0: raise ConnectionError("PVs not connected: " + ", ".join(not_connected))
+
+    def get(self, name, timeout=None):
+        pv = self.add(name)
+
+        value = pv.get(timeout=self.__timeout if timeout is None else timeout, use_monitor=self.__is_monitor_current(pv))
+        if value is None: raise TimeoutError("No value from " + name)
+
+        return value
+
+    def put(self, name, value, wait=False, timeout=None, callback=None, callback_data=None):
+        '''
+        wait: blocks until the put is completed by the IOC (e.g. the end of a motion)
+        callback: called by the completion of the put, as callback(pvname=name, data=callback_data)
+        '''
+        pv = self.add(name)
+
+        self.__last_put[_get_record(name)] = time.monotonic()
+
+        return pv.put(value, wait=wait, timeout=self.__timeout if timeout is None else timeout,
+                      use_complete=not callback is None, callback=callback, callback_data=callback_data)
+
+    def disconnect(self):
+        with self.__lock:
+            for pv in self.__pvs.values(): pv.disconnect()
+
+            self.__pvs = {}
+            self.__last_update = {}
+            self.__last_put = {}
+
+    def __on_monitor_event(self, pvname=None, **kwargs):
+        self.__last_update[pvname] = time.monotonic()
+
+    def __is_monitor_current(self, pv):
+        if not pv.auto_monitor: return False
+
+        return self.__last_update.get(pv.pvname, -1.0) > self.__last_put.get(_get_record(pv.pvname), -1.0)
+
+def _get_record(name):
+    return name.split(".")[0]
+
+def get_plugin_counter(name):
+    '''
+    ArrayCounter_RBV of the areaDetector plugin of name (e.g. Stats5:Total_RBV -> Stats5:ArrayCounter_RBV): it posts
+    an event for every frame processed by the plugin, while the other readbacks post only the ones that change
+    '''
+    return name[:name.rindex(":")] + ":ArrayCounter_RBV"
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import math
+import types
+import asyncio
+import numpy
+
+from caproto.server import PVGroup, SubGroup, pvproperty, ioc_arg_parser, run
+
+from beamline34IDC.hardware.facade import Beamline
+from beamline34IDC.hardware.epics.pv_names import Scan, Motors, ImageMode, Image
+
+#############################################################################
+# Soft IOC (caproto) serving the process variables of the virtual beamline
+# (Beamline.VIRTUAL), to run the EPICS focusing optics offline:
+#
+#     python -m beamline34IDC.hardware.epics.simulated_ioc --list-pvs
+#
+# and, in the client, EPICS_CA_ADDR_LIST=127.0.0.1 EPICS_CA_AUTO_ADDR_LIST=NO.
+#
+# Motors move at .VELO, updating .RBV every UPDATE_PERIOD and clearing .DMOV
+# during the motion. The detector counts (Stats5:Total_RBV) are a gaussian
+# beam at the position of the sample stage, integrated over the exposure, and
+# the image (image1:ArrayData) is the same beam on a camera at the sample.
+#
+
+UPDATE_PERIOD = 0.01 # s
+IMAGE_SIZE    = (128, 96) # pixels, h x v (image1:ArrayData, 32-bit)
+
+# motor units per second
+DEFAULT_VELOCITIES = {"COH_SLITS" : 100.0, # micron
+                      "MOTOR_1"   : 50.0,  # bender, micron
+                      "MOTOR_2"   : 50.0,  # bender, micron
+                      "MOTOR_3"   : 0.5,   # pitch, mrad
+                      "MOTOR_4"   : 50.0,  # translation, micron
+                      "SAMPLE"    : 1.0}   # mm
+
+class SimulatedMotor(PVGroup):
+    val  = pvproperty(name=".VAL",  value=0.0, precision=5)
+    rlv  = pvproperty(name=".RLV",  value=0.0, precision=5)
+    rbv  = pvproperty(name=".RBV",  value=0.0, precision=5, read_only=True)
+    dmov = pvproperty(name=".DMOV", value=1, read_only=True)
+    velo = pvproperty(name=".VELO", value=1.0, precision=5)
+
+    def __init__(self, *args, velocity=1.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__velocity = velocity
+        self.__motion   = None
+
+    @velo.startup
+    async def velo(self, instance, async_lib):
+        await instance.write(self.__velocity)
+
+    @val.putter
+    async def val(self, instance, value):
+        if not self.__motion is None: self.__motion.cancel()
+        self.__motion = asyncio.get_running_loop().create_task(self.__move(value))
+
+        return value
+
+    @rlv.putter
+    async def rlv(self, instance, value):
+        await self.val.write(self.val.value + value)
+
+        return 0.0
+
+    def get_position(self):
+        return self.rbv.value
+
+    async def __move(self, target):
+        await self.dmov.write(0)
+
+        position = self.rbv.value
+        step     = max(abs(self.velo.value), 1e-12) * UPDATE_PERIOD
+
+        while position != target:
+            position = target if abs(target - position) <= step else position + math.copysign(step, target - position)
+
+            await asyncio.sleep(UPDATE_PERIOD)
+            await self.rbv.write(position)
+
+        await self.dmov.write(1)
+
+class SimulatedDetector(PVGroup):
+    acquire       = pvproperty(name="cam1:Acquire", value=0)
+    acquire_time  = pvproperty(name="cam1:AcquireTime", value=0.3, precision=3)
+    image_mode    = pvproperty(name="cam1:ImageMode", value=ImageMode.SINGLE)
+    num_images    = pvproperty(name="cam1:NumImages", value=1)
+    array_counter = pvproperty(name="cam1:ArrayCounter_RBV", value=0, read_only=True)
+    total         = pvproperty(name="Stats5:Total_RBV", value=0.0, precision=1, read_only=True)
+    stats_counter = pvproperty(name="Stats5:ArrayCounter_RBV", value=0, read_only=True)
+    n_dimensions  = pvproperty(name="image1:NDimensions_RBV", value=2, read_only=True)
+    image_size_h  = pvproperty(name="image1:ArraySize0_RBV", value=IMAGE_SIZE[0], read_only=True)
+    image_size_v  = pvproperty(name="image1:ArraySize1_RBV", value=IMAGE_SIZE[1], read_only=True)
+    image_counter = pvproperty(name="image1:ArrayCounter_RBV", value=0, read_only=True)
+    image_data    = pvproperty(name="image1:ArrayData", value=[0] * (IMAGE_SIZE[0] * IMAGE_SIZE[1]), dtype=int, read_only=True)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__exposure = None
+
+    @acquire.putter
+    async def acquire(self, instance, value):
+        if value == 1 and (self.__exposure is None or self.__exposure.done()):
+            self.__exposure = asyncio.get_running_loop().create_task(self.__expose())
+
+        return value
+
+    async def __expose(self):
+        # Single: one frame, Multiple: NumImages frames, Continuous: until Acquire is put to 0
+        if   self.image_mode.value == ImageMode.SINGLE:   n_images = 1
+        elif self.image_mode.value == ImageMode.MULTIPLE: n_images = max(self.num_images.value, 1)
+        else:                                             n_images = None
+
+        n_acquired = 0
+        while self.acquire.value == 1 and (n_images is None or n_acquired < n_images):
+            await self.__expose_frame()
+            n_acquired += 1
+
+        await self.acquire.write(0)
+
+    async def __expose_frame(self):
+        # counts integrated over the exposure: average of the rates at the start, middle and end
+        exposure_time = max(self.acquire_time.value, 0.0)
+
+        rates = [self.parent.get_counts()]
+        for _ in range(2):
+            await asyncio.sleep(exposure_time / 2)
+            rates.append(self.parent.get_counts())
+
+        # as the asyn records of areaDetector, Total_RBV posts a monitor event only when it changes: the counter always does
+        total = exposure_time * (rates[0] + 4 * rates[1] + rates[2]) / 6
+        if total != self.total.value: await self.total.write(total)
+        await self.array_counter.write(self.array_counter.value + 1)
+        await self.stats_counter.write(self.stats_counter.value + 1)
+        await self.image_data.write(self.parent.get_image(exposure_time).ravel().tolist())
+        await self.image_counter.write(self.image_counter.value + 1)
+
+class _SimulatedBeamline(PVGroup):
+    '''
+    beam: peak rate [counts/s], background rate [counts/s], sigma h and v [mm] at the sample stage;
+    the KB pitches move the centroid by beam_offset_per_mrad [mm]
+    '''
+    shutter = pvproperty(name=Scan.SHUTTER[Beamline.VIRTUAL], value=0)
+
+    def __init__(self, *args, peak_rate=1e6, background_rate=1e2, sigma_h=0.5, sigma_v=0.3, beam_offset_per_mrad=1.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__peak_rate            = peak_rate
+        self.__background_rate      = background_rate
+        self.__sigma_h              = sigma_h
+        self.__sigma_v              = sigma_v
+        self.__beam_offset_per_mrad = beam_offset_per_mrad
+
+    def get_motor(self, name):
+        return getattr(self, name.lower())
+
+    def get_counts(self):
+        x = self.get_motor("SAMPLE_STAGE_X").get_position() - self.__get_centroid_h()
+        z = self.get_motor("SAMPLE_STAGE_Z").get_position() - self.__get_centroid_v()
+
+        return self.__background_rate + self.__peak_rate * math.exp(-0.5 * ((x / self.__sigma_h) ** 2 + (z / self.__sigma_v) ** 2))
+
+    def get_image(self, exposure_time):
+        # camera centered on the beam axis, counts per pixel at the end of the exposure (rows: vertical)
+        pixel_size = Image.PIXEL_SIZE[Beamline.VIRTUAL]
+        x          = (numpy.arange(IMAGE_SIZE[0]) - 0.5 * (IMAGE_SIZE[0] - 1)) * pixel_size - self.__get_centroid_h()
+        z          = (numpy.arange(IMAGE_SIZE[1]) - 0.5 * (IMAGE_SIZE[1] - 1)) * pixel_size - self.__get_centroid_v()
+        rates      = self.__background_rate + self.__peak_rate * numpy.exp(-0.5 * ((x[numpy.newaxis, :] / self.__sigma_h) ** 2 +
+                                                                                  (z[:, numpy.newaxis] / self.__sigma_v) ** 2))
+
+        return numpy.rint(exposure_time * rates).astype(int)
+
+    def __get_centroid_h(self):
+        return self.__beam_offset_per_mrad * self.get_motor("HKB_MOTOR_3").get_position()
+
+    def __get_centroid_v(self):
+        return self.__beam_offset_per_mrad * self.get_motor("VKB_MOTOR_3").get_position()
+
+def __get_default_velocity(motor_name):
+    for key, velocity in DEFAULT_VELOCITIES.items():
+        if key in motor_name: return velocity
+
+    return 1.0
+
+def __add_subgroups(namespace):
+    for motor_name in [name for name in vars(Motors).keys() if not name.startswith("_")]:
+        namespace[motor_name.lower()] = SubGroup(SimulatedMotor, prefix=getattr(Motors, motor_name)[Beamline.VIRTUAL],
+                                                 velocity=__get_default_velocity(motor_name))
+
+    detector = Scan.DETECTOR[Beamline.VIRTUAL]
+    if not detector.endswith(":cam1") or Scan.COUNTS[Beamline.VIRTUAL] != detector[:-len("cam1")] + "Stats5:Total_RBV" or \
+            Image.PLUGIN[Beamline.VIRTUAL] != detector[:-len("cam1")] + "image1":
+        raise ValueError("Detector PVs do not match the simulated detector")
+
+    namespace["detector"] = SubGroup(SimulatedDetector, prefix=detector[:-len("cam1")])
+
+# the motors and the detector, from the PV names of the virtual beamline
+SimulatedBeamline = types.new_class("SimulatedBeamline", (_SimulatedBeamline,), exec_body=__add_subgroups)
+
+def create_simulated_beamline(**kwargs):
+    return SimulatedBeamline(prefix="", **kwargs)
+
+if __name__ == "__main__":
+    ioc_options, run_options = ioc_arg_parser(default_prefix="", desc="Simulated 34-ID-C focusing optics and detector")
+
+    run(create_simulated_beamline().pvdb, **run_options)
@@ -46,8 +46,6 @@
 # ----------------------------------------------------------------------- #
 
 from beamline34IDC.hardware.facade import Implementors
-from beamline34IDC.hardware.epics.focusing_optics import epics_focusing_optics_factory_method
-from beamline34IDC.hardware.bluesky.focusing_optics import bluesky_focusing_optics_factory_method
 
 from beamline34IDC.util.initializer import register_ini_instance, AlreadyInitializedError, IniMode
 #############################################################################
@@ -55,6 +53,13 @@ from beamline34IDC.util.initializer import register_ini_instance, AlreadyInitial
 #
 
 def hardware_focusing_optics_factory_method(implementor=Implementors.EPICS, **kwargs):
-    if implementor==Implementors.EPICS: return epics_focusing_optics_factory_method(**kwargs)
-    elif implementor==Implementors.BLUESKY:  return bluesky_focusing_optics_factory_method(**kwargs)
+    # the implementors are imported on first use: the simulation does not load EPICS and Bluesky
+    if implementor==Implementors.EPICS:
+        from beamline34IDC.hardware.epics.focusing_optics import epics_focusing_optics_factory_method
+
+        return epics_focusing_optics_factory_method(**kwargs)
+    elif implementor==Implementors.BLUESKY:
+        from beamline34IDC.hardware.bluesky.focusing_optics import bluesky_focusing_optics_factory_method
+
+        return bluesky_focusing_optics_factory_method(**kwargs)
     else: raise ValueError("Implementor not recognized")
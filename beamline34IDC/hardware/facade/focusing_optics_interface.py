@@ -54,7 +54,15 @@ class Directions:
     VERTICAL = 1
     BOTH = 2
 
+class ScanMode:
+    STEP = 0 # step and shoot
+    FLY  = 1 # continuous motion of the sample stage
+    IMAGE = 2 # single acquisition of the area detector image, no scan
+
 class AbstractHardwareFocusingOptics(AbstractFocusingOptics):
     def initialize(self, **kwargs): raise NotImplementedError()
 
+    # {motor: position}: the motors move together, returns {motor: settle time}
+    def move_many(self, positions, movement=Movement.ABSOLUTE, **kwargs): raise NotImplementedError()
+
     def get_photon_beam(self, **kwargs): raise NotImplementedError()
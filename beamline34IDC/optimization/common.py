@@ -49,9 +49,11 @@ from beamline34IDC.simulation.facade import Implementors
 from beamline34IDC.simulation.facade.focusing_optics_factory import simulated_focusing_optics_factory_method
 from beamline34IDC.util.shadow.common import get_shadow_beam_spatial_distribution,\
     load_shadow_beam, PreProcessorFiles, EmptyBeamException
-from beamline34IDC.util import clean_up
+from beamline34IDC.util.profiling import get_profiler, active_profiler
 import numpy as np
 import abc
+import threading
+import weakref
 from beamline34IDC.optimization import movers, configs
 from typing import Callable, NoReturn, Tuple, List, NamedTuple
 
@@ -63,14 +65,19 @@ class BeamParameterOutput(NamedTuple):
     dw: object
 
 
-def reinitialize(input_beam_path: str, bender: bool = True) -> object:
-    clean_up()
+def reinitialize(input_beam_path: str, bender: bool = True, pool: object = None) -> object:
+    # with a FocusingOpticsPool, an idle system in its initial state (release it to the pool when done)
+    if pool is not None:
+        return pool.acquire(input_photon_beam_file_name=input_beam_path, implementor=Implementors.SHADOW, bender=bender)
+
+    # the files written by the simulation go in a private workspace, removed by focusing_system.close()
     input_beam = load_shadow_beam(input_beam_path)
     focusing_system = simulated_focusing_optics_factory_method(implementor=Implementors.SHADOW, bender=bender)
 
     focusing_system.initialize(input_photon_beam=input_beam,
                                rewrite_preprocessor_files=PreProcessorFiles.NO,
-                               rewrite_height_error_profile_files=False)
+                               rewrite_height_error_profile_files=False,
+                               workspace=True)
     return focusing_system
 
 
@@ -108,7 +115,7 @@ def get_peak_intensity(focusing_system: object = None, photon_beam: object = Non
         return BeamParameterOutput(out_of_bounds_value, None, None, None)
 
     hist, dw = get_shadow_beam_spatial_distribution(photon_beam)
-    peak = dw.get_parameter('peak_intensity')
+    peak = _peak_intensity(hist, dw)
     return BeamParameterOutput(peak, photon_beam, hist, dw)
 
 
@@ -120,9 +127,7 @@ def get_centroid_distance(focusing_system: object = None, photon_beam: object =
         return BeamParameterOutput(out_of_bounds_value, None, None, None)
 
     hist, dw = get_shadow_beam_spatial_distribution(photon_beam)
-    h_centroid = dw.get_parameter('h_centroid')
-    v_centroid = dw.get_parameter('v_centroid')
-    centroid_distance = (h_centroid ** 2 + v_centroid ** 2) ** 0.5
+    centroid_distance = _centroid_distance(hist, dw)
     return BeamParameterOutput(centroid_distance, photon_beam, hist, dw)
 
 
@@ -134,10 +139,120 @@ def get_fwhm(focusing_system: object = None, photon_beam: object = None,
         return BeamParameterOutput(out_of_bounds_value, None, None, None)
 
     hist, dw = get_shadow_beam_spatial_distribution(photon_beam)
+    fwhm = _fwhm(hist, dw)
+    return BeamParameterOutput(fwhm, photon_beam, hist, dw)
+
+
+def get_loss(loss_parameters: List[str], loss_weights: List[float] = None,
+             focusing_system: object = None, photon_beam: object = None,
+             random_seed: float = None, out_of_bounds_value: float = 1e4) -> BeamParameterOutput:
+    """Weighted sum of the registered loss terms, from a single trace and a single histogram."""
+
+    loss_parameters = np.atleast_1d(loss_parameters)
+    loss_weights = np.ones(len(loss_parameters)) if loss_weights is None else np.atleast_1d(loss_weights)
+    for loss_type in loss_parameters:
+        if loss_type not in LOSS_TERMS: raise ValueError("Supplied loss parameter is not valid.")
+
+    photon_beam = check_beam_out_of_bounds(focusing_system, photon_beam, random_seed)
+    if photon_beam is None:
+        return BeamParameterOutput(out_of_bounds_value, None, None, None)
+
+    hist, dw = get_shadow_beam_spatial_distribution(photon_beam)
+    loss = np.sum([weight * LOSS_TERMS[loss_type].function(hist, dw)
+                   for loss_type, weight in zip(loss_parameters, loss_weights)])
+    return BeamParameterOutput(loss, photon_beam, hist, dw)
+
+
+def evaluate_positions(focusing_system: object, initial_motor_state: dict, motor_types: List[str],
+                       absolute_positions: List[float], loss_parameters: List[str], loss_weights: List[float] = None,
+                       random_seed: float = None, out_of_bounds_value: float = 1e4,
+                       keep_positions: bool = False) -> BeamParameterOutput:
+    """Loss at absolute_positions, the offsets of the motors from initial_motor_state (see get_motor_state).
+
+    The focusing system is reset to initial_motor_state and moved once, so the result does not depend on
+    the previous evaluations: with a random seed, evaluations can be replayed or run in any order, on any
+    focusing system with the same initial state (e.g. in the workers of ParallelFocusingOptics).
+
+    The evaluations on the same focusing system are serialized, and each one runs between snapshot() and
+    restore(): the focusing system is left as it was, unless keep_positions (or the system has no snapshots).
+    Snapshots hold the input and stage beams by reference, so they copy no rays.
+
+    Calls from several threads are safe but not concurrent: to evaluate positions in parallel, trace the
+    configurations with ParallelFocusingOptics.get_photon_beams, or give each thread its own focusing system
+    (e.g. from a FocusingOpticsPool).
+    """
+    with _get_evaluation_lock(focusing_system):
+        snapshot = None if keep_positions else _get_snapshot(focusing_system)
+
+        try:
+            with get_profiler().stage("move motors", category="optimization"):
+                focusing_system.set_motor_state(initial_motor_state)
+                focusing_system = movers.move_motors(focusing_system, motor_types, absolute_positions, movement='relative')
+
+            with get_profiler().stage("loss", category="optimization"):
+                return get_loss(loss_parameters, loss_weights, focusing_system=focusing_system,
+                                random_seed=random_seed, out_of_bounds_value=out_of_bounds_value)
+        finally:
+            if snapshot is not None: focusing_system.restore(snapshot)
+
+
+_EVALUATION_LOCKS = weakref.WeakKeyDictionary() # focusing system: lock
+_EVALUATION_LOCKS_LOCK = threading.Lock()
+
+
+def _get_evaluation_lock(focusing_system: object) -> object:
+    with _EVALUATION_LOCKS_LOCK:
+        try:
+            return _EVALUATION_LOCKS[focusing_system]
+        except KeyError:
+            lock = _EVALUATION_LOCKS[focusing_system] = threading.RLock()
+            return lock
+
+
+def _get_snapshot(focusing_system: object) -> object:
+    try:
+        return focusing_system.snapshot()
+    except (AttributeError, NotImplementedError):
+        return None
+
+
+class LossTerm(NamedTuple):
+    function: Callable[[object, object], float] # (hist, dw) -> loss term
+    tolerance: float
+
+
+# Loss terms available to get_loss and OptimizationCommon, by name.
+LOSS_TERMS = {}
+
+
+def register_loss_term(name: str, function: Callable[[object, object], float], tolerance: float = 0.0) -> NoReturn:
+    """The tolerance is the contribution of the term to the default stopping loss value."""
+    LOSS_TERMS[name] = LossTerm(function, tolerance)
+    configs.DEFAULT_LOSS_TOLERANCES[name] = tolerance
+
+
+def _peak_intensity(hist: object, dw: object) -> float:
+    return dw.get_parameter('peak_intensity')
+
+
+def _centroid_distance(hist: object, dw: object) -> float:
+    h_centroid = dw.get_parameter('h_centroid')
+    v_centroid = dw.get_parameter('v_centroid')
+    return (h_centroid ** 2 + v_centroid ** 2) ** 0.5
+
+
+def _fwhm(hist: object, dw: object) -> float:
     h_fwhm = dw.get_parameter('h_fwhm')
     v_fwhm = dw.get_parameter('v_fwhm')
-    fwhm = (h_fwhm ** 2 + v_fwhm ** 2) ** 0.5
-    return BeamParameterOutput(fwhm, photon_beam, hist, dw)
+    return (h_fwhm ** 2 + v_fwhm ** 2) ** 0.5
+
+
+register_loss_term('centroid', _centroid_distance, configs.DEFAULT_LOSS_TOLERANCES['centroid'])
+register_loss_term('fwhm', _fwhm, configs.DEFAULT_LOSS_TOLERANCES['fwhm'])
+register_loss_term('peak_intensity', lambda hist, dw: -np.log(_peak_intensity(hist, dw)),
+                   configs.DEFAULT_LOSS_TOLERANCES['peak_intensity'])
+register_loss_term('peak_fwhm_ratio', lambda hist, dw: -np.log(_peak_intensity(hist, dw) / _fwhm(hist, dw)),
+                   configs.DEFAULT_LOSS_TOLERANCES['peak_fwhm_ratio'])
 
 
 class OptimizationCommon(abc.ABC):
@@ -151,9 +266,8 @@ class OptimizationCommon(abc.ABC):
         def loss(self, x_absolute_this: List[float], verbose: bool = None) -> float:
             if np.ndim(x_absolute_this) > 0:
                 x_absolute_this = np.array(x_absolute_this)
-            x_relative_this = x_absolute_this - self.x_absolute_prev
             self.x_absolute_prev = x_absolute_this
-            self.current_loss = self.opt_common.loss_function(x_relative_this, verbose=False)
+            self.current_loss = self.opt_common.absolute_loss_function(x_absolute_this, verbose=False)
             verbose = verbose if verbose is not None else self.verbose
             if verbose:
                 print("motors", self.opt_common.motor_types,
@@ -165,8 +279,11 @@ class OptimizationCommon(abc.ABC):
                  initial_motor_positions: List[float] = None,
                  random_seed: int = None,
                  loss_parameters: List[str] = 'centroid',
-                 loss_min_value: float = None) -> NoReturn:
+                 loss_min_value: float = None,
+                 loss_weights: List[float] = None,
+                 profiler: object = None) -> NoReturn:
         self.focusing_system = focusing_system
+        self.profiler = profiler # beamline34IDC.util.profiling.Profiler: every optimizer call is timed, stage by stage
         self.motor_types = motor_types if np.ndim(motor_types) > 0 else [motor_types]
         self.random_seed = random_seed
 
@@ -176,32 +293,40 @@ class OptimizationCommon(abc.ABC):
 
         self.loss_parameters = np.atleast_1d(loss_parameters)
 
-        self._loss_function_list = []
+        self.loss_weights = np.ones(len(self.loss_parameters)) if loss_weights is None else np.atleast_1d(loss_weights)
+        if len(self.loss_weights) != len(self.loss_parameters):
+            raise ValueError("Supplied loss weights do not match the loss parameters.")
+
         temp_loss_min_value = 0
-        for loss_type in self.loss_parameters:
-            if loss_type == 'centroid':
-                self._loss_function_list.append(self.get_centroid_distance)
-            elif loss_type == 'peak_intensity':
-                print("Warning: Stopping condition for the peak intensity case is not supported.")
-                self._loss_function_list.append(self.get_negative_log_peak_intensity)
-            elif loss_type == 'fwhm':
-                self._loss_function_list.append(self.get_fwhm)
-            else:
+        for loss_type, weight in zip(self.loss_parameters, self.loss_weights):
+            if loss_type not in LOSS_TERMS:
                 raise ValueError("Supplied loss parameter is not valid.")
-            temp_loss_min_value += configs.DEFAULT_LOSS_TOLERANCES[loss_type]
-        self._loss_function = lambda: np.sum([lossfn() for lossfn in self._loss_function_list])
+            if loss_type == 'peak_intensity':
+                print("Warning: Stopping condition for the peak intensity case is not supported.")
+            if weight != 0: # 0 * -inf is nan
+                temp_loss_min_value += weight * LOSS_TERMS[loss_type].tolerance
+        self._loss_function = self.get_loss
 
         self._loss_min_value = temp_loss_min_value if loss_min_value is None else loss_min_value
         self._opt_trials_motor_positions = []
         self._opt_trials_losses = []
         self._opt_fn_call_counter = 0
         self._out_of_bounds_loss = 1e4 # this is a ridiculous arbitrarily high value.
+        self._initial_motor_state = None
         self.guesses_all = []
         self.results_all = []
 
     def get_beam(self) -> object:
         return get_beam(self.focusing_system, self.random_seed, remove_lost_rays=True)
 
+    def get_loss(self) -> float:
+        """All the loss terms from a single trace: out of bounds beams give the out of bounds loss."""
+        loss, photon_beam, hist, dw = get_loss(self.loss_parameters, self.loss_weights,
+                                               focusing_system=self.focusing_system,
+                                               random_seed=self.random_seed,
+                                               out_of_bounds_value=self._out_of_bounds_loss)
+        return loss
+
     def get_negative_log_peak_intensity(self) -> float:
         peak, photon_beam, hist, dw = get_peak_intensity(focusing_system=self.focusing_system,
                                                          random_seed=self.random_seed,
@@ -220,11 +345,51 @@ class OptimizationCommon(abc.ABC):
                                                out_of_bounds_value=self._out_of_bounds_loss)
         return fwhm
 
+    def get_initial_motor_state(self) -> dict:
+        """Motor state the absolute positions are measured from: the state of the focusing system at the first call."""
+        with _get_evaluation_lock(self.focusing_system): # not in the middle of an evaluation
+            if self._initial_motor_state is None:
+                self._initial_motor_state = self.focusing_system.get_motor_state()
+        return self._initial_motor_state
+
+    def evaluate(self, absolute_positions: List[float], keep_positions: bool = False) -> BeamParameterOutput:
+        """Loss and metrics at the absolute positions of the motors, independent from the previous evaluations.
+
+        The focusing system is left in its current state, unless keep_positions. Calls on the same focusing
+        system are serialized: see evaluate_positions for concurrent evaluations."""
+        return evaluate_positions(self.focusing_system, self.get_initial_motor_state(), self.motor_types,
+                                  absolute_positions, self.loss_parameters, self.loss_weights,
+                                  random_seed=self.random_seed, out_of_bounds_value=self._out_of_bounds_loss,
+                                  keep_positions=keep_positions)
+
+    def move_to_absolute_positions(self, absolute_positions: List[float]) -> NoReturn:
+        self.focusing_system.set_motor_state(self.get_initial_motor_state())
+        self.focusing_system = movers.move_motors(self.focusing_system, self.motor_types, absolute_positions,
+                                                  movement='relative')
+
+    def absolute_loss_function(self, absolute_positions: List[float], verbose: bool = True) -> float:
+        """As loss_function, with absolute positions: the focusing system is left at these positions."""
+        with active_profiler(self.profiler), get_profiler().stage("optimizer call", category="optimization",
+                                                                  call=self._opt_fn_call_counter) as stage:
+            loss = self.evaluate(absolute_positions, keep_positions=True).parameter_value
+            stage.set(loss=loss)
+        self._opt_trials_motor_positions.append(absolute_positions)
+        self._opt_trials_losses.append(loss)
+        self._opt_fn_call_counter += 1
+        if verbose:
+            print("motors", self.motor_types, "trans", absolute_positions, "current loss", loss)
+        return loss
+
     def loss_function(self, translations: List[float], verbose: bool = True) -> float:
         """This mutates the state of the focusing system."""
-        self.focusing_system = movers.move_motors(self.focusing_system, self.motor_types, translations,
-                                                  movement='relative')
-        loss = self._loss_function()
+        with active_profiler(self.profiler), get_profiler().stage("optimizer call", category="optimization",
+                                                                  call=self._opt_fn_call_counter) as stage:
+            with get_profiler().stage("move motors", category="optimization"):
+                self.focusing_system = movers.move_motors(self.focusing_system, self.motor_types, translations,
+                                                          movement='relative')
+            with get_profiler().stage("loss", category="optimization"):
+                loss = self._loss_function()
+            stage.set(loss=loss)
         self._opt_trials_motor_positions.append(translations)
         self._opt_trials_losses.append(loss)
         self._opt_fn_call_counter += 1
@@ -244,6 +409,7 @@ class OptimizationCommon(abc.ABC):
         self.focusing_system = movers.move_motors(self.focusing_system, self.motor_types,
                                                   motor_positions, movement=movement)
         self.initial_motor_positions = motor_positions
+        self._initial_motor_state = None
 
     @abc.abstractmethod
     def set_optimizer_options(self) -> NoReturn: pass
@@ -45,7 +45,7 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
 
-from beamline34IDC.simulation.facade.focusing_optics_interface import  MotorResolution
+from beamline34IDC.facade.focusing_optics_interface import MotorResolution
 import numpy as np
 
 motor_resolutions = MotorResolution.getInstance()
@@ -77,4 +77,5 @@ DEFAULT_MOTOR_TOLERANCES = DEFAULT_MOTOR_RESOLUTIONS
 # These values only apply for the simulation with 50k simulated beams
 DEFAULT_LOSS_TOLERANCES = {'centroid': 2e-4,
                            'fwhm': 2e-4,
-                           'peak_intensity': -np.inf}
\ No newline at end of file
+                           'peak_intensity': -np.inf,
+                           'peak_fwhm_ratio': -np.inf}
\ No newline at end of file
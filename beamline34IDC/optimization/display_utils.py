@@ -45,26 +45,23 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
 
-import matplotlib.pyplot as plt
+import sys
 import numpy as np
 from beamline34IDC.optimization.common import OptimizationCommon
 from beamline34IDC.optimization import configs
 from typing import List, NoReturn
 
 # This is just for a live plotting utility --------------------------------
-import IPython
-# Check if we are in a ipython/colab environment
+# Check if we are in a ipython/colab environment: there IPython is already imported,
+# otherwise it is not loaded (nor matplotlib, imported by the live plot)
 try:
-    class_name = IPython.get_ipython().__class__.__name__
-    if "Terminal" in class_name:
+    class_name = sys.modules["IPython"].get_ipython().__class__.__name__
+    if "Terminal" in class_name or class_name == "NoneType":
         IS_NOTEBOOK = False
     else:
         IS_NOTEBOOK = True
-except NameError:
+except KeyError:
     IS_NOTEBOOK = False
-
-if IS_NOTEBOOK:
-    from IPython import display
 # ---------------------------------------------------------------------------
 
 class EarlyStoppingCallback:
@@ -96,6 +93,9 @@ class LivePlotCallback:
         self.fig_kwargs = fig_kwargs
 
     def _initialize_fig(self) -> NoReturn:
+        import matplotlib.pyplot as plt
+        from IPython import display
+
         self.fig, self.ax = plt.subplots(1, 1, **self.fig_kwargs)
         self.hdisplay = display.display("", display_id=True)
         self.ax.set_xlabel("Calls")
@@ -116,4 +116,6 @@ class LivePlotCallback:
 
     def close(self) -> NoReturn:
         if self._fig_initialized:
+            import matplotlib.pyplot as plt
+
             plt.close(self.fig)
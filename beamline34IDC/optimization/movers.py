@@ -75,12 +75,44 @@ def get_motor_move_fn(focusing_system, motor):
         return motor
     raise ValueError
 
+# Motors of the hardware focusing optics (see move_many), in the units of the move functions.
+HARDWARE_MOTORS = {'hkb_4': ['HKB_MOTOR_4'],
+                   'hkb_3': ['HKB_MOTOR_3'],
+                   'vkb_4': ['VKB_MOTOR_4'],
+                   'vkb_3': ['VKB_MOTOR_3'],
+                   'hkb_1_2': ['HKB_MOTOR_1', 'HKB_MOTOR_2'],
+                   'vkb_1_2': ['VKB_MOTOR_1', 'VKB_MOTOR_2']}
+
+def get_hardware_positions(motors, translations, movement):
+    """{hardware motor: position} for move_many, None if a motor is not a hardware motor."""
+    positions = {}
+    for motor, trans in zip(motors, translations):
+        if motor not in HARDWARE_MOTORS:
+            return None
+        hardware_motors = HARDWARE_MOTORS[motor]
+        if len(hardware_motors) == 2:
+            if np.ndim(trans) == 0 and movement == Movement.RELATIVE:
+                trans = [trans, trans]
+            elif np.ndim(trans) != 1:
+                raise ValueError("For absolute movement for motors 1 and 2, " +
+                                 "translation for both the bender motors should be supplied together")
+        else:
+            trans = [trans]
+        positions.update(zip(hardware_motors, trans))
+    return positions
+
 def move_motors(focusing_system, motors, translations, movement='relative'):
     movement = get_movement(movement)
     if np.ndim(motors) == 0:
         motors = [motors]
     if np.ndim(translations) == 0:
         translations = [translations]
+    # on the hardware, all the motors move together
+    if hasattr(focusing_system, 'move_many'):
+        positions = get_hardware_positions(motors, translations, movement)
+        if positions is not None:
+            focusing_system.move_many(positions, movement=movement)
+            return focusing_system
     for motor, trans in zip(motors, translations):
         motor_move_fn = get_motor_move_fn(focusing_system, motor)
         if motor in ['hkb_1_2', 'vkb_1_2']:
@@ -46,13 +46,34 @@
 # ----------------------------------------------------------------------- #
 import numpy as np
 import scipy
+import multiprocessing
+from concurrent.futures import as_completed
 from beamline34IDC.util.shadow.common import EmptyBeamException
 from beamline34IDC.optimization import common, movers, configs
 from typing import List, Tuple, Callable, NoReturn
 
 
+class _MultiStartStopped(Exception):
+    pass
+
+
 class ScipyOptimizer(common.OptimizationCommon):
     opt_platform = 'scipy'
+    _stop_event = None
+    _start_seed = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # one entry per completed start, aligned with guesses_all and results_all: the calls of the loss function,
+        # and the seed of the random guesses (None if drawn from the global random state)
+        self.calls_per_start = []
+        self.seeds_all = []
+
+    def absolute_loss_function(self, absolute_positions: List[float], verbose: bool = True) -> float:
+        # a parallel restart is stopped at the next evaluation, once another one succeeded
+        if self._stop_event is not None and self._stop_event.is_set():
+            raise _MultiStartStopped()
+        return super().absolute_loss_function(absolute_positions, verbose=verbose)
 
     def set_optimizer_options(self, maxiter: int = None, maxfev: int = None,
                               xtol: float = None, ftol: float = None,
@@ -96,6 +117,8 @@ class ScipyOptimizer(common.OptimizationCommon):
                   trial_count: int = 0,
                   verbose: bool = False) -> Tuple[object, List[float], bool]:
 
+        calls_before = self._opt_fn_call_counter
+
         if initial_guess is None or trial_count > 0:
             initial_guess = [np.random.uniform(m1, m2) for (m1, m2) in guess_range]
 
@@ -119,6 +142,8 @@ class ScipyOptimizer(common.OptimizationCommon):
 
         self.guesses_all.append(initial_guess)
         self.results_all.append(opt_result)
+        self.calls_per_start.append(self._opt_fn_call_counter - calls_before)
+        self.seeds_all.append(self._start_seed)
 
         if loss < self._loss_min_value:
             return opt_result, sol, True
@@ -128,8 +153,13 @@ class ScipyOptimizer(common.OptimizationCommon):
                initial_guess: float = None,
                verbose: bool = False,
                guess_range: List[float] = None,
-               accept_all_solutions: bool = False) -> Tuple[List[object], List[float], List[float], bool]:
-        """Supply zeros to the initial guess to start from the initial posiiton."""
+               accept_all_solutions: bool = False,
+               parallel_focusing_optics: object = None) -> Tuple[List[object], List[float], List[float], bool]:
+        """Supply zeros to the initial guess to start from the initial posiiton.
+
+        With a ParallelFocusingOptics (same bender configuration), the random restarts run at the same
+        time, one per worker: the first one reaching the stopping loss value stops the others.
+        """
 
         if guess_range is None:
             guess_range = [np.array(configs.DEFAULT_MOVEMENT_RANGES[mt]) / 2 for mt in self.motor_types]
@@ -144,14 +174,82 @@ class ScipyOptimizer(common.OptimizationCommon):
 
         self._check_initial_loss(verbose=verbose)
 
+        if parallel_focusing_optics is not None:
+            return self._parallel_trials(parallel_focusing_optics, n_guesses, guess_range, accept_all_solutions)
+
         for n_trial in range(n_guesses):
             result, solution, success_status = self._optimize(guess_range=guess_range, verbose=verbose)
 
+            # every evaluation starts from the initial motor state: no need to move the motors back
             if accept_all_solutions or success_status:
                 return self.results_all, self.guesses_all, solution, True
 
-            if n_trial < n_guesses:
-                self.focusing_system = movers.move_motors(self.focusing_system, self.motor_types,
-                                                          self.initial_motor_positions, movement='absolute')
-
-        return self.results_all, self.guesses_all, solution, False
\ No newline at end of file
+        return self.results_all, self.guesses_all, solution, False
+
+    def _parallel_trials(self, parallel_focusing_optics: object,
+                         n_guesses: int,
+                         guess_range: List[float],
+                         accept_all_solutions: bool) -> Tuple[List[object], List[float], List[float], bool]:
+        # the restarts start from the initial motor state of this focusing system
+        motor_state = self.get_initial_motor_state()
+        optimizer_parameters = {'motor_types': self.motor_types,
+                                'random_seed': self.random_seed,
+                                'loss_parameters': self.loss_parameters,
+                                'loss_min_value': self._loss_min_value,
+                                'loss_weights': self.loss_weights}
+        # different random guesses in every worker
+        seeds = np.random.randint(0, 2 ** 31 - 1, size=n_guesses)
+
+        best_result, best_solution, success_status = None, None, False
+        with multiprocessing.Manager() as manager:
+            stop_event = manager.Event()
+            futures = [parallel_focusing_optics.submit(_run_parallel_start, motor_state, optimizer_parameters,
+                                                       self._opt_params, guess_range, int(seed), stop_event)
+                       for seed in seeds]
+
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result, guesses, solution, success, motor_positions, losses, fn_call_counter, calls_per_start, start_seeds = future.result()
+
+                # in order of completion: seeds_all tells which start each result comes from
+                self._opt_trials_motor_positions.extend(motor_positions)
+                self._opt_trials_losses.extend(losses)
+                self._opt_fn_call_counter += fn_call_counter
+                if result is None:
+                    continue
+                self.guesses_all.extend(guesses)
+                self.results_all.append(result)
+                self.calls_per_start.extend(calls_per_start)
+                self.seeds_all.extend(start_seeds)
+
+                if not success_status and (best_result is None or result.fun < best_result.fun):
+                    best_result, best_solution = result, solution
+                if not success_status and (accept_all_solutions or success):
+                    best_result, best_solution, success_status = result, solution, True
+                    stop_event.set()
+                    for other_future in futures:
+                        other_future.cancel()
+
+        if best_solution is not None:
+            self.move_to_absolute_positions(best_solution)
+        return self.results_all, self.guesses_all, best_solution, success_status
+
+
+def _run_parallel_start(focusing_system: object, motor_state: dict, optimizer_parameters: dict, opt_params: dict,
+                        guess_range: List[float], seed: int, stop_event: object) -> Tuple:
+    """One random restart, in a worker of ParallelFocusingOptics. Returns None as result if stopped."""
+    np.random.seed(seed)
+    focusing_system.set_motor_state(motor_state)
+
+    optimizer = ScipyOptimizer(focusing_system, **optimizer_parameters)
+    optimizer._opt_params = opt_params
+    optimizer._stop_event = stop_event
+    optimizer._start_seed = seed
+    try:
+        result, solution, success = optimizer._optimize(guess_range=guess_range, trial_count=1)
+    except _MultiStartStopped:
+        result, solution, success = None, None, False
+
+    return (result, optimizer.guesses_all, solution, success, optimizer._opt_trials_motor_positions,
+            optimizer._opt_trials_losses, optimizer._opt_fn_call_counter, optimizer.calls_per_start, optimizer.seeds_all)
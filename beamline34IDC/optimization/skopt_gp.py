@@ -46,6 +46,8 @@
 # ----------------------------------------------------------------------- #
 import numpy as np
 import skopt
+from skopt.utils import cook_estimator, normalize_dimensions
+from sklearn.utils import check_random_state
 from beamline34IDC.util.shadow.common import EmptyBeamException
 from beamline34IDC.optimization import common, movers, configs
 from typing import List, Tuple, Callable, NoReturn
@@ -72,10 +74,14 @@ class SkoptGaussianProcessOptimizer(common.OptimizationCommon):
         self._opt_params = extra_options
         self._opt_params.update({'dimensions': bounds, 'n_calls':n_calls})
 
-    def _optimize(self, verbose: bool = False) -> Tuple[object, List[float], bool]:
+    def _optimize(self, verbose: bool = False, parallel_focusing_optics: object = None,
+                  batch_size: int = None) -> Tuple[object, List[float], bool]:
 
-        lossfn_obj_this = self.TrialInstanceLossFunction(self, verbose=verbose)
-        opt_result = skopt.gp_minimize(lossfn_obj_this.loss, **self._opt_params)
+        if parallel_focusing_optics is None:
+            lossfn_obj_this = self.TrialInstanceLossFunction(self, verbose=verbose)
+            opt_result = skopt.gp_minimize(lossfn_obj_this.loss, **self._opt_params)
+        else:
+            opt_result = self._batch_minimize(parallel_focusing_optics, batch_size, verbose=verbose)
         loss = opt_result.fun
         sol = opt_result.x
         print("Loss is", loss, "for x", sol, "and min acceptable value is", self._loss_min_value)
@@ -99,7 +105,83 @@ class SkoptGaussianProcessOptimizer(common.OptimizationCommon):
         # print('New y0 is', len(self._opt_params['y0']), self._opt_params['y0'])
         return opt_result, sol, False
 
-    def trials(self, n_guesses = 1, verbose: bool = False, accept_all_solutions: bool = False) -> Tuple[List[object], List[float], List[float], bool]:
+    def _get_translations(self, x: List[float]) -> List[float]:
+        return list(x)
+
+    def _batch_minimize(self, parallel_focusing_optics: object, batch_size: int = None,
+                        verbose: bool = False) -> object:
+        """Ask/tell version of gp_minimize: q points per iteration (constant liar), evaluated in parallel."""
+        params = dict(self._opt_params)
+        n_calls = params.pop('n_calls')
+        if batch_size is None:
+            batch_size = parallel_focusing_optics.get_n_workers()
+        x0, y0 = params.pop('x0', None), params.pop('y0', None)
+        strategy = params.pop('strategy', 'cl_min')
+
+        # same defaults of gp_minimize
+        rng = check_random_state(params.pop('random_state', None))
+        space = normalize_dimensions(params.pop('dimensions'))
+        base_estimator = params.pop('base_estimator', None)
+        noise = params.pop('noise', 'gaussian')
+        if base_estimator is None:
+            base_estimator = cook_estimator("GP", space=space, random_state=rng.randint(0, np.iinfo(np.int32).max),
+                                            noise=noise)
+        n_jobs = params.pop('n_jobs', 1)
+        optimizer = skopt.Optimizer(space, base_estimator,
+                                    n_initial_points=params.pop('n_initial_points', 10),
+                                    initial_point_generator=params.pop('initial_point_generator', 'random'),
+                                    n_jobs=n_jobs,
+                                    acq_func=params.pop('acq_func', 'gp_hedge'),
+                                    acq_optimizer=params.pop('acq_optimizer', 'lbfgs'),
+                                    random_state=rng,
+                                    acq_func_kwargs={'xi': params.pop('xi', 0.01), 'kappa': params.pop('kappa', 1.96)},
+                                    acq_optimizer_kwargs={'n_points': params.pop('n_points', 10000),
+                                                          'n_restarts_optimizer': params.pop('n_restarts_optimizer', 5),
+                                                          'n_jobs': n_jobs})
+        if params:
+            print("Warning: options", list(params.keys()), "are not used in the batch optimization.")
+
+        # the points are absolute positions from the initial motor state, as in TrialInstanceLossFunction
+        motor_state = self.get_initial_motor_state()
+        loss_parameters = {'loss_parameters': self.loss_parameters,
+                           'loss_weights': self.loss_weights,
+                           'random_seed': self.random_seed,
+                           'out_of_bounds_value': self._out_of_bounds_loss}
+
+        def evaluate(points):
+            futures = [parallel_focusing_optics.submit(_get_loss_at, motor_state, self.motor_types,
+                                                       self._get_translations(x), loss_parameters)
+                       for x in points]
+            losses = [future.result() for future in futures]
+            for x, loss in zip(points, losses):
+                self._opt_trials_motor_positions.append(self._get_translations(x))
+                self._opt_trials_losses.append(loss)
+                self._opt_fn_call_counter += 1
+                if verbose:
+                    print("motors", self.motor_types, "trans", x, "current loss", loss)
+            return losses
+
+        opt_result = None
+        n_evaluations = 0
+        if x0 is not None:
+            x0 = [x0] if np.ndim(x0) == 1 else list(x0)
+            if y0 is None:
+                y0 = evaluate(x0)
+                n_evaluations += len(x0)
+            opt_result = optimizer.tell(x0, list(np.atleast_1d(y0)))
+
+        while n_evaluations < n_calls:
+            points = optimizer.ask(n_points=min(batch_size, n_calls - n_evaluations), strategy=strategy)
+            opt_result = optimizer.tell(points, evaluate(points))
+            n_evaluations += len(points)
+
+        self.move_to_absolute_positions(self._get_translations(opt_result.x))
+        return opt_result
+
+    def trials(self, n_guesses = 1, verbose: bool = False, accept_all_solutions: bool = False,
+               parallel_focusing_optics: object = None, batch_size: int = None) -> Tuple[List[object], List[float], List[float], bool]:
+        """With a ParallelFocusingOptics (same bender configuration), batch_size points (default: one per worker)
+        are asked to the GP at every iteration and evaluated at the same time. n_calls is the total budget."""
 
         if n_guesses != 1:
             print('Warning: Since the skopt optimization samples random points anyway, there is little ' + \
@@ -109,7 +191,9 @@ class SkoptGaussianProcessOptimizer(common.OptimizationCommon):
                           'is to just increase the n_calls parameter in the optimizer options.')
 
         self._check_initial_loss(verbose=verbose)
-        result, solution, success_status = self._optimize(verbose=verbose)
+        result, solution, success_status = self._optimize(verbose=verbose,
+                                                          parallel_focusing_optics=parallel_focusing_optics,
+                                                          batch_size=batch_size)
 
         if accept_all_solutions or success_status:
                 return self.results_all, self.guesses_all, solution, True
@@ -122,17 +206,19 @@ class SkoptDiscreteGPOptimizer(SkoptGaussianProcessOptimizer):
         def loss(self, x_absolute_this: List[float], verbose: bool = None) -> float:
             if np.ndim(x_absolute_this) > 0:
                 x_absolute_this = np.array(x_absolute_this)
-            x_relative_this = x_absolute_this - self.x_absolute_prev
             self.x_absolute_prev = x_absolute_this
 
-            x_relative_this_float = self.opt_common.transform_to_float(self.opt_common.motor_types, x_relative_this)
-            self.current_loss = self.opt_common.loss_function(x_relative_this_float, verbose=False)
+            x_absolute_this_float = self.opt_common.transform_to_float(self.opt_common.motor_types, x_absolute_this)
+            self.current_loss = self.opt_common.absolute_loss_function(x_absolute_this_float, verbose=False)
             verbose = verbose if verbose is not None else self.verbose
             if verbose:
                 print("motors", self.opt_common.motor_types,
                       "trans", x_absolute_this, "current loss", self.current_loss)
             return self.current_loss
 
+    def _get_translations(self, x: List[int]) -> List[float]:
+        return self.transform_to_float(self.motor_types, x)
+
     @staticmethod
     def transform_to_integer(motor_types: List[str], motor_values: List[float]):
         int_values = []
@@ -170,7 +256,10 @@ class SkoptDiscreteGPOptimizer(SkoptGaussianProcessOptimizer):
         self._opt_params = extra_options
         self._opt_params.update({'dimensions': bounds_int, 'n_calls':n_calls})
 
-    def trials(self, n_guesses = 1, verbose: bool = False, accept_all_solutions: bool = False) -> Tuple[List[object], List[float], List[float], bool]:
+    def trials(self, n_guesses = 1, verbose: bool = False, accept_all_solutions: bool = False,
+               parallel_focusing_optics: object = None, batch_size: int = None) -> Tuple[List[object], List[float], List[float], bool]:
+        """With a ParallelFocusingOptics (same bender configuration), batch_size points (default: one per worker)
+        are asked to the GP at every iteration and evaluated at the same time. n_calls is the total budget."""
 
         if n_guesses != 1:
             print('Warning: Since the skopt optimization samples random points anyway, there is little ' + \
@@ -180,9 +269,19 @@ class SkoptDiscreteGPOptimizer(SkoptGaussianProcessOptimizer):
                           'is to just increase the n_calls parameter in the optimizer options.')
 
         self._check_initial_loss(verbose=verbose)
-        result, solution, success_status = self._optimize(verbose=verbose)
+        result, solution, success_status = self._optimize(verbose=verbose,
+                                                          parallel_focusing_optics=parallel_focusing_optics,
+                                                          batch_size=batch_size)
 
         if accept_all_solutions or success_status:
                 return self.results_all, self.guesses_all, solution, True
 
-        return self.results_all, self.guesses_all, solution, False
\ No newline at end of file
+        return self.results_all, self.guesses_all, solution, False
+
+def _get_loss_at(focusing_system: object, motor_state: dict, motor_types: List[str], translations: List[float],
+                 loss_parameters: dict) -> float:
+    """Loss at translations from motor_state, in a worker of ParallelFocusingOptics.
+
+    The focusing system of the worker is private and reset by every evaluation: no snapshot."""
+    return common.evaluate_positions(focusing_system, motor_state, motor_types, translations,
+                                     keep_positions=True, **loss_parameters).parameter_value
@@ -48,3 +48,4 @@
 class Implementors:
     SHADOW = 0
     SRW = 1
+    SHADOW_SERVER = 2 # Shadow systems hosted by a SimulationServer (simulation.shadow.server)
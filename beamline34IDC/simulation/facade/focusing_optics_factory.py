@@ -46,8 +46,6 @@
 # ----------------------------------------------------------------------- #
 
 from beamline34IDC.simulation.facade import Implementors
-from beamline34IDC.simulation.shadow.focusing_optics import shadow_focusing_optics_factory_method
-from beamline34IDC.simulation.srw.focusing_optics import srw_focusing_optics_factory_method
 
 from beamline34IDC.util.initializer import register_ini_instance, AlreadyInitializedError, IniMode
 #############################################################################
@@ -60,6 +58,17 @@ def simulated_focusing_optics_factory_method(implementor=Implementors.SHADOW, **
     try: register_ini_instance(ini_mode=IniMode.LOCAL_FILE, application_name="benders calibration", ini_file_name="benders_calibration.ini")
     except AlreadyInitializedError: pass
 
-    if implementor==Implementors.SHADOW: return shadow_focusing_optics_factory_method(**kwargs)
-    elif implementor==Implementors.SRW:  return srw_focusing_optics_factory_method(**kwargs)
+    # the implementors are imported on first use: a Shadow worker does not load the SRW stack, and vice versa
+    if implementor==Implementors.SHADOW:
+        from beamline34IDC.simulation.shadow.focusing_optics import shadow_focusing_optics_factory_method
+
+        return shadow_focusing_optics_factory_method(**kwargs)
+    elif implementor==Implementors.SRW:
+        from beamline34IDC.simulation.srw.focusing_optics import srw_focusing_optics_factory_method
+
+        return srw_focusing_optics_factory_method(**kwargs)
+    elif implementor==Implementors.SHADOW_SERVER:
+        from beamline34IDC.simulation.shadow.server import shadow_server_focusing_optics_factory_method
+
+        return shadow_server_focusing_optics_factory_method(**kwargs)
     else: raise ValueError("Implementor not recognized")
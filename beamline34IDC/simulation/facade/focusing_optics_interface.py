@@ -74,6 +74,10 @@ class AbstractSimulatedFocusingOptics(AbstractFocusingOptics):
     def perturbate_input_photon_beam(self, shift_h=None, shift_v=None, rotation_h=None, rotation_v=None): raise NotImplementedError()
     def restore_input_photon_beam(self): raise NotImplementedError()
 
+    # state of the simulation (OE parameters and beams), restored without tracing
+    def snapshot(self): raise NotImplementedError()
+    def restore(self, token): raise NotImplementedError()
+
     #####################################################################################
     # This methods represent the run-time interface, to interact with the optical system
     # in real time, like in the real beamline. FOR SIMULATION PURPOSES ONLY
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import threading
+from contextlib import contextmanager
+
+from beamline34IDC.simulation.facade import Implementors
+from beamline34IDC.simulation.facade.focusing_optics_factory import simulated_focusing_optics_factory_method
+from beamline34IDC.simulation.facade.focusing_optics_interface import get_default_input_features
+from beamline34IDC.simulation.shadow.cache import get_beam_fingerprint, get_cache_key
+from beamline34IDC.util.shadow.common import load_shadow_beam, PreProcessorFiles
+from beamline34IDC.util.workspace import Workspace
+
+#############################################################################
+# DESIGN PATTERN: OBJECT POOL
+#
+# Initialized focusing optics systems, grouped by configuration (implementor,
+# bender, input beam, input features and initialization parameters).
+# A released system is reset to its initial state with restore(), without
+# tracing: acquiring an idle system costs milliseconds instead of a new
+# initialization (input beam loading, preprocessor and bender files).
+#
+# Every system runs in its own Workspace (the bender profile files have fixed
+# names and are reused across traces). Systems are handed out to one user at a
+# time; as the Workspaces, they are meant to be used by one thread at a time.
+#
+
+class FocusingOpticsPool():
+    def __init__(self, size=1, working_directory=os.curdir, **initialization_parameters):
+        '''
+        size: idle systems kept per configuration (the exceeding ones are discarded when released)
+        initialization_parameters: passed to initialize() (workspace is set by the pool)
+        '''
+        try:    initialization_parameters["rewrite_preprocessor_files"]
+        except: initialization_parameters["rewrite_preprocessor_files"] = PreProcessorFiles.NO
+        try:    initialization_parameters["rewrite_height_error_profile_files"]
+        except: initialization_parameters["rewrite_height_error_profile_files"] = False
+        initialization_parameters.pop("workspace", None)
+
+        self.__size = size
+        self.__working_directory = os.path.abspath(working_directory)
+        self.__initialization_parameters = initialization_parameters
+
+        self.__input_beams  = {} # file key: (input beam, fingerprint)
+        self.__idle_systems = {} # configuration key: [focusing systems]
+        self.__in_use       = {} # id(focusing system): (configuration key, focusing system, initial state, workspace)
+        self.__idle_entries = {} # id(focusing system): (initial state, workspace)
+
+        self.__lock          = threading.RLock()
+        self.__creation_lock = threading.Lock() # the initialization changes the current directory of the process
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_value, traceback): self.clear()
+
+    def warm_up(self, n_systems=None, input_photon_beam=None, input_photon_beam_file_name="primary_optics_system_beam.dat",
+                implementor=Implementors.SHADOW, bender=False, input_features=None):
+        '''
+        initializes idle systems of a configuration up to n_systems (default: the size of the pool)
+        '''
+        if n_systems is None: n_systems = self.__size
+        if input_features is None: input_features = get_default_input_features()
+
+        input_photon_beam, configuration_key = self.__get_configuration(input_photon_beam, input_photon_beam_file_name, implementor, bender, input_features)
+
+        while True:
+            with self.__lock:
+                if len(self.__idle_systems.get(configuration_key, [])) >= n_systems: return
+
+            # initialized out of the lock: it takes seconds
+            focusing_system, initial_state, workspace = self.__create(input_photon_beam, implementor, bender, input_features)
+
+            with self.__lock:
+                self.__idle_systems.setdefault(configuration_key, []).append(focusing_system)
+                self.__idle_entries[id(focusing_system)] = (initial_state, workspace)
+
+    def acquire(self, input_photon_beam=None, input_photon_beam_file_name="primary_optics_system_beam.dat",
+                implementor=Implementors.SHADOW, bender=False, input_features=None):
+        '''
+        returns a system in its initial state: idle if available, otherwise a new one is initialized.
+        input_photon_beam: a ShadowBeam, if None it is loaded from input_photon_beam_file_name (once)
+        input_features: if None, get_default_input_features()
+        '''
+        if input_features is None: input_features = get_default_input_features()
+
+        input_photon_beam, configuration_key = self.__get_configuration(input_photon_beam, input_photon_beam_file_name, implementor, bender, input_features)
+
+        with self.__lock:
+            idle_systems = self.__idle_systems.get(configuration_key, [])
+
+            if len(idle_systems) > 0:
+                focusing_system = idle_systems.pop()
+                initial_state, workspace = self.__idle_entries.pop(id(focusing_system))
+            else:
+                focusing_system = None
+
+        if focusing_system is None: focusing_system, initial_state, workspace = self.__create(input_photon_beam, implementor, bender, input_features)
+
+        with self.__lock:
+            self.__in_use[id(focusing_system)] = (configuration_key, focusing_system, initial_state, workspace)
+
+        return focusing_system
+
+    def release(self, focusing_system):
+        with self.__lock:
+            try:    configuration_key, _, initial_state, workspace = self.__in_use.pop(id(focusing_system))
+            except KeyError: raise ValueError("Focusing Optical System not acquired from this pool")
+
+            idle_systems = self.__idle_systems.setdefault(configuration_key, [])
+
+            if len(idle_systems) < self.__size:
+                focusing_system.restore(initial_state)
+
+                idle_systems.append(focusing_system)
+                self.__idle_entries[id(focusing_system)] = (initial_state, workspace)
+            else:
+                workspace.remove()
+
+    @contextmanager
+    def focusing_system(self, **kwargs):
+        '''
+        with pool.focusing_system(bender=True) as focusing_system: ... (released on exit)
+        '''
+        focusing_system = self.acquire(**kwargs)
+        try:     yield focusing_system
+        finally: self.release(focusing_system)
+
+    def get_n_idle_systems(self):
+        with self.__lock:
+            return sum([len(idle_systems) for idle_systems in self.__idle_systems.values()])
+
+    def get_n_systems_in_use(self):
+        with self.__lock:
+            return len(self.__in_use)
+
+    def clear(self):
+        '''
+        removes the idle systems and their workspaces: the systems in use go back to the pool when released
+        '''
+        with self.__lock:
+            for _, workspace in self.__idle_entries.values(): workspace.remove()
+
+            self.__idle_systems.clear()
+            self.__idle_entries.clear()
+            self.__input_beams.clear()
+
+    # PRIVATE METHODS
+
+    def __get_configuration(self, input_photon_beam, input_photon_beam_file_name, implementor, bender, input_features):
+        with self.__lock:
+            if input_photon_beam is None:
+                file_name = os.path.join(self.__working_directory, input_photon_beam_file_name)
+                file_stat = os.stat(file_name)
+                file_key  = (file_name, file_stat.st_mtime_ns, file_stat.st_size)
+
+                try:
+                    input_photon_beam, fingerprint = self.__input_beams[file_key]
+                except KeyError:
+                    input_photon_beam = load_shadow_beam(file_name)
+                    fingerprint       = get_beam_fingerprint(input_photon_beam)
+
+                    self.__input_beams[file_key] = (input_photon_beam, fingerprint)
+            else:
+                fingerprint = get_beam_fingerprint(input_photon_beam)
+
+        return input_photon_beam, get_cache_key(implementor, bender, fingerprint, vars(input_features))
+
+    def __create(self, input_photon_beam, implementor, bender, input_features):
+        with self.__creation_lock:
+            # ini files are registered with the path of the working directory
+            current_directory = os.path.abspath(os.curdir)
+            os.chdir(self.__working_directory)
+            try:
+                focusing_system = simulated_focusing_optics_factory_method(implementor=implementor, bender=bender)
+                workspace       = Workspace(source_directory=self.__working_directory, prefix="pool_")
+
+                try:
+                    focusing_system.initialize(input_photon_beam=input_photon_beam, input_features=input_features, workspace=workspace, **self.__initialization_parameters)
+                except:
+                    workspace.remove()
+                    raise
+            finally:
+                os.chdir(current_directory)
+
+        return focusing_system, focusing_system.snapshot(), workspace
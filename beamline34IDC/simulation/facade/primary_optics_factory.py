@@ -46,14 +46,19 @@
 # ----------------------------------------------------------------------- #
 
 from beamline34IDC.simulation.facade import Implementors
-from beamline34IDC.simulation.shadow.primary_optics import shadow_primary_optics_factory_method
-from beamline34IDC.simulation.srw.primary_optics import srw_primary_optics_factory_method
 
 #############################################################################
 # DESIGN PATTERN: FACTORY METHOD
 #
 
 def primary_optics_factory_method(implementor=Implementors.SHADOW):
-    if implementor==Implementors.SHADOW: return shadow_primary_optics_factory_method()
-    elif implementor==Implementors.SRW:  return srw_primary_optics_factory_method()
+    # the implementors are imported on first use
+    if implementor==Implementors.SHADOW:
+        from beamline34IDC.simulation.shadow.primary_optics import shadow_primary_optics_factory_method
+
+        return shadow_primary_optics_factory_method()
+    elif implementor==Implementors.SRW:
+        from beamline34IDC.simulation.srw.primary_optics import srw_primary_optics_factory_method
+
+        return srw_primary_optics_factory_method()
     else: raise ValueError("Implementor not recognized")
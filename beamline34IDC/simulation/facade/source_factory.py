@@ -44,8 +44,6 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
-from beamline34IDC.simulation.shadow.source import shadow_source_factory_method
-from beamline34IDC.simulation.srw.source import srw_source_factory_method
 from beamline34IDC.simulation.facade.source_interface import Sources
 from beamline34IDC.simulation.facade import Implementors
 
@@ -54,7 +52,14 @@ from beamline34IDC.simulation.facade import Implementors
 #
 
 def source_factory_method(implementor=Implementors.SHADOW, kind_of_source=Sources.GAUSSIAN):
-    if implementor==Implementors.SHADOW: return shadow_source_factory_method(kind_of_source=kind_of_source)
-    elif implementor==Implementors.SRW:  return srw_source_factory_method(kind_of_source=kind_of_source)
+    # the implementors are imported on first use
+    if implementor==Implementors.SHADOW:
+        from beamline34IDC.simulation.shadow.source import shadow_source_factory_method
+
+        return shadow_source_factory_method(kind_of_source=kind_of_source)
+    elif implementor==Implementors.SRW:
+        from beamline34IDC.simulation.srw.source import srw_source_factory_method
+
+        return srw_source_factory_method(kind_of_source=kind_of_source)
     else: raise ValueError("Implementor not recognized")
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy
+
+from orangecontrib.ml.util.data_structures import DictionaryWrapper
+
+#############################################################################
+# Memoization of the output beams of the focusing optics.
+#
+# Entries are keyed by a canonical hash of everything that determines the
+# output beam (see get_cache_key()), they are kept in memory up to a budget
+# in bytes, least recently used first out. With a disk directory, the evicted
+# entries are moved there (.npy files) instead of being discarded.
+#
+
+class BeamCache():
+    def __init__(self, memory_budget=1024**3, disk_directory=None, disk_budget=None):
+        '''
+        memory_budget, disk_budget: bytes (disk_budget None = unlimited)
+        disk_directory: None = memory only, True = temporary directory (removed by close(), or when the cache is
+                        garbage collected)
+        '''
+        if disk_directory == True:
+            disk_directory   = tempfile.mkdtemp(prefix="beam_cache_")
+            self.__finalizer = weakref.finalize(self, shutil.rmtree, disk_directory, ignore_errors=True)
+        else:
+            if not disk_directory is None: os.makedirs(disk_directory, exist_ok=True)
+            self.__finalizer = None
+
+        self.__memory_budget  = memory_budget
+        self.__disk_directory = disk_directory
+        self.__disk_budget    = disk_budget
+
+        self.__memory_entries = OrderedDict() # key: (oe_number, initial_flux, rays)
+        self.__disk_entries   = OrderedDict() # key: (oe_number, initial_flux, size)
+        self.__memory_size    = 0
+        self.__disk_size      = 0
+
+        self.__hits       = 0
+        self.__disk_hits  = 0
+        self.__misses     = 0
+        self.__evictions  = 0
+
+        self.__lock = threading.RLock()
+
+    def get(self, key):
+        '''
+        returns (oe_number, initial_flux, rays) or None, rays are read-only
+        '''
+        with self.__lock:
+            if key in self.__memory_entries:
+                self.__memory_entries.move_to_end(key)
+                self.__hits += 1
+
+                return self.__memory_entries[key]
+            elif key in self.__disk_entries:
+                oe_number, initial_flux, _ = self.__disk_entries[key]
+
+                try:
+                    rays = numpy.load(self.__get_disk_file_name(key))
+                except OSError: # removed from outside
+                    self.__remove_from_disk(key)
+                    self.__misses += 1
+
+                    return None
+
+                self.__remove_from_disk(key)
+                self.__store_in_memory(key, oe_number, initial_flux, rays)
+                self.__hits      += 1
+                self.__disk_hits += 1
+
+                return self.__memory_entries[key]
+            else:
+                self.__misses += 1
+
+                return None
+
+    def put(self, key, oe_number, initial_flux, rays):
+        with self.__lock:
+            if key in self.__memory_entries or key in self.__disk_entries: return
+
+            self.__store_in_memory(key, oe_number, initial_flux, numpy.array(rays, copy=True))
+
+    def clear(self):
+        with self.__lock:
+            for key in list(self.__disk_entries.keys()): self.__remove_from_disk(key)
+
+            self.__memory_entries.clear()
+            self.__memory_size = 0
+
+    def close(self):
+        '''
+        clears the cache, and removes the temporary directory: the cache is memory only afterwards
+        '''
+        with self.__lock:
+            self.clear()
+
+            if not self.__finalizer is None:
+                self.__finalizer()
+                self.__finalizer      = None
+                self.__disk_directory = None
+
+    def reset_statistics(self):
+        with self.__lock:
+            self.__hits = self.__disk_hits = self.__misses = self.__evictions = 0
+
+    def get_statistics(self):
+        with self.__lock:
+            return DictionaryWrapper(hits=self.__hits,
+                                     disk_hits=self.__disk_hits,
+                                     misses=self.__misses,
+                                     evictions=self.__evictions,
+                                     memory_entries=len(self.__memory_entries),
+                                     memory_size=self.__memory_size,
+                                     disk_entries=len(self.__disk_entries),
+                                     disk_size=self.__disk_size)
+
+    def __len__(self):
+        return len(self.__memory_entries) + len(self.__disk_entries)
+
+    def __contains__(self, key):
+        return key in self.__memory_entries or key in self.__disk_entries
+
+    # PRIVATE METHODS
+
+    def __store_in_memory(self, key, oe_number, initial_flux, rays):
+        rays.setflags(write=False)
+
+        self.__memory_entries[key] = (oe_number, initial_flux, rays)
+        self.__memory_size += rays.nbytes
+
+        while self.__memory_size > self.__memory_budget and len(self.__memory_entries) > 1:
+            evicted_key, (evicted_oe_number, evicted_initial_flux, evicted_rays) = self.__memory_entries.popitem(last=False)
+            self.__memory_size -= evicted_rays.nbytes
+            self.__evictions += 1
+
+            if not self.__disk_directory is None: self.__store_on_disk(evicted_key, evicted_oe_number, evicted_initial_flux, evicted_rays)
+
+    def __store_on_disk(self, key, oe_number, initial_flux, rays):
+        if not self.__disk_budget is None and rays.nbytes > self.__disk_budget: return
+
+        numpy.save(self.__get_disk_file_name(key), rays, allow_pickle=False)
+
+        self.__disk_entries[key] = (oe_number, initial_flux, rays.nbytes)
+        self.__disk_size += rays.nbytes
+
+        if not self.__disk_budget is None:
+            while self.__disk_size > self.__disk_budget: self.__remove_from_disk(next(iter(self.__disk_entries)))
+
+    def __remove_from_disk(self, key):
+        _, _, size = self.__disk_entries.pop(key)
+        self.__disk_size -= size
+
+        try:    os.remove(self.__get_disk_file_name(key))
+        except: pass
+
+    def __get_disk_file_name(self, key):
+        return os.path.join(self.__disk_directory, key + ".npy")
+
+#############################################################################
+# Last versions of the output of a stage of the beamline, keyed by the hash of
+# the stage parameters and of the key of the upstream stage
+
+class StageCache():
+    def __init__(self, max_versions=3):
+        self.__max_versions = max_versions
+        self.__entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            self.__entries.move_to_end(key)
+            return self.__entries[key]
+        except KeyError:
+            return None
+
+    def put(self, key, shadow_beam):
+        self.__entries[key] = shadow_beam
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.__max_versions: self.__entries.popitem(last=False)
+
+    def clear(self):
+        self.__entries.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+#############################################################################
+# Canonical keys
+
+def get_beam_fingerprint(shadow_beam):
+    rays = numpy.ascontiguousarray(shadow_beam._beam.rays)
+
+    hash = hashlib.blake2b(digest_size=16)
+    hash.update(str(rays.shape).encode("utf-8"))
+    hash.update(rays.tobytes())
+
+    return hash.hexdigest()
+
+def get_cache_key(*parameters):
+    '''
+    parameters are converted to their repr(): floats are written with full precision,
+    numpy arrays are converted to lists
+    '''
+    hash = hashlib.blake2b(digest_size=16)
+
+    for parameter in parameters:
+        hash.update(repr(__to_canonical(parameter)).encode("utf-8"))
+        hash.update(b"|")
+
+    return hash.hexdigest()
+
+def __to_canonical(parameter):
+    if isinstance(parameter, numpy.ndarray):  return parameter.tolist()
+    elif isinstance(parameter, numpy.generic): return parameter.item()
+    elif isinstance(parameter, (list, tuple)): return [__to_canonical(item) for item in parameter]
+    elif isinstance(parameter, dict):          return [[key, __to_canonical(parameter[key])] for key in sorted(parameter.keys())]
+    else: return parameter
@@ -45,6 +45,7 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
 import os.path
+from contextlib import nullcontext
 
 import numpy
 import Shadow
@@ -53,7 +54,12 @@ from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement, Shado
 from orangecontrib.shadow.util.shadow_util import ShadowPhysics, ShadowMath, ShadowCongruence
 from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
 
-from beamline34IDC.util.shadow.common import TTYInibitor, HybridFailureException, EmptyBeamException, PreProcessorFiles, write_reflectivity_file, write_dabam_file, rotate_axis_system, get_hybrid_input_parameters, plot_shadow_beam_spatial_distribution
+from beamline34IDC.util.shadow.common import FortranOutputCapture, HybridFailureException, EmptyBeamException, PreProcessorFiles, create_shadow_beam, write_reflectivity_file, write_dabam_file, rotate_axis_system, get_hybrid_input_parameters, plot_shadow_beam_spatial_distribution
+from beamline34IDC.util import clean_up
+from beamline34IDC.util.workspace import Workspace
+from beamline34IDC.util.shadow.copy_on_write import CopyOnWriteShadowBeam
+from beamline34IDC.util.profiling import get_profiler, active_profiler, get_ray_count, get_bytes_copied
+from beamline34IDC.simulation.shadow.cache import StageCache, get_beam_fingerprint, get_cache_key
 from beamline34IDC.facade.focusing_optics_interface import Movement, MotorResolution, AngularUnits, DistanceUnits
 from beamline34IDC.simulation.facade.focusing_optics_interface import AbstractSimulatedFocusingOptics, get_default_input_features
 
@@ -63,6 +69,16 @@ def shadow_focusing_optics_factory_method(**kwargs):
         else:                        return __IdealFocusingOptics()
     except: return __IdealFocusingOptics()
 
+class FocusingOpticsSnapshot():
+    def __init__(self, owner, optical_elements, shape_snapshot, input_beam, input_beam_key, stage_beams, stage_beam_keys):
+        self.owner            = owner
+        self.optical_elements = optical_elements
+        self.shape_snapshot   = shape_snapshot
+        self.input_beam       = input_beam
+        self.input_beam_key   = input_beam_key
+        self.stage_beams      = stage_beams
+        self.stage_beam_keys  = stage_beam_keys
+
 class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
     def __init__(self):
         self._input_beam = None
@@ -72,7 +88,17 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
         self._coherence_slits = None
         self._vkb = None
         self._hkb = None
-        self._modified_elements = None
+        self._workspace = None
+        self._owns_workspace = False
+        self._copy_on_write = False
+        self._beam_cache = None
+        self._slits_stage_cache = None
+        self._vkb_stage_cache = None
+        self._hkb_stage_cache = None
+        self._input_beam_key = None
+        self._stage_beam_keys = [None, None, None] # stage keys of _slits_beam, _vkb_beam, _hkb_beam
+        self.__input_beam_version = 0
+        self.__stage_beams_restored = False
 
     def initialize(self,
                    input_photon_beam,
@@ -82,51 +108,99 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
         except: rewrite_preprocessor_files = PreProcessorFiles.YES_SOURCE_RANGE
         try:    rewrite_height_error_profile_files = kwargs["rewrite_height_error_profile_files"]
         except: rewrite_height_error_profile_files = False
+        try:    workspace = kwargs["workspace"]
+        except: workspace = None
+        try:    self._beam_cache = kwargs["beam_cache"]
+        except: self._beam_cache = None
+        try:    stage_cache_versions = kwargs["stage_cache_versions"]
+        except: stage_cache_versions = 3
+        self._copy_on_write = kwargs.get("copy_on_write", False) # beams returned read-only: opt-in
+
+        # private directory for the files written by the simulation: a Workspace (left to the caller) or True to
+        # create one, removed by close()
+        self.close()
+
+        if workspace == True: self._workspace = Workspace()
+        elif isinstance(workspace, Workspace): self._workspace = workspace
+        else: self._workspace = None
+        self._owns_workspace = workspace == True
+
+        with self._in_workspace():
+            # with copy on write, the beams traced from the input beam share the rays until they are modified
+            if self._copy_on_write:
+                self._input_beam          = CopyOnWriteShadowBeam.copy_beam(input_photon_beam)
+                self.__initial_input_beam = self._input_beam.duplicate()
+            else:
+                self._input_beam          = input_photon_beam.duplicate()
+                self.__initial_input_beam = input_photon_beam.duplicate()
+            self.__input_beam_changed()
+
+            energies     = ShadowPhysics.getEnergyFromShadowK(self._input_beam._beam.rays[:, 10])
+            energy_range = [numpy.min(energies), numpy.max(energies)]
 
-        self._input_beam = input_photon_beam.duplicate()
-        self.__initial_input_beam = input_photon_beam.duplicate()
+            if rewrite_preprocessor_files == PreProcessorFiles.YES_FULL_RANGE:     reflectivity_file = write_reflectivity_file()
+            elif rewrite_preprocessor_files == PreProcessorFiles.YES_SOURCE_RANGE: reflectivity_file = write_reflectivity_file(energy_range=energy_range)
+            elif rewrite_preprocessor_files == PreProcessorFiles.NO:               reflectivity_file = "Pt.dat"
 
-        energies     = ShadowPhysics.getEnergyFromShadowK(self._input_beam._beam.rays[:, 10])
-        energy_range = [numpy.min(energies), numpy.max(energies)]
+            if rewrite_height_error_profile_files == True:
+                vkb_error_profile_file = write_dabam_file(dabam_entry_number=92, heigth_profile_file_name="VKB-LTP_shadow.dat", seed=8787)
+                hkb_error_profile_file = write_dabam_file(dabam_entry_number=93, heigth_profile_file_name="HKB-LTP_shadow.dat", seed=2345345)
+            else:
+                vkb_error_profile_file = "VKB-LTP_shadow.dat"
+                hkb_error_profile_file = "HKB-LTP_shadow.dat"
 
-        if rewrite_preprocessor_files == PreProcessorFiles.YES_FULL_RANGE:     reflectivity_file = write_reflectivity_file()
-        elif rewrite_preprocessor_files == PreProcessorFiles.YES_SOURCE_RANGE: reflectivity_file = write_reflectivity_file(energy_range=energy_range)
-        elif rewrite_preprocessor_files == PreProcessorFiles.NO:               reflectivity_file = "Pt.dat"
+            coherence_slits = Shadow.OE()
 
-        if rewrite_height_error_profile_files == True:
-            vkb_error_profile_file = write_dabam_file(dabam_entry_number=92, heigth_profile_file_name="VKB-LTP_shadow.dat", seed=8787)
-            hkb_error_profile_file = write_dabam_file(dabam_entry_number=93, heigth_profile_file_name="HKB-LTP_shadow.dat", seed=2345345)
-        else:
-            vkb_error_profile_file = "VKB-LTP_shadow.dat"
-            hkb_error_profile_file = "HKB-LTP_shadow.dat"
+            # COHERENCE SLITS
+            coherence_slits.DUMMY = 0.1
+            coherence_slits.FWRITE = 3
+            coherence_slits.F_REFRAC = 2
+            coherence_slits.F_SCREEN = 1
+            coherence_slits.I_SLIT = numpy.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+            coherence_slits.N_SCREEN = 1
+            coherence_slits.CX_SLIT = numpy.array([input_features.get_parameter("coh_slits_h_center"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            coherence_slits.CZ_SLIT = numpy.array([input_features.get_parameter("coh_slits_v_center"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            coherence_slits.RX_SLIT = numpy.array([input_features.get_parameter("coh_slits_h_aperture"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            coherence_slits.RZ_SLIT = numpy.array([input_features.get_parameter("coh_slits_v_aperture"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+            coherence_slits.T_IMAGE = 0.0
+            coherence_slits.T_INCIDENCE = 0.0
+            coherence_slits.T_REFLECTION = 180.0
+            coherence_slits.T_SOURCE = 0.0
+
+            self._coherence_slits = ShadowOpticalElement(coherence_slits)
 
-        coherence_slits = Shadow.OE()
+            self._initialize_kb(input_features, reflectivity_file, vkb_error_profile_file, hkb_error_profile_file)
 
-        # COHERENCE SLITS
-        coherence_slits.DUMMY = 0.1
-        coherence_slits.FWRITE = 3
-        coherence_slits.F_REFRAC = 2
-        coherence_slits.F_SCREEN = 1
-        coherence_slits.I_SLIT = numpy.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        coherence_slits.N_SCREEN = 1
-        coherence_slits.CX_SLIT = numpy.array([input_features.get_parameter("coh_slits_h_center"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
-        coherence_slits.CZ_SLIT = numpy.array([input_features.get_parameter("coh_slits_v_center"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
-        coherence_slits.RX_SLIT = numpy.array([input_features.get_parameter("coh_slits_h_aperture"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
-        coherence_slits.RZ_SLIT = numpy.array([input_features.get_parameter("coh_slits_v_aperture"), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
-        coherence_slits.T_IMAGE = 0.0
-        coherence_slits.T_INCIDENCE = 0.0
-        coherence_slits.T_REFLECTION = 180.0
-        coherence_slits.T_SOURCE = 0.0
+            self._slits_stage_cache = StageCache(stage_cache_versions)
+            self._vkb_stage_cache   = StageCache(stage_cache_versions)
+            self._hkb_stage_cache   = StageCache(stage_cache_versions)
 
-        self._coherence_slits = ShadowOpticalElement(coherence_slits)
+    def clean_up(self):
+        if self._workspace is None: clean_up()
+        else: self._workspace.clean_up()
 
-        self._initialize_kb(input_features, reflectivity_file, vkb_error_profile_file, hkb_error_profile_file)
+    def close(self):
+        if self._owns_workspace: self._workspace.remove()
 
-        self._modified_elements = [self._coherence_slits, self._vkb, self._hkb]
+        self._workspace      = None
+        self._owns_workspace = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _in_workspace(self):
+        return nullcontext() if self._workspace is None else self._workspace
 
     def perturbate_input_photon_beam(self, shift_h=None, shift_v=None, rotation_h=None, rotation_v=None):
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
 
+        # the input beam is shared with the snapshots: the perturbation is applied to a private copy
+        if self._copy_on_write: self._input_beam = self._input_beam.duplicate().make_writable()
+        else:                   self._input_beam = self._input_beam.duplicate()
+
         good_only = numpy.where(self._input_beam._beam.rays[:, 9] == 1)
 
         if not shift_h is None: self._input_beam._beam.rays[good_only, 0] += shift_h
@@ -144,9 +218,19 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
             self._input_beam._beam.rays[good_only, 4] = v_out[1]
             self._input_beam._beam.rays[good_only, 5] = v_out[2]
 
+        self.__input_beam_changed()
+
     def restore_input_photon_beam(self):
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
         self._input_beam = self.__initial_input_beam.duplicate()
+        self.__input_beam_changed()
+
+    # root of the stage keys: the content of the beam is hashed only when the output beams are cached across states
+    def __input_beam_changed(self):
+        self.__input_beam_version += 1
+
+        if self._beam_cache is None: self._input_beam_key = "input beam version " + str(self.__input_beam_version)
+        else:                        self._input_beam_key = get_beam_fingerprint(self._input_beam)
 
         #####################################################################################
         # This methods represent the run-time interface, to interact with the optical system
@@ -166,10 +250,6 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
         if not coh_slits_h_aperture is None: self._coherence_slits._oe.RX_SLIT = numpy.array([round(factor*coh_slits_h_aperture, round_digit), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
         if not coh_slits_v_aperture is None: self._coherence_slits._oe.RZ_SLIT = numpy.array([round(factor*coh_slits_v_aperture, round_digit), 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
 
-        if not self._coherence_slits in self._modified_elements: self._modified_elements.append(self._coherence_slits)
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_coherence_slits_parameters(self, units=DistanceUnits.MICRON):  # center x, center z, aperture x, aperture z
         if self._coherence_slits is None: raise ValueError("Initialize Focusing Optics System first")
 
@@ -252,6 +332,109 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
 
         return element._oe.SIMAG
 
+    #####################################################################################
+    # Motor state: absolute positions with the keys and units of get_default_input_features()
+    # (mm for slits and translations, rad for pitch angles, micron for benders)
+
+    def get_motor_state(self):
+        h_center, v_center, h_aperture, v_aperture = self.get_coherence_slits_parameters(units=DistanceUnits.MILLIMETERS)
+
+        motor_state = {
+            "coh_slits_h_center"            : float(h_center[0]),
+            "coh_slits_v_center"            : float(v_center[0]),
+            "coh_slits_h_aperture"          : float(h_aperture[0]),
+            "coh_slits_v_aperture"          : float(v_aperture[0]),
+            "vkb_motor_3_pitch_angle"       : float(self.get_vkb_motor_3_pitch(units=AngularUnits.RADIANS)),
+            "vkb_motor_3_delta_pitch_angle" : 0.0,
+            "vkb_motor_4_translation"       : float(self.get_vkb_motor_4_translation(units=DistanceUnits.MILLIMETERS)),
+            "hkb_motor_3_pitch_angle"       : float(self.get_hkb_motor_3_pitch(units=AngularUnits.RADIANS)),
+            "hkb_motor_3_delta_pitch_angle" : 0.0,
+            "hkb_motor_4_translation"       : float(self.get_hkb_motor_4_translation(units=DistanceUnits.MILLIMETERS)),
+        }
+        motor_state.update(self._get_kb_shape_state())
+
+        return motor_state
+
+    def set_motor_state(self, motor_state):
+        def get_value(name):
+            try:    return motor_state[name]
+            except: return None
+
+        self.modify_coherence_slits(coh_slits_h_center=get_value("coh_slits_h_center"),
+                                    coh_slits_v_center=get_value("coh_slits_v_center"),
+                                    coh_slits_h_aperture=get_value("coh_slits_h_aperture"),
+                                    coh_slits_v_aperture=get_value("coh_slits_v_aperture"),
+                                    units=DistanceUnits.MILLIMETERS)
+
+        for kb, move_motor_3_pitch, get_motor_3_pitch, move_motor_4_translation in \
+                [["vkb", self.move_vkb_motor_3_pitch, self.get_vkb_motor_3_pitch, self.move_vkb_motor_4_translation],
+                 ["hkb", self.move_hkb_motor_3_pitch, self.get_hkb_motor_3_pitch, self.move_hkb_motor_4_translation]]:
+            pitch_angle       = get_value(kb + "_motor_3_pitch_angle")
+            delta_pitch_angle = get_value(kb + "_motor_3_delta_pitch_angle")
+
+            # as in initialize, the delta is added to the (given or current) pitch angle
+            if not (pitch_angle is None and delta_pitch_angle is None):
+                if pitch_angle is None: pitch_angle = get_motor_3_pitch(units=AngularUnits.RADIANS)
+                if not delta_pitch_angle is None: pitch_angle += delta_pitch_angle
+                move_motor_3_pitch(pitch_angle, movement=Movement.ABSOLUTE, units=AngularUnits.RADIANS)
+
+            # the translation is projected on the current pitch angle: it has to follow the pitch
+            translation = get_value(kb + "_motor_4_translation")
+            if not translation is None: move_motor_4_translation(translation, movement=Movement.ABSOLUTE, units=DistanceUnits.MILLIMETERS)
+
+        self._set_kb_shape_state(get_value)
+
+    def _get_kb_shape_state(self): raise NotImplementedError()
+    def _set_kb_shape_state(self, get_value): raise NotImplementedError()
+
+    #####################################################################################
+    # Snapshots: the OE parameters, the shape of the KBs and the input and stage beams (by
+    # reference). Restoring a snapshot does not trace anything: the stage beams are put back
+    # in the stage caches and marked as current, so the next get_photon_beam with the same
+    # options and random seed (or without one) returns them.
+
+    def snapshot(self):
+        if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
+
+        return FocusingOpticsSnapshot(owner=self,
+                                      optical_elements=[element._oe.duplicate() for element in self._get_optical_elements()],
+                                      shape_snapshot=self._get_shape_snapshot(),
+                                      input_beam=self._input_beam, # never changed in place: perturbate_input_photon_beam copies it
+                                      input_beam_key=self._input_beam_key,
+                                      stage_beams=[self._slits_beam, self._vkb_beam, self._hkb_beam],
+                                      stage_beam_keys=list(self._stage_beam_keys))
+
+    def restore(self, token):
+        if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
+        if not isinstance(token, FocusingOpticsSnapshot) or not token.owner is self: raise ValueError("Snapshot not taken from this Focusing Optical System")
+
+        # the OE wrappers are kept: the bender widgets refer to them
+        for element, oe in zip(self._get_optical_elements(), token.optical_elements): element._oe = oe.duplicate()
+
+        self._restore_shape_snapshot(token.shape_snapshot)
+
+        self._input_beam     = token.input_beam
+        self._input_beam_key = token.input_beam_key
+
+        self._slits_beam, self._vkb_beam, self._hkb_beam = token.stage_beams
+        self._stage_beam_keys = list(token.stage_beam_keys)
+
+        for stage_cache, stage_beam, stage_beam_key in zip([self._slits_stage_cache, self._vkb_stage_cache, self._hkb_stage_cache],
+                                                           token.stage_beams,
+                                                           token.stage_beam_keys):
+            if not (stage_beam is None or stage_beam_key is None): stage_cache.put(stage_beam_key, stage_beam)
+
+        # the next call without random seed returns the restored beams, instead of tracing a new realization
+        self.__stage_beams_restored = True
+
+    def _get_optical_elements(self):
+        return [self._coherence_slits] + \
+               (self._vkb if isinstance(self._vkb, list) else [self._vkb]) + \
+               (self._hkb if isinstance(self._hkb, list) else [self._hkb])
+
+    def _get_shape_snapshot(self): raise NotImplementedError()
+    def _restore_shape_snapshot(self, shape_snapshot): raise NotImplementedError()
+
     #####################################################################################
     # Run the simulation
 
@@ -262,53 +445,131 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
         except: debug_mode = False
         try:    random_seed = kwargs["random_seed"]
         except: random_seed = None
+        try:    profiler = kwargs["profiler"] # a util.profiling.Profiler, recording the stages of the call
+        except: profiler = None
 
         if self._input_beam is None: raise ValueError("Focusing Optical System is not initialized")
 
-        self._check_beam(self._input_beam, "Primary Optical System", remove_lost_rays)
+        with active_profiler(profiler), get_profiler().stage("get_photon_beam", rays_in=get_ray_count(self._input_beam), random_seed=random_seed,
+                                                             near_field_calculation=near_field_calculation) as stage:
+            output_beam = self.__get_photon_beam(near_field_calculation, remove_lost_rays, verbose, debug_mode, random_seed)
+            stage.set(rays_out=get_ray_count(output_beam))
 
-        if not verbose:
-            fortran_suppressor = TTYInibitor()
-            fortran_suppressor.start()
+        return output_beam
 
-        output_beam = None
+    def __get_photon_beam(self, near_field_calculation, remove_lost_rays, verbose, debug_mode, random_seed):
 
-        try:
-            run_all = self._modified_elements == [] or len(self._modified_elements) == 3
+        slits_key, vkb_key, hkb_key = self._get_stage_keys(near_field_calculation, remove_lost_rays, random_seed)
 
-            if run_all or self._coherence_slits in self._modified_elements:
-                self._slits_beam = self._trace_coherence_slits(random_seed, remove_lost_rays, verbose)
-                output_beam      = self._slits_beam
+        stage_beams_restored, self.__stage_beams_restored = self.__stage_beams_restored, False
 
-                if debug_mode: plot_shadow_beam_spatial_distribution(self._slits_beam, title="Coherence Slits", xrange=None, yrange=None)
+        # without a random seed the output is not reproducible: nothing to cache
+        if self._beam_cache is None or random_seed is None: cache_key = None
+        else:
+            cache_key   = get_cache_key(self.__class__.__name__, hkb_key)
 
-            if run_all or self._vkb in self._modified_elements:
-                self._vkb_beam = self._trace_vkb(random_seed, remove_lost_rays, verbose)
-                output_beam    = self._vkb_beam
+            with get_profiler().stage("beam cache") as stage:
+                cached_beam = self._beam_cache.get(cache_key)
+                stage.set(hit=not cached_beam is None)
 
-                if debug_mode: plot_shadow_beam_spatial_distribution(self._vkb_beam, title="VKB", xrange=None, yrange=None)
+            if not cached_beam is None:
+                oe_number, initial_flux, rays = cached_beam
 
-            if run_all or self._hkb in self._modified_elements:
-                self._hkb_beam = self._trace_hkb(near_field_calculation, random_seed, remove_lost_rays, verbose)
-                output_beam    = self._hkb_beam
+                if self._copy_on_write: return CopyOnWriteShadowBeam.from_rays(rays, oe_number, initial_flux)
+                else:                   return create_shadow_beam(rays.copy(), oe_number, initial_flux)
 
-                if debug_mode: plot_shadow_beam_spatial_distribution(self._hkb_beam, title="HKB", xrange=None, yrange=None)
+        with self._in_workspace():
+            self._check_beam(self._input_beam, "Primary Optical System", remove_lost_rays)
 
-            # after every run, the list of modified elements must be empty
-            self._modified_elements = []
+            with FortranOutputCapture(enabled=not verbose):
+                # a stage is traced only if its output for the current parameters and upstream state is not cached.
+                # Without random seed the outputs are not reproducible: no cache lookups, the current beams of the
+                # stages upstream of the first changed one are reused (from the first stage, if nothing changed,
+                # unless the beams have just been restored from a snapshot)
+                if random_seed is None:
+                    first_changed = self.__get_first_changed_stage([slits_key, vkb_key, hkb_key], stage_beams_restored)
+                    current_beams = [self._slits_beam, self._vkb_beam, self._hkb_beam]
 
-        except Exception as e:
-            if not verbose:
-                try:    fortran_suppressor.stop()
-                except: pass
+                    get_stage_beam = lambda index, stage_cache, key: current_beams[index] if index < first_changed else None
+                else:
+                    get_stage_beam = lambda index, stage_cache, key: stage_cache.get(key)
 
-            raise e
-        else:
-            if not verbose:
-                try:    fortran_suppressor.stop()
-                except: pass
+                self._hkb_beam = get_stage_beam(2, self._hkb_stage_cache, hkb_key)
+
+                if self._hkb_beam is None:
+                    self._vkb_beam = get_stage_beam(1, self._vkb_stage_cache, vkb_key)
+
+                    if self._vkb_beam is None:
+                        self._slits_beam = get_stage_beam(0, self._slits_stage_cache, slits_key)
+
+                        if self._slits_beam is None:
+                            with get_profiler().stage("Coherence Slits", category="stage", rays_in=get_ray_count(self._input_beam)) as stage:
+                                self._slits_beam = self._own_stage_beam(self._trace_coherence_slits(random_seed, remove_lost_rays, verbose))
+                                stage.set(rays_out=get_ray_count(self._slits_beam))
+                            self._slits_stage_cache.put(slits_key, self._slits_beam)
+
+                            if debug_mode: plot_shadow_beam_spatial_distribution(self._slits_beam, title="Coherence Slits", xrange=None, yrange=None)
+
+                        self._stage_beam_keys[0] = slits_key
+
+                        with get_profiler().stage("V-KB", category="stage", rays_in=get_ray_count(self._slits_beam)) as stage:
+                            self._vkb_beam = self._own_stage_beam(self._trace_vkb(random_seed, remove_lost_rays, verbose))
+                            stage.set(rays_out=get_ray_count(self._vkb_beam))
+                        self._vkb_stage_cache.put(vkb_key, self._vkb_beam)
+
+                        if debug_mode: plot_shadow_beam_spatial_distribution(self._vkb_beam, title="VKB", xrange=None, yrange=None)
+
+                    self._stage_beam_keys[1] = vkb_key
 
-        return output_beam.duplicate(history=False)
+                    # the H-KB stage includes the final rotation of the axis system
+                    with get_profiler().stage("H-KB", category="stage", rays_in=get_ray_count(self._vkb_beam)) as stage:
+                        self._hkb_beam = self._own_stage_beam(self._trace_hkb(near_field_calculation, random_seed, remove_lost_rays, verbose))
+                        stage.set(rays_out=get_ray_count(self._hkb_beam))
+                    self._hkb_stage_cache.put(hkb_key, self._hkb_beam)
+
+                    if debug_mode: plot_shadow_beam_spatial_distribution(self._hkb_beam, title="HKB", xrange=None, yrange=None)
+
+                self._stage_beam_keys[2] = hkb_key
+
+                output_beam = self._hkb_beam
+
+        if not cache_key is None: self._beam_cache.put(cache_key, output_beam._oe_number, output_beam.get_initial_flux(), output_beam._beam.rays)
+
+        # with copy on write, a read-only view on the rays of the H-KB stage beam, not a copy: call make_writable()
+        # before changing the rays
+        with get_profiler().stage("output copy") as stage:
+            photon_beam = output_beam.duplicate(history=False)
+            stage.set(bytes_copied=get_bytes_copied(output_beam, photon_beam))
+
+        return photon_beam
+
+    def __get_first_changed_stage(self, stage_keys, stage_beams_restored=False):
+        current_beams = [self._slits_beam, self._vkb_beam, self._hkb_beam]
+
+        for index, (key, current_key, current_beam) in enumerate(zip(stage_keys, self._stage_beam_keys, current_beams)):
+            if key != current_key or current_beam is None: return index
+
+        return len(stage_keys) if stage_beams_restored else 0
+
+    # stage DAG: input beam -> coherence slits -> V-KB -> H-KB (+ axis rotation)
+    def _get_stage_keys(self, near_field_calculation, remove_lost_rays, random_seed):
+        kb_shape_state = self._get_kb_shape_state() # q distances or bender positions (that determine the bender forces)
+
+        def get_kb_parameters(kb, prefix):
+            return [[element._oe.X_ROT, element._oe.OFFY, element._oe.OFFZ, element._oe.SIMAG] for element in (kb if isinstance(kb, list) else [kb])] + \
+                   [[name, value] for name, value in sorted(kb_shape_state.items()) if name.startswith(prefix)]
+
+        slits_key = get_cache_key(self._input_beam_key,
+                                  random_seed,
+                                  remove_lost_rays,
+                                  [self._coherence_slits._oe.CX_SLIT[0],
+                                   self._coherence_slits._oe.CZ_SLIT[0],
+                                   self._coherence_slits._oe.RX_SLIT[0],
+                                   self._coherence_slits._oe.RZ_SLIT[0]])
+        vkb_key   = get_cache_key(slits_key, get_kb_parameters(self._vkb, "vkb"))
+        hkb_key   = get_cache_key(vkb_key, near_field_calculation, get_kb_parameters(self._hkb, "hkb"))
+
+        return slits_key, vkb_key, hkb_key
 
     def _trace_coherence_slits(self, random_seed, remove_lost_rays, verbose):
         output_beam = self._trace_oe(input_beam=self._input_beam,
@@ -319,11 +580,11 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
 
         # HYBRID CORRECTION TO CONSIDER DIFFRACTION FROM SLITS
         try:
-            return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                     diffraction_plane=4,  # BOTH 1D+1D (3 is 2D)
-                                                                     calcType=1,  # Diffraction by Simple Aperture
-                                                                     verbose=verbose,
-                                                                     random_seed=None if random_seed is None else (random_seed + 100))).ff_beam
+            return self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                diffraction_plane=4,  # BOTH 1D+1D (3 is 2D)
+                                                                calcType=1,  # Diffraction by Simple Aperture
+                                                                verbose=verbose,
+                                                                random_seed=None if random_seed is None else (random_seed + 100)), oe_name="Coherence Slits").ff_beam
         except Exception:
             raise HybridFailureException(oe="Coherence Slits")
 
@@ -331,24 +592,57 @@ class _FocusingOpticsCommon(AbstractSimulatedFocusingOptics):
     def _trace_hkb(self, near_field_calculation, random_seed, remove_lost_rays, verbose): raise NotImplementedError()
 
     def _trace_oe(self, input_beam, shadow_oe, widget_class_name, oe_name, remove_lost_rays, history=True):
-        return self._check_beam(ShadowBeam.traceFromOE(input_beam, #.duplicate(history=history),
-                                                       shadow_oe.duplicate(),
-                                                       widget_class_name=widget_class_name,
-                                                       history=history,
-                                                       recursive_history=False),
-                                oe_name, remove_lost_rays)
+        with get_profiler().stage("trace_oe", oe=oe_name, rays_in=get_ray_count(input_beam)) as stage:
+            output_beam = ShadowBeam.traceFromOE(input_beam, #.duplicate(history=history),
+                                                 shadow_oe.duplicate(),
+                                                 widget_class_name=widget_class_name,
+                                                 history=history,
+                                                 recursive_history=False)
+            stage.set(rays_out=get_ray_count(output_beam), bytes_copied=get_bytes_copied(input_beam, output_beam))
+
+        # traced from a copy on write beam: the rays are private (copied by traceOE), hybrid writes them in place
+        if isinstance(output_beam, CopyOnWriteShadowBeam): output_beam = output_beam.release(history=history)
+
+        return self._check_beam(output_beam, oe_name, remove_lost_rays)
+
+    # the traced beams are private: with copy on write the stage beam takes their rays, the returned beams share them
+    def _own_stage_beam(self, output_beam):
+        return CopyOnWriteShadowBeam.adopt_beam(output_beam) if self._copy_on_write else output_beam
+
+    def _run_hybrid(self, input_parameters, oe_name):
+        with get_profiler().stage("hybrid", oe=oe_name, rays_in=get_ray_count(input_parameters.shadow_beam),
+                                  fftnpts=input_parameters.ghy_fftnpts, near_field=input_parameters.ghy_nf) as stage:
+            calculation_parameters = hybrid_control.hy_run(input_parameters)
+
+            output_beam = calculation_parameters.nf_beam if input_parameters.ghy_nf == 1 else calculation_parameters.ff_beam
+            stage.set(rays_out=get_ray_count(output_beam), bytes_copied=get_bytes_copied(input_parameters.shadow_beam, output_beam))
+
+        return calculation_parameters
+
+    def _rotate_axis_system(self, input_beam, rotation_angle=270.0):
+        with get_profiler().stage("rotate_axis_system", rays_in=get_ray_count(input_beam)) as stage:
+            output_beam = rotate_axis_system(input_beam, rotation_angle=rotation_angle)
+            stage.set(rays_out=get_ray_count(output_beam), bytes_copied=get_bytes_copied(input_beam, output_beam))
+
+        return output_beam
 
     def _check_beam(self, output_beam, oe, remove_lost_rays):
-        if ShadowCongruence.checkEmptyBeam(output_beam):
-            if ShadowCongruence.checkGoodBeam(output_beam):
-                if remove_lost_rays: output_beam._beam.rays = output_beam._beam.rays[numpy.where(output_beam._beam.rays[:, 9] == 1)]
-                return output_beam
+        with get_profiler().stage("check_beam", oe=oe, rays_in=get_ray_count(output_beam)) as stage:
+            if ShadowCongruence.checkEmptyBeam(output_beam):
+                if ShadowCongruence.checkGoodBeam(output_beam):
+                    if remove_lost_rays:
+                        good_rays = output_beam._beam.rays[:, 9] == 1
+                        if not numpy.all(good_rays):
+                            output_beam._beam.rays = output_beam._beam.rays[good_rays]
+                            stage.set(bytes_copied=output_beam._beam.rays.nbytes)
+                    stage.set(rays_out=get_ray_count(output_beam))
+                    return output_beam
+                else: raise EmptyBeamException(oe)
             else: raise EmptyBeamException(oe)
-        else: raise EmptyBeamException(oe)
 
 class __IdealFocusingOptics(_FocusingOpticsCommon):
     def __init__(self):
-        super(_FocusingOpticsCommon, self).__init__()
+        super().__init__()
 
     def _initialize_kb(self, input_features, reflectivity_file, vkb_error_profile_file, hkb_error_profile_file):
         # V-KB
@@ -435,9 +729,6 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_3_pitch(self._vkb, angle, movement, units,
                                  round_digit=MotorResolution.getInstance().get_vkb_motor_3_pitch_resolution(units=AngularUnits.DEGREES)[1], invert=True)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS):
         return self._get_motor_3_pitch(self._vkb, units, invert=True)
 
@@ -445,9 +736,6 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_4_transation(self._vkb, translation, movement, units,
                                       round_digit=MotorResolution.getInstance().get_vkb_motor_4_translation_resolution(units=DistanceUnits.MILLIMETERS)[1], invert=True)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_4_translation(self, units=DistanceUnits.MICRON):
         return self._get_motor_4_translation(self._vkb, units, invert=True)
 
@@ -455,8 +743,6 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_3_pitch(self._hkb, angle, movement, units,
                                  round_digit=MotorResolution.getInstance().get_hkb_motor_3_pitch_resolution(units=AngularUnits.DEGREES)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS):
         return self._get_motor_3_pitch(self._hkb, units)
 
@@ -464,17 +750,12 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_4_transation(self._hkb, translation, movement, units,
                                       round_digit=MotorResolution.getInstance().get_hkb_motor_4_translation_resolution(units=DistanceUnits.MILLIMETERS)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_4_translation(self, units=DistanceUnits.MICRON):
         return self._get_motor_4_translation(self._hkb, units)
 
     def change_vkb_shape(self, q_distance, movement=Movement.ABSOLUTE):
         self.__change_shape(self._vkb, q_distance, movement)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_q_distance(self):
         return self._get_q_distance(self._vkb)
 
@@ -483,13 +764,26 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
     def change_hkb_shape(self, q_distance, movement=Movement.ABSOLUTE):
         self.__change_shape(self._hkb, q_distance, movement)
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_q_distance(self):
         return self._get_q_distance(self._hkb)
 
     # IMPLEMENTATION OF PROTECTED METHODS FROM SUPERCLASS
 
+    def _get_kb_shape_state(self):
+        return {"vkb_q_distance" : float(self.get_vkb_q_distance()),
+                "hkb_q_distance" : float(self.get_hkb_q_distance())}
+
+    def _set_kb_shape_state(self, get_value):
+        vkb_q_distance = get_value("vkb_q_distance")
+        hkb_q_distance = get_value("hkb_q_distance")
+
+        if not vkb_q_distance is None: self.change_vkb_shape(vkb_q_distance, movement=Movement.ABSOLUTE)
+        if not hkb_q_distance is None: self.change_hkb_shape(hkb_q_distance, movement=Movement.ABSOLUTE)
+
+    # the q distances are OE parameters
+    def _get_shape_snapshot(self): return None
+    def _restore_shape_snapshot(self, shape_snapshot): pass
+
     def _trace_vkb(self, random_seed, remove_lost_rays, verbose):
         output_beam =  self._trace_oe(input_beam=self._slits_beam,
                                       shadow_oe=self._vkb,
@@ -499,11 +793,11 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
 
         # NOTE: Near field not possible for vkb (beam is untraceable)
         try:
-            return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                     diffraction_plane=2,  # Tangential
-                                                                     calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                     verbose=verbose,
-                                                                     random_seed=None if random_seed is None else (random_seed + 200))).ff_beam
+            return self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                diffraction_plane=2,  # Tangential
+                                                                calcType=3,  # Diffraction by Mirror Size + Errors
+                                                                verbose=verbose,
+                                                                random_seed=None if random_seed is None else (random_seed + 200)), oe_name="V-KB").ff_beam
         except Exception:
             raise HybridFailureException(oe="V-KB")
 
@@ -515,22 +809,22 @@ class __IdealFocusingOptics(_FocusingOpticsCommon):
                               remove_lost_rays=remove_lost_rays)
         try:
             if not near_field_calculation:
-                output_beam = hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                                diffraction_plane=2,  # Tangential
-                                                                                calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                                verbose=verbose,
-                                                                                random_seed=None if random_seed is None else (random_seed + 300))).ff_beam
+                output_beam = self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                           diffraction_plane=2,  # Tangential
+                                                                           calcType=3,  # Diffraction by Mirror Size + Errors
+                                                                           verbose=verbose,
+                                                                           random_seed=None if random_seed is None else (random_seed + 300)), oe_name="H-KB").ff_beam
             else:
-                output_beam = hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                                diffraction_plane=2,  # Tangential
-                                                                                calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                                nf=1,
-                                                                                verbose=verbose,
-                                                                                random_seed=None if random_seed is None else (random_seed + 300))).nf_beam
+                output_beam = self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                           diffraction_plane=2,  # Tangential
+                                                                           calcType=3,  # Diffraction by Mirror Size + Errors
+                                                                           nf=1,
+                                                                           verbose=verbose,
+                                                                           random_seed=None if random_seed is None else (random_seed + 300)), oe_name="H-KB").nf_beam
         except Exception:
             raise HybridFailureException(oe="H-KB")
 
-        output_beam = rotate_axis_system(output_beam, rotation_angle=270.0)
+        output_beam = self._rotate_axis_system(output_beam, rotation_angle=270.0)
 
         return output_beam
 
@@ -549,7 +843,7 @@ from orangecontrib.shadow_advanced_tools.widgets.optical_elements.bl.double_rod_
 
 class __BendableFocusingOptics(_FocusingOpticsCommon):
     def __init__(self):
-        super(_FocusingOpticsCommon, self).__init__()
+        super().__init__()
 
     def initialize(self,
                    input_photon_beam,
@@ -557,20 +851,22 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
                    **kwargs):
 
         super().initialize(input_photon_beam, input_features, **kwargs)
-        
-        self.__vkb_bender_manager = BenderManager(kb_upstream=VKBMockWidget(self._vkb[0], verbose=True, label="Upstream"),
-                                                  kb_downstream=VKBMockWidget(self._vkb[1], verbose=True, label="Downstream"))
-        self.__vkb_bender_manager.load_calibration("V-KB")
-        self.__vkb_bender_manager.set_positions(input_features.get_parameter("vkb_motor_1_bender_position"),
-                                                input_features.get_parameter("vkb_motor_2_bender_position"))
-        self.__vkb_bender_manager.remove_bender_files()
-
-        self.__hkb_bender_manager = BenderManager(kb_upstream=HKBMockWidget(self._hkb[0], verbose=True, label="Upstream"),
-                                                  kb_downstream=HKBMockWidget(self._hkb[1], verbose=True, label="Downstream"))
-        self.__hkb_bender_manager.load_calibration("H-KB")
-        self.__hkb_bender_manager.set_positions(input_features.get_parameter("hkb_motor_1_bender_position"),
-                                                input_features.get_parameter("hkb_motor_2_bender_position"))
-        self.__hkb_bender_manager.remove_bender_files()
+
+        # the bender profile files are written in the workspace
+        with self._in_workspace():
+            self.__vkb_bender_manager = BenderManager(kb_upstream=VKBMockWidget(self._vkb[0], verbose=True, label="Upstream"),
+                                                      kb_downstream=VKBMockWidget(self._vkb[1], verbose=True, label="Downstream"))
+            self.__vkb_bender_manager.load_calibration("V-KB")
+            self.__vkb_bender_manager.set_positions(input_features.get_parameter("vkb_motor_1_bender_position"),
+                                                    input_features.get_parameter("vkb_motor_2_bender_position"))
+            self.__vkb_bender_manager.remove_bender_files()
+
+            self.__hkb_bender_manager = BenderManager(kb_upstream=HKBMockWidget(self._hkb[0], verbose=True, label="Upstream"),
+                                                      kb_downstream=HKBMockWidget(self._hkb[1], verbose=True, label="Downstream"))
+            self.__hkb_bender_manager.load_calibration("H-KB")
+            self.__hkb_bender_manager.set_positions(input_features.get_parameter("hkb_motor_1_bender_position"),
+                                                    input_features.get_parameter("hkb_motor_2_bender_position"))
+            self.__hkb_bender_manager.remove_bender_files()
 
     def _initialize_kb(self, input_features, reflectivity_file, vkb_error_profile_file, hkb_error_profile_file):
         # V-KB --------------------
@@ -722,9 +1018,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self.__move_motor_1_2_bender(self.__vkb_bender_manager, pos_upstream, None, movement, units,
                                      round_digit=MotorResolution.getInstance().get_vkb_motor_1_2_bender_resolution(units=DistanceUnits.MICRON)[1])
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_1_bender(self, units=DistanceUnits.MICRON): 
         return self.__get_motor_1_2_bender(self.__vkb_bender_manager, units)[0]
     
@@ -732,9 +1025,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self.__move_motor_1_2_bender(self.__vkb_bender_manager, None, pos_downstream, movement, units,
                                      round_digit=MotorResolution.getInstance().get_vkb_motor_1_2_bender_resolution(units=DistanceUnits.MICRON)[1])
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_2_bender(self, units=DistanceUnits.MICRON):
         return self.__get_motor_1_2_bender(self.__vkb_bender_manager, units)[1]
 
@@ -748,9 +1038,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_3_pitch(self._vkb[1], angle, movement, units,
                                  round_digit=MotorResolution.getInstance().get_vkb_motor_3_pitch_resolution(units=AngularUnits.DEGREES)[1], invert=True)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS):
         # motor 3/4 are identical for the two sides
         return self._get_motor_3_pitch(self._vkb[0], units, invert=True)
@@ -761,9 +1048,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_4_transation(self._vkb[1], translation, movement, units,
                                       round_digit=MotorResolution.getInstance().get_vkb_motor_4_translation_resolution(units=DistanceUnits.MILLIMETERS)[1], invert=True)
 
-        if not self._vkb in self._modified_elements: self._modified_elements.append(self._vkb)
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_vkb_motor_4_translation(self, units=DistanceUnits.MICRON):
         # motor 3/4 are identical for the two sides
         return self._get_motor_4_translation(self._vkb[0], units, invert=True)
@@ -774,8 +1058,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self.__move_motor_1_2_bender(self.__hkb_bender_manager, pos_upstream, None, movement, units,
                                      round_digit=MotorResolution.getInstance().get_hkb_motor_1_2_bender_resolution(units=DistanceUnits.MICRON)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_1_bender(self, units=DistanceUnits.MICRON):
         return self.__get_motor_1_2_bender(self.__hkb_bender_manager, units)[0]
 
@@ -783,8 +1065,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self.__move_motor_1_2_bender(self.__hkb_bender_manager, None, pos_downstream, movement, units,
                                      round_digit=MotorResolution.getInstance().get_hkb_motor_1_2_bender_resolution(units=DistanceUnits.MICRON)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_2_bender(self, units=DistanceUnits.MICRON):
         return self.__get_motor_1_2_bender(self.__hkb_bender_manager, units)[1]
 
@@ -797,8 +1077,6 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_3_pitch(self._hkb[1], angle, movement, units,
                                  round_digit=MotorResolution.getInstance().get_hkb_motor_3_pitch_resolution(units=AngularUnits.DEGREES)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_3_pitch(self, units=AngularUnits.MILLIRADIANS):
         # motor 3/4 are identical for the two sides
         return self._get_motor_3_pitch(self._hkb[0], units)
@@ -809,14 +1087,43 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         self._move_motor_4_transation(self._hkb[1], translation, movement, units,
                                       round_digit=MotorResolution.getInstance().get_hkb_motor_4_translation_resolution(units=DistanceUnits.MILLIMETERS)[1])
 
-        if not self._hkb in self._modified_elements: self._modified_elements.append(self._hkb)
-
     def get_hkb_motor_4_translation(self, units=DistanceUnits.MICRON):
         # motor 3/4 are identical for the two sides
         return self._get_motor_4_translation(self._hkb[0], units)
 
     # IMPLEMENTATION OF PROTECTED METHODS FROM SUPERCLASS
 
+    def _get_kb_shape_state(self):
+        return {"vkb_motor_1_bender_position" : float(self.get_vkb_motor_1_bender(units=DistanceUnits.MICRON)),
+                "vkb_motor_2_bender_position" : float(self.get_vkb_motor_2_bender(units=DistanceUnits.MICRON)),
+                "hkb_motor_1_bender_position" : float(self.get_hkb_motor_1_bender(units=DistanceUnits.MICRON)),
+                "hkb_motor_2_bender_position" : float(self.get_hkb_motor_2_bender(units=DistanceUnits.MICRON))}
+
+    def _set_kb_shape_state(self, get_value):
+        for name, move_motor in [["vkb_motor_1_bender_position", self.move_vkb_motor_1_bender],
+                                 ["vkb_motor_2_bender_position", self.move_vkb_motor_2_bender],
+                                 ["hkb_motor_1_bender_position", self.move_hkb_motor_1_bender],
+                                 ["hkb_motor_2_bender_position", self.move_hkb_motor_2_bender]]:
+            position = get_value(name)
+            if not position is None: move_motor(position, movement=Movement.ABSOLUTE, units=DistanceUnits.MICRON)
+
+    # forces and widget quantities of the benders (the OEs of the widgets are snapshot by the superclass).
+    # The previous forces are not restored: they refer to the bender profile files on disk
+    def _get_shape_snapshot(self):
+        def get_widget_state(widget): return {name: value for name, value in vars(widget).items() if name != "shadow_oe"}
+
+        return [[bender_manager.F_upstream, bender_manager.F_downstream,
+                 get_widget_state(bender_manager._kb_upstream), get_widget_state(bender_manager._kb_downstream)]
+                for bender_manager in [self.__vkb_bender_manager, self.__hkb_bender_manager]]
+
+    def _restore_shape_snapshot(self, shape_snapshot):
+        for bender_manager, (F_upstream, F_downstream, upstream_widget_state, downstream_widget_state) in \
+                zip([self.__vkb_bender_manager, self.__hkb_bender_manager], shape_snapshot):
+            bender_manager.F_upstream   = F_upstream
+            bender_manager.F_downstream = F_downstream
+            vars(bender_manager._kb_upstream).update(upstream_widget_state)
+            vars(bender_manager._kb_downstream).update(downstream_widget_state)
+
     def _trace_vkb(self, random_seed, remove_lost_rays, verbose):
         output_beam_upstream, cursor_upstream, output_beam_downstream, cursor_downstream =  \
             self.__trace_kb(bender_manager=self.__vkb_bender_manager,
@@ -828,11 +1135,11 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         def run_hybrid(output_beam, increment):
             # NOTE: Near field not possible for vkb (beam is untraceable)
             try:
-                return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                         diffraction_plane=2,  # Tangential
-                                                                         calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                         verbose=verbose,
-                                                                         random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
+                return self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                    diffraction_plane=2,  # Tangential
+                                                                    calcType=3,  # Diffraction by Mirror Size + Errors
+                                                                    verbose=verbose,
+                                                                    random_seed=None if random_seed is None else (random_seed + increment)), oe_name="V-KB").ff_beam
             except Exception:
                 raise HybridFailureException(oe="V-KB")
 
@@ -855,18 +1162,18 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
         def run_hybrid(output_beam, increment):
             try:
                 if not near_field_calculation:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).ff_beam
+                    return self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                        diffraction_plane=2,  # Tangential
+                                                                        calcType=3,  # Diffraction by Mirror Size + Errors
+                                                                        verbose=verbose,
+                                                                        random_seed=None if random_seed is None else (random_seed + increment)), oe_name="H-KB").ff_beam
                 else:
-                    return hybrid_control.hy_run(get_hybrid_input_parameters(output_beam,
-                                                                             diffraction_plane=2,  # Tangential
-                                                                             calcType=3,  # Diffraction by Mirror Size + Errors
-                                                                             nf=1,
-                                                                             verbose=verbose,
-                                                                             random_seed=None if random_seed is None else (random_seed + increment))).nf_beam
+                    return self._run_hybrid(get_hybrid_input_parameters(output_beam,
+                                                                        diffraction_plane=2,  # Tangential
+                                                                        calcType=3,  # Diffraction by Mirror Size + Errors
+                                                                        nf=1,
+                                                                        verbose=verbose,
+                                                                        random_seed=None if random_seed is None else (random_seed + increment)), oe_name="H-KB").nf_beam
             except Exception:
                 raise HybridFailureException(oe="H-KB")
 
@@ -878,7 +1185,7 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
 
         output_beam = ShadowBeam.mergeBeams(output_beam_upstream, output_beam_downstream, which_flux=3, merge_history=0)
 
-        return rotate_axis_system(output_beam, rotation_angle=270.0)
+        return self._rotate_axis_system(output_beam, rotation_angle=270.0)
 
     # PRIVATE METHODS
 
@@ -920,7 +1227,8 @@ class __BendableFocusingOptics(_FocusingOpticsCommon):
             if do_calculation:
                 widget.shadow_oe._oe.FILE_RIP = bytes(widget.ms_defect_file_name, 'utf-8') # restore original error profile
 
-                apply_bender_surface(widget=widget, shadow_oe=widget.shadow_oe, input_beam=input_beam)
+                with get_profiler().stage("bender surface", rays_in=get_ray_count(input_beam)):
+                    apply_bender_surface(widget=widget, shadow_oe=widget.shadow_oe, input_beam=input_beam)
             else:
                 widget.shadow_oe._oe.F_RIPPLE = 1
                 widget.shadow_oe._oe.F_G_S = 2
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from typing import NamedTuple
+
+from beamline34IDC.simulation.facade import Implementors
+from beamline34IDC.facade.focusing_optics_factory import focusing_optics_factory_method, ExecutionMode
+from beamline34IDC.simulation.facade.focusing_optics_interface import get_default_input_features
+from beamline34IDC.util.shadow.common import load_shadow_beam, create_shadow_beam, PreProcessorFiles
+from beamline34IDC.util.workspace import Workspace
+from beamline34IDC.util.profiling import get_profiler, active_profiler, get_ray_count
+
+class BatchOutput(NamedTuple):
+    photon_beam: object
+    exception: Exception
+
+#############################################################################
+# Batch evaluation of motor configurations on a pool of processes, each one
+# owning an initialized focusing optics system.
+# Shadow3 and Hybrid keep global state and write fixed file names in the
+# working directory: every worker runs in its own Workspace.
+#
+# Configurations are dictionaries with the keys of get_default_input_features(),
+# absolute positions in the same units (see get_motor_state()). Each configuration
+# is applied over the initial state of the system, so the results do not depend
+# on the order of evaluation nor on the worker that traced them.
+#
+
+class ParallelFocusingOptics():
+    def __init__(self,
+                 input_photon_beam_file_name="primary_optics_system_beam.dat",
+                 bender=False,
+                 n_workers=None,
+                 input_features=None,
+                 **kwargs):
+        try:    kwargs["rewrite_preprocessor_files"]
+        except: kwargs["rewrite_preprocessor_files"] = PreProcessorFiles.NO  # workers must not write the same files
+        try:    kwargs["rewrite_height_error_profile_files"]
+        except: kwargs["rewrite_height_error_profile_files"] = False
+        kwargs.pop("workspace", None)  # each worker has its own
+        kwargs.pop("beam_cache", None) # not shared between processes
+        if input_features is None: input_features = get_default_input_features()
+
+        self.__n_workers = os.cpu_count() if n_workers is None else n_workers
+        self.__executor  = ProcessPoolExecutor(max_workers=self.__n_workers,
+                                               initializer=_initialize_worker,
+                                               initargs=(os.path.abspath(os.curdir), input_photon_beam_file_name, bender, input_features, kwargs))
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def get_n_workers(self):
+        return self.__n_workers
+
+    def close(self, wait=True):
+        self.__executor.shutdown(wait=wait)
+
+    def get_photon_beams(self, configurations, near_field_calculation=False, remove_lost_rays=True, **kwargs):
+        '''
+        returns a list of BatchOutput, in the same order of the configurations: the exception
+        (EmptyBeamException, HybridFailureException, ...) is recorded per configuration and does not stop the batch
+        '''
+        profiler = kwargs.pop("profiler", None) # only the whole batch is timed: the stages run in the workers
+        configurations = list(configurations)
+
+        with active_profiler(profiler), get_profiler().stage("get_photon_beams", n_configurations=len(configurations), n_workers=self.__n_workers) as stage:
+            futures = [self.__executor.submit(_get_photon_beam, configuration, near_field_calculation, remove_lost_rays, kwargs)
+                       for configuration in configurations]
+
+            outputs = []
+            for future in futures:
+                try:
+                    oe_number, rays, exception = future.result()
+                    outputs.append(BatchOutput(photon_beam=None if rays is None else create_shadow_beam(rays, oe_number), exception=exception))
+                except Exception as exception: # the worker crashed or the result could not be sent back
+                    outputs.append(BatchOutput(photon_beam=None, exception=exception))
+
+            stage.set(rays_out=sum([get_ray_count(output.photon_beam) for output in outputs]))
+
+        return outputs
+
+    def submit(self, function, *args, **kwargs):
+        '''
+        runs function(focusing_system, *args, **kwargs) in a worker, returns a Future.
+        function and its result must be picklable: module-level functions returning arrays or numbers
+        '''
+        return self.__executor.submit(_run_function, function, args, kwargs)
+
+def get_photon_beams(configurations, input_photon_beam_file_name="primary_optics_system_beam.dat", bender=False, n_workers=None, **kwargs):
+    try:    random_seed = kwargs["random_seed"]
+    except: random_seed = None
+    try:    verbose = kwargs["verbose"]
+    except: verbose = False
+    try:    near_field_calculation = kwargs["near_field_calculation"]
+    except: near_field_calculation = False
+    try:    remove_lost_rays = kwargs["remove_lost_rays"]
+    except: remove_lost_rays = True
+
+    with ParallelFocusingOptics(input_photon_beam_file_name=input_photon_beam_file_name, bender=bender, n_workers=n_workers) as parallel_focusing_optics:
+        return parallel_focusing_optics.get_photon_beams(configurations,
+                                                         near_field_calculation=near_field_calculation,
+                                                         remove_lost_rays=remove_lost_rays,
+                                                         random_seed=random_seed,
+                                                         verbose=verbose)
+
+#############################################################################
+# WORKER PROCESS
+
+__focusing_system = None
+__initial_motor_state = None
+
+def get_worker_focusing_system():
+    return __focusing_system
+
+def _initialize_worker(working_directory, input_photon_beam_file_name, bender, input_features, initialization_parameters):
+    global __focusing_system, __initial_motor_state
+
+    os.chdir(working_directory)
+
+    input_photon_beam = load_shadow_beam(input_photon_beam_file_name)
+
+    # ini files are registered with the path of the working directory
+    focusing_system = focusing_optics_factory_method(execution_mode=ExecutionMode.SIMULATION, implementor=Implementors.SHADOW, bender=bender)
+
+    workspace = Workspace(source_directory=working_directory, prefix="worker_" + str(os.getpid()) + "_")
+    Finalize(None, workspace.remove, exitpriority=0)
+
+    focusing_system.initialize(input_photon_beam=input_photon_beam, input_features=input_features, workspace=workspace, **initialization_parameters)
+
+    __focusing_system     = focusing_system
+    __initial_motor_state = focusing_system.get_motor_state()
+
+def _get_photon_beam(configuration, near_field_calculation, remove_lost_rays, kwargs):
+    try:
+        motor_state = __initial_motor_state.copy()
+        motor_state.update(configuration)
+
+        __focusing_system.set_motor_state(motor_state)
+
+        photon_beam = __focusing_system.get_photon_beam(near_field_calculation=near_field_calculation, remove_lost_rays=remove_lost_rays, **kwargs)
+
+        return photon_beam._oe_number, photon_beam._beam.rays, None
+    except Exception as exception:
+        return None, None, exception
+
+def _run_function(function, args, kwargs):
+    return function(__focusing_system, *args, **kwargs)
@@ -51,7 +51,8 @@ from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalEl
 from orangecontrib.shadow.util.shadow_util import ShadowPhysics
 
 from beamline34IDC.simulation.facade.primary_optics_interface import AbstractPrimaryOptics
-from beamline34IDC.util.shadow.common import write_bragg_file, write_reflectivity_file, PreProcessorFiles, TTYInibitor, rotate_axis_system
+from beamline34IDC.util.shadow.common import write_bragg_file, write_reflectivity_file, PreProcessorFiles, FortranOutputCapture, rotate_axis_system
+from beamline34IDC.util.shadow.empty_elements import is_empty_element, trace_empty_element
 
 def shadow_primary_optics_factory_method():
     return __PrimaryOptics()
@@ -171,37 +172,28 @@ class __PrimaryOptics(AbstractPrimaryOptics):
     def get_photon_beam(self, **kwargs):
         try:    verbose = kwargs["verbose"]
         except: verbose = False
+        try:    native_empty_elements = kwargs["native_empty_elements"]
+        except: native_empty_elements = False # see rotate_axis_system
 
         if self.__source_beam is None: raise ValueError("Primary Optical System is not initialized")
 
         input_beam = self.__source_beam.duplicate()
 
-        if not verbose:
-            fortran_suppressor = TTYInibitor()
-            fortran_suppressor.start()
-
         output_beam = None
 
-        try:
+        with FortranOutputCapture(enabled=not verbose):
             for optical_element_data in self.__optical_system:
                 optical_element   = optical_element_data[0]
                 widget_class_name = optical_element_data[1]
                 is_last_element   = optical_element_data[2]
 
-                output_beam = ShadowBeam.traceFromOE(input_beam, optical_element, widget_class_name=widget_class_name, recursive_history=False)
+                if native_empty_elements and is_empty_element(optical_element):
+                    output_beam = trace_empty_element(input_beam, optical_element, widget_class_name=widget_class_name, recursive_history=False)
+                else:
+                    output_beam = ShadowBeam.traceFromOE(input_beam, optical_element, widget_class_name=widget_class_name, recursive_history=False)
 
                 if not is_last_element: input_beam = output_beam.duplicate()
-        except Exception as e:
-            if not verbose:
-                try: fortran_suppressor.stop()
-                except: pass
-
-            raise e
-        else:
-            if not verbose:
-                try: fortran_suppressor.stop()
-                except: pass
-
-        output_beam = rotate_axis_system(output_beam, rotation_angle=180.0)
+
+        output_beam = rotate_axis_system(output_beam, rotation_angle=180.0, native=native_empty_elements)
 
         return output_beam
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import sys
+import queue
+import secrets
+import itertools
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+
+from beamline34IDC.facade.focusing_optics_interface import AbstractFocusingOptics
+from beamline34IDC.simulation.facade import Implementors
+from beamline34IDC.simulation.facade.focusing_optics_interface import AbstractSimulatedFocusingOptics, get_default_input_features
+from beamline34IDC.simulation.facade.focusing_optics_pool import FocusingOpticsPool
+from beamline34IDC.simulation.shadow.cache import get_beam_fingerprint, get_cache_key
+from beamline34IDC.simulation.shadow.parallel import BatchOutput
+from beamline34IDC.util.shadow.common import create_shadow_beam
+from beamline34IDC.util.profiling import get_profiler, active_profiler
+
+DEFAULT_ADDRESS = ("localhost", 6034)
+AUTHKEY_VARIABLE     = "BEAMLINE34IDC_SERVER_AUTHKEY" # hex string
+DEFAULT_AUTHKEY_FILE = "simulation_server.authkey"    # written by the command line server, readable by the owner only
+
+# run-time interface forwarded to the hosted systems (initialize, get_photon_beam, snapshot and restore are handled separately)
+_REMOTE_METHODS = sorted(set([name for name in list(vars(AbstractFocusingOptics).keys()) + list(vars(AbstractSimulatedFocusingOptics).keys()) if not name.startswith("_")] +
+                             ["get_motor_state", "set_motor_state"]) -
+                         set(["initialize", "get_photon_beam", "snapshot", "restore"]))
+
+#############################################################################
+# Long-lived simulation server: initialized Shadow focusing systems (ideal and
+# bender) behind a local socket (multiprocessing.connection, pickled messages).
+#
+# A client opens a session, bound to a system of a FocusingOpticsPool, and
+# calls the run-time interface on it. All the requests go through a single queue,
+# executed in order by one thread: Shadow3 and Hybrid keep global state.
+# Identical batches (same configuration of the system, input beam and shape of the
+# KBs of the session, motor configurations and random seed) in flight at the same
+# time are traced once.
+#
+# Clients use ShadowServerFocusingOptics, returned by the factory methods with
+# implementor=Implementors.SHADOW_SERVER.
+#
+# The messages are pickled: there is no public authentication key. The server
+# uses the key in BEAMLINE34IDC_SERVER_AUTHKEY or a random one (get_authkey), and
+# can write it to a file readable by the owner only; the clients must be given
+# the key, the file or the environment variable.
+#
+
+def get_authkey(authkey=None, authkey_file=None):
+    '''
+    authkey (bytes or hex string), else the content of authkey_file, else BEAMLINE34IDC_SERVER_AUTHKEY; None if none of them
+    '''
+    if not authkey is None: return authkey if isinstance(authkey, bytes) else bytes.fromhex(authkey)
+
+    if not authkey_file is None:
+        with open(authkey_file, "r") as file: return bytes.fromhex(file.read().strip())
+
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+
+    return None if authkey is None else bytes.fromhex(authkey)
+
+def write_authkey(authkey, authkey_file):
+    '''
+    writes authkey to authkey_file (hex), readable and writable by the owner only
+    '''
+    if os.path.exists(authkey_file): os.remove(authkey_file) # the mode applies to new files only
+
+    with os.fdopen(os.open(authkey_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as file: file.write(authkey.hex())
+
+
+class SimulationServer():
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, authkey_file=None, pool_size=1, working_directory=os.curdir, **initialization_parameters):
+        '''
+        authkey: if None, BEAMLINE34IDC_SERVER_AUTHKEY or a random key (see get_authkey)
+        authkey_file: if not None, the key is written to it for the clients (owner only)
+        initialization_parameters: passed to initialize() of the hosted systems (the ones sent by the clients are ignored)
+        '''
+        authkey = get_authkey(authkey)
+        if authkey is None: authkey = secrets.token_bytes(32)
+        if not authkey_file is None: write_authkey(authkey, authkey_file)
+
+        self.__authkey  = authkey
+        self.__pool     = FocusingOpticsPool(size=pool_size, working_directory=working_directory, **initialization_parameters)
+        self.__listener = Listener(address, authkey=authkey)
+
+        self.__requests      = queue.Queue()
+        self.__in_flight     = {} # deduplication key: Future
+        self.__lock          = threading.RLock()
+        self.__sessions      = {} # session id: _Session
+        self.__session_ids   = itertools.count(1)
+        self.__closed        = threading.Event()
+        self.__worker        = threading.Thread(target=self.__run_requests, name="simulation server worker", daemon=True)
+        self.__server_thread = None
+
+    def __enter__(self): return self.start()
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def get_address(self):
+        return self.__listener.address
+
+    def get_authkey(self):
+        return self.__authkey
+
+    def start(self):
+        '''
+        serves in a background thread
+        '''
+        self.__server_thread = threading.Thread(target=self.serve_forever, name="simulation server", daemon=True)
+        self.__server_thread.start()
+
+        return self
+
+    def serve_forever(self):
+        if not self.__worker.is_alive(): self.__worker.start()
+
+        while not self.__closed.is_set():
+            try:
+                connection = self.__listener.accept()
+            except Exception:
+                if self.__closed.is_set(): break
+                else: continue
+
+            if self.__closed.is_set():
+                connection.close()
+                break
+
+            threading.Thread(target=self.__serve_connection, args=(connection,), daemon=True).start()
+
+    def close(self):
+        if self.__closed.is_set(): return
+        self.__closed.set()
+
+        # wakes up the accept() of the server thread
+        try:    Client(self.__listener.address, authkey=self.__authkey).close()
+        except: pass
+        self.__listener.close()
+
+        if not self.__server_thread is None: self.__server_thread.join()
+
+        self.__requests.put(None)
+        if self.__worker.is_alive(): self.__worker.join()
+
+        self.__pool.clear()
+
+    def warm_up(self, n_systems=None, input_photon_beam_file_name="primary_optics_system_beam.dat", bender=False, input_features=None):
+        self.__pool.warm_up(n_systems=n_systems, input_photon_beam_file_name=input_photon_beam_file_name, bender=bender, input_features=input_features)
+
+    # PRIVATE METHODS
+
+    def __serve_connection(self, connection):
+        session_ids = [] # opened on this connection: released when the client disconnects
+
+        try:
+            while True:
+                try:    command, arguments = connection.recv()
+                except (EOFError, OSError): break
+
+                try:    response = (self.__execute(command, arguments, session_ids), None)
+                except Exception as exception: response = (None, exception)
+
+                try:
+                    connection.send(response)
+                except (EOFError, OSError): break
+                except Exception as exception: # not picklable
+                    connection.send((None, RuntimeError(repr(exception))))
+        finally:
+            for session_id in session_ids:
+                try:    self.__submit(self.__close_session, session_id).result()
+                except: pass
+
+            connection.close()
+
+    def __execute(self, command, arguments, session_ids):
+        if command == "open":
+            session_id = self.__submit(self.__open_session, *arguments).result()
+            session_ids.append(session_id)
+
+            return session_id
+        elif command == "close":
+            session_id, = arguments
+            self.__check_session_id(session_id, session_ids)
+            session_ids.remove(session_id)
+
+            return self.__submit(self.__close_session, session_id).result()
+        elif command == "call":
+            self.__check_session_id(arguments[0], session_ids)
+
+            return self.__submit(self.__call, *arguments).result()
+        elif command == "get_photon_beams":
+            session_id, configurations, kwargs = arguments
+            self.__check_session_id(session_id, session_ids)
+
+            try:    random_seed = kwargs["random_seed"]
+            except: random_seed = None
+
+            # without a random seed the results are not reproducible: nothing to share
+            if random_seed is None: return self.__submit(self.__get_photon_beams, session_id, configurations, kwargs).result()
+            else:
+                # read before the batch: the client of the session waits for the batch before its next request
+                session_state_key = self.__submit(self.__get_session_state_key, session_id).result()
+                deduplication_key = get_cache_key(session_state_key, configurations, kwargs)
+
+                with self.__lock:
+                    future = self.__in_flight.get(deduplication_key)
+
+                    if future is None:
+                        future = self.__submit(self.__get_photon_beams, session_id, configurations, kwargs)
+                        self.__in_flight[deduplication_key] = future
+                        future.add_done_callback(lambda _: self.__remove_in_flight(deduplication_key))
+
+                return future.result()
+        else: raise ValueError("Command not recognized: " + str(command))
+
+    # a client reaches only the sessions opened on its connection
+    @staticmethod
+    def __check_session_id(session_id, session_ids):
+        if not session_id in session_ids: raise ValueError("Session not opened by this client: " + str(session_id))
+
+    def __remove_in_flight(self, deduplication_key):
+        with self.__lock: self.__in_flight.pop(deduplication_key, None)
+
+    def __submit(self, function, *args):
+        if self.__closed.is_set(): raise RuntimeError("Simulation server is closed")
+
+        future = Future()
+        self.__requests.put((future, function, args))
+
+        return future
+
+    def __run_requests(self):
+        while True:
+            request = self.__requests.get()
+            if request is None: break
+
+            future, function, args = request
+
+            if future.set_running_or_notify_cancel():
+                try:    future.set_result(function(*args))
+                except Exception as exception: future.set_exception(exception)
+
+        # requests still in the queue when the server is closed
+        while True:
+            try:    request = self.__requests.get_nowait()
+            except queue.Empty: break
+            if not request is None: request[0].set_exception(RuntimeError("Simulation server is closed"))
+
+    # EXECUTED BY THE WORKER THREAD
+
+    def __get_session(self, session_id):
+        try:    return self.__sessions[session_id]
+        except KeyError: raise ValueError("Session not opened: " + str(session_id))
+
+    def __open_session(self, oe_number, rays, bender, input_features):
+        input_photon_beam = create_shadow_beam(rays, oe_number)
+        focusing_system   = self.__pool.acquire(input_photon_beam=input_photon_beam, implementor=Implementors.SHADOW, bender=bender, input_features=input_features)
+
+        session_id = next(self.__session_ids)
+        self.__sessions[session_id] = _Session(focusing_system,
+                                               get_cache_key(bender, get_beam_fingerprint(input_photon_beam), vars(input_features)),
+                                               focusing_system.get_motor_state())
+
+        return session_id
+
+    def __close_session(self, session_id):
+        self.__pool.release(self.__sessions.pop(session_id).focusing_system)
+
+    def __get_session_state_key(self, session_id):
+        # the configurations of a batch are applied over the initial motor state: what is left of the state of the
+        # session is the input beam (perturbate_input_photon_beam, ...) and the shape of the KBs, as in the stage keys
+        session         = self.__get_session(session_id)
+        focusing_system = session.focusing_system
+
+        # the input beam key is a version number without beam cache: the beam is hashed once per version
+        if session.input_beam_fingerprint is None or session.input_beam_fingerprint[0] != focusing_system._input_beam_key:
+            session.input_beam_fingerprint = (focusing_system._input_beam_key, get_beam_fingerprint(focusing_system._input_beam))
+
+        return get_cache_key(session.configuration_key,
+                             session.input_beam_fingerprint[1],
+                             focusing_system._get_kb_shape_state())
+
+    def __call(self, session_id, method_name, args, kwargs):
+        session = self.__get_session(session_id)
+
+        if method_name == "get_photon_beam":
+            photon_beam = session.focusing_system.get_photon_beam(*args, **kwargs)
+
+            return photon_beam._oe_number, photon_beam._beam.rays
+        elif method_name == "snapshot":
+            snapshot_id = next(session.snapshot_ids)
+            session.snapshots[snapshot_id] = session.focusing_system.snapshot()
+
+            return snapshot_id
+        elif method_name == "restore":
+            snapshot_id, = args
+            try:    session.focusing_system.restore(session.snapshots[snapshot_id])
+            except KeyError: raise ValueError("Snapshot not taken in this session: " + str(snapshot_id))
+        elif method_name in _REMOTE_METHODS:
+            return getattr(session.focusing_system, method_name)(*args, **kwargs)
+        else: raise ValueError("Method not available: " + str(method_name))
+
+    def __get_photon_beams(self, session_id, configurations, kwargs):
+        # as ParallelFocusingOptics: each configuration is applied over the initial state of the system.
+        # The state of the session is restored afterwards
+        session = self.__get_session(session_id)
+        kwargs  = kwargs.copy()
+
+        try:    near_field_calculation = kwargs.pop("near_field_calculation")
+        except: near_field_calculation = False
+        try:    remove_lost_rays = kwargs.pop("remove_lost_rays")
+        except: remove_lost_rays = True
+
+        session_state = session.focusing_system.snapshot()
+
+        outputs = []
+        try:
+            for configuration in configurations:
+                try:
+                    motor_state = session.initial_motor_state.copy()
+                    motor_state.update(configuration)
+
+                    session.focusing_system.set_motor_state(motor_state)
+
+                    photon_beam = session.focusing_system.get_photon_beam(near_field_calculation=near_field_calculation, remove_lost_rays=remove_lost_rays, **kwargs)
+
+                    outputs.append((photon_beam._oe_number, photon_beam._beam.rays, None))
+                except Exception as exception:
+                    outputs.append((None, None, exception))
+        finally:
+            session.focusing_system.restore(session_state)
+
+        return outputs
+
+class _Session():
+    def __init__(self, focusing_system, configuration_key, initial_motor_state):
+        self.focusing_system        = focusing_system
+        self.configuration_key      = configuration_key
+        self.initial_motor_state    = initial_motor_state
+        self.snapshots              = {}
+        self.snapshot_ids           = itertools.count(1)
+        self.input_beam_fingerprint = None # input beam key, fingerprint of the input beam
+
+#############################################################################
+# CLIENT PROXY
+
+def shadow_server_focusing_optics_factory_method(**kwargs):
+    try:    bender = kwargs["bender"] == True
+    except: bender = False
+    try:    address = kwargs["address"]
+    except: address = DEFAULT_ADDRESS
+    try:    authkey = kwargs["authkey"]
+    except: authkey = None
+    try:    authkey_file = kwargs["authkey_file"]
+    except: authkey_file = None
+
+    return ShadowServerFocusingOptics(bender=bender, address=address, authkey=authkey, authkey_file=authkey_file)
+
+class ShadowServerFocusingOptics(AbstractSimulatedFocusingOptics):
+    def __init__(self, bender=False, address=DEFAULT_ADDRESS, authkey=None, authkey_file=None):
+        '''
+        the key of the server is required: authkey, authkey_file or BEAMLINE34IDC_SERVER_AUTHKEY
+        '''
+        authkey = get_authkey(authkey, authkey_file)
+        if authkey is None: raise ValueError("The authentication key of the simulation server is required (authkey, authkey_file or " + AUTHKEY_VARIABLE + ")")
+
+        self.__bender     = bender
+        self.__address    = address
+        self.__authkey    = authkey
+        self.__connection = None
+        self.__session_id = None
+        self.__lock       = threading.Lock() # one request at a time on the connection
+
+    def initialize(self, input_photon_beam, input_features=None, **kwargs):
+        '''
+        the input beam and features are sent to the server, the other initialization parameters are the server ones
+        '''
+        if input_features is None: input_features = get_default_input_features()
+
+        if self.__connection is None: self.__connection = Client(self.__address, authkey=self.__authkey)
+        if not self.__session_id is None: self.__request("close", (self.__session_id,))
+
+        self.__session_id = None
+        self.__session_id = self.__request("open", (input_photon_beam._oe_number, input_photon_beam._beam.rays, self.__bender, input_features))
+
+    def close(self):
+        if not self.__connection is None:
+            try:
+                if not self.__session_id is None: self.__request("close", (self.__session_id,))
+            finally:
+                self.__connection.close()
+                self.__connection = None
+                self.__session_id = None
+
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_value, traceback): self.close()
+
+    def get_photon_beam(self, near_field_calculation=False, remove_lost_rays=True, **kwargs):
+        profiler = kwargs.pop("profiler", None) # the round trip is timed, the stages run in the server
+
+        with active_profiler(profiler), get_profiler().stage("remote get_photon_beam", random_seed=kwargs.get("random_seed", None)) as stage:
+            oe_number, rays = self.__call("get_photon_beam", near_field_calculation=near_field_calculation, remove_lost_rays=remove_lost_rays, **kwargs)
+            stage.set(rays_out=len(rays), bytes_copied=rays.nbytes)
+
+        return create_shadow_beam(rays, oe_number)
+
+    def get_photon_beams(self, configurations, near_field_calculation=False, remove_lost_rays=True, **kwargs):
+        '''
+        as ParallelFocusingOptics.get_photon_beams: a list of BatchOutput, each configuration applied over the initial state
+        '''
+        kwargs["near_field_calculation"] = near_field_calculation
+        kwargs["remove_lost_rays"]       = remove_lost_rays
+        profiler = kwargs.pop("profiler", None)
+        configurations = list(configurations)
+
+        with active_profiler(profiler), get_profiler().stage("remote get_photon_beams", n_configurations=len(configurations)):
+            return [BatchOutput(photon_beam=None if rays is None else create_shadow_beam(rays, oe_number), exception=exception)
+                    for oe_number, rays, exception in self.__request("get_photon_beams", (self.__get_session_id(), configurations, kwargs))]
+
+    # the snapshots are kept by the server, the tokens are their ids
+    def snapshot(self): return self.__call("snapshot")
+    def restore(self, token): self.__call("restore", token)
+
+    # PRIVATE METHODS
+
+    def __get_session_id(self):
+        if self.__session_id is None: raise ValueError("Focusing Optical System is not initialized")
+
+        return self.__session_id
+
+    def __call(self, method_name, *args, **kwargs):
+        return self.__request("call", (self.__get_session_id(), method_name, args, kwargs))
+
+    def __request(self, command, arguments):
+        with self.__lock:
+            self.__connection.send((command, arguments))
+            result, exception = self.__connection.recv()
+
+        if not exception is None: raise exception
+
+        return result
+
+def __add_remote_method(method_name):
+    def remote_method(self, *args, **kwargs): return self._ShadowServerFocusingOptics__call(method_name, *args, **kwargs)
+
+    remote_method.__name__ = method_name
+    setattr(ShadowServerFocusingOptics, method_name, remote_method)
+
+for method_name in _REMOTE_METHODS: __add_remote_method(method_name)
+
+#############################################################################
+# python -m beamline34IDC.simulation.shadow.server [port [authkey file]], from the working directory
+
+if __name__ == "__main__":
+    port         = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ADDRESS[1]
+    authkey_file = os.path.abspath(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_AUTHKEY_FILE)
+
+    server = SimulationServer(address=(DEFAULT_ADDRESS[0], port), authkey_file=authkey_file)
+    print("Simulation server listening on " + str(server.get_address()) + ", authentication key in " + authkey_file)
+
+    try:                      server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:                  server.close()
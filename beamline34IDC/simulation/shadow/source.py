@@ -55,7 +55,7 @@ from orangecontrib.shadow_advanced_tools.widgets.sources.attributes.hybrid_undul
 import orangecontrib.shadow_advanced_tools.widgets.sources.bl.hybrid_undulator_bl as HU
 
 from beamline34IDC.simulation.facade.source_interface import AbstractSource, Sources, StorageRing, ElectronBeamAPS_U, ElectronBeamAPS
-from beamline34IDC.util.shadow.common import TTYInibitor
+from beamline34IDC.util.shadow.common import FortranOutputCapture
 
 def shadow_source_factory_method(kind_of_source=Sources.GAUSSIAN):
     if kind_of_source == Sources.GAUSSIAN:
@@ -121,24 +121,8 @@ class __ShadowGaussianUndulatorSource(AbstractSource):
         try:    verbose = kwargs["verbose"]
         except: verbose = False
 
-        if not verbose:
-            fortran_suppressor = TTYInibitor()
-            fortran_suppressor.start()
-
-        output_beam = None
-
-        try:
-           output_beam = fix_Intensity(ShadowBeam.traceFromSource(self.__shadow_source))
-        except Exception as e:
-            if not verbose:
-                try: fortran_suppressor.stop()
-                except: pass
-
-            raise e
-        else:
-            if not verbose:
-                try: fortran_suppressor.stop()
-                except: pass
+        with FortranOutputCapture(enabled=not verbose):
+            output_beam = fix_Intensity(ShadowBeam.traceFromSource(self.__shadow_source))
 
         return output_beam
 
@@ -47,9 +47,9 @@
 
 import os, glob
 
-def clean_up():
-    for pattern in ["angle.*", "effic.*", "mirr.*", "optax.*", "rmir.*", "screen.*", "star.*"]:
-        files = glob.glob(os.path.join(os.curdir, pattern), recursive=True)
+def clean_up(directory=os.curdir):
+    for pattern in ["angle.*", "effic.*", "mirr.*", "optax.*", "rmir.*", "screen.*", "star.*", "*_bender_profile.dat"]:
+        files = glob.glob(os.path.join(directory, pattern), recursive=True)
         for file in files: os.remove(file)
 
 
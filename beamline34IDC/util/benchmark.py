@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import gc
+import sys
+import time
+import tracemalloc
+from typing import NamedTuple
+
+import numpy
+
+#############################################################################
+# Memory-regression benchmark of a repeated call (e.g. get_photon_beam in an
+# optimization loop): per iteration, latency, resident memory (RSS, Fortran and
+# C allocations included), Python allocations (tracemalloc) and open file
+# descriptors. Leaks are the growth per call after a warm up (caches filled),
+# as slope of a linear fit. The run fails when a threshold is exceeded.
+#
+
+class MemoryThresholds(NamedTuple):
+    max_rss_leak_per_call: float = None     # bytes
+    max_traced_leak_per_call: float = None  # bytes, Python allocations only
+    max_fd_leak: int = None                 # file descriptors left open by the whole run
+    max_latency_p50: float = None           # seconds
+    max_latency_p95: float = None           # seconds
+    max_latency_p99: float = None           # seconds
+
+# None: not checked
+DEFAULT_THRESHOLDS = MemoryThresholds(max_rss_leak_per_call=256*1024,
+                                      max_traced_leak_per_call=16*1024,
+                                      max_fd_leak=0)
+
+def get_rss():
+    '''
+    resident memory of the process in bytes (peak resident memory where /proc is not available)
+    '''
+    try:
+        with open("/proc/self/statm", "r") as file: return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        return max_rss if sys.platform == "darwin" else max_rss * 1024 # bytes on macOS, kilobytes on Linux
+
+def get_open_file_descriptors():
+    '''
+    number of open file descriptors of the process, -1 if not available
+    '''
+    for fd_directory in ["/proc/self/fd", "/dev/fd"]:
+        try:    return len(os.listdir(fd_directory)) - 1 # the descriptor of the listing itself
+        except OSError: pass
+
+    return -1
+
+class MemoryBenchmarkResult():
+    def __init__(self, name, latencies, rss, traced_memory, open_file_descriptors, top_allocations, thresholds):
+        self.name                  = name
+        self.latencies             = numpy.array(latencies)
+        self.rss                   = numpy.array(rss)
+        self.traced_memory         = None if traced_memory is None else numpy.array(traced_memory)
+        self.open_file_descriptors = numpy.array(open_file_descriptors)
+        self.top_allocations       = top_allocations
+        self.thresholds            = thresholds
+
+    def get_n_calls(self): return len(self.latencies)
+
+    def get_rss_leak_per_call(self): return _get_slope(self.rss)
+
+    def get_traced_leak_per_call(self): return None if self.traced_memory is None else _get_slope(self.traced_memory)
+
+    def get_fd_leak(self): return int(self.open_file_descriptors[-1] - self.open_file_descriptors[0])
+
+    def get_latency_percentiles(self, percentiles=(50, 95, 99)):
+        return dict([(percentile, float(numpy.percentile(self.latencies, percentile))) for percentile in percentiles])
+
+    def get_failures(self):
+        '''
+        list of the exceeded thresholds, as messages
+        '''
+        if self.thresholds is None: return []
+
+        latency = self.get_latency_percentiles()
+        checks  = [("RSS leak per call [B]",    self.get_rss_leak_per_call(),    self.thresholds.max_rss_leak_per_call),
+                   ("traced leak per call [B]", self.get_traced_leak_per_call(), self.thresholds.max_traced_leak_per_call),
+                   ("open file descriptors leaked", self.get_fd_leak(),          self.thresholds.max_fd_leak),
+                   ("latency p50 [s]",          latency[50],                     self.thresholds.max_latency_p50),
+                   ("latency p95 [s]",          latency[95],                     self.thresholds.max_latency_p95),
+                   ("latency p99 [s]",          latency[99],                     self.thresholds.max_latency_p99)]
+
+        return [label + ": " + _format(value) + " > " + _format(threshold) for label, value, threshold in checks
+                if not (threshold is None or value is None) and value > threshold]
+
+    def is_passed(self): return len(self.get_failures()) == 0
+
+    def format_report(self):
+        latency = self.get_latency_percentiles()
+        traced_leak = self.get_traced_leak_per_call()
+
+        lines = ["Memory benchmark" + ("" if not self.name else (" - " + self.name)) + ": " + str(self.get_n_calls()) + " calls",
+                 "  latency p50/p95/p99 [ms]:   " + "/".join(["{:.1f}".format(1e3*latency[percentile]) for percentile in [50, 95, 99]]) +
+                 " (max " + "{:.1f}".format(1e3*self.latencies.max()) + ")",
+                 "  RSS start/end [MB]:         " + "{:.1f}".format(self.rss[0]/1024**2) + "/" + "{:.1f}".format(self.rss[-1]/1024**2),
+                 "  RSS leak per call [kB]:     " + "{:.2f}".format(self.get_rss_leak_per_call()/1024),
+                 "  traced leak per call [kB]:  " + ("n.a." if traced_leak is None else "{:.2f}".format(traced_leak/1024)),
+                 "  open file descriptors:      " + str(self.open_file_descriptors[0]) + " -> " + str(self.open_file_descriptors[-1])]
+
+        if self.top_allocations:
+            lines.append("  top Python allocation growth:")
+            for statistic in self.top_allocations: lines.append("    " + str(statistic))
+
+        failures = self.get_failures()
+        lines.append("  PASSED" if len(failures) == 0 else ("  FAILED:\n" + "\n".join(["    " + failure for failure in failures])))
+
+        return "\n".join(lines)
+
+    def print_report(self):
+        print(self.format_report())
+
+def run_memory_benchmark(function, n_iterations=50, n_warm_up=5, thresholds=DEFAULT_THRESHOLDS, trace_python_allocations=True,
+                         n_top_allocations=5, name="", verbose=False):
+    '''
+    calls function(iteration) n_warm_up + n_iterations times, measuring the last n_iterations against the state after the warm up.
+    with trace_python_allocations the latencies include the overhead of tracemalloc: disable it to check latency thresholds
+    '''
+    if n_iterations < 2: raise ValueError("At least 2 iterations are needed")
+
+    started_tracemalloc = trace_python_allocations and not tracemalloc.is_tracing()
+    if started_tracemalloc: tracemalloc.start()
+
+    try:
+        for iteration in range(n_warm_up): function(iteration)
+
+        gc.collect()
+        initial_snapshot = tracemalloc.take_snapshot() if trace_python_allocations else None
+
+        # the first samples are the baseline before the measured calls: the first call is measured as the others
+        latencies             = []
+        rss                   = [get_rss()]
+        open_file_descriptors = [get_open_file_descriptors()]
+        traced_memory         = [tracemalloc.get_traced_memory()[0]] if trace_python_allocations else None
+        for iteration in range(n_warm_up, n_warm_up + n_iterations):
+            t0 = time.perf_counter()
+            function(iteration)
+            latencies.append(time.perf_counter() - t0)
+
+            gc.collect() # garbage is not a leak
+            rss.append(get_rss())
+            open_file_descriptors.append(get_open_file_descriptors())
+            if trace_python_allocations: traced_memory.append(tracemalloc.get_traced_memory()[0])
+
+            if verbose: print("iteration", iteration, "latency [ms]", round(1e3*latencies[-1], 1), "RSS [MB]", round(rss[-1]/1024**2, 1), "open fds", open_file_descriptors[-1])
+
+        if trace_python_allocations:
+            own_allocations = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)] # the measurements
+            top_allocations = [statistic for statistic in tracemalloc.take_snapshot().filter_traces(own_allocations).compare_to(initial_snapshot.filter_traces(own_allocations), "lineno")
+                               if statistic.size_diff > 0][:n_top_allocations]
+        else:
+            top_allocations = []
+    finally:
+        if started_tracemalloc: tracemalloc.stop()
+
+    return MemoryBenchmarkResult(name, latencies, rss, traced_memory, open_file_descriptors, top_allocations, thresholds)
+
+def _get_slope(values):
+    return float(numpy.polyfit(numpy.arange(len(values)), numpy.asarray(values, dtype=float), 1)[0])
+
+def _format(value):
+    return str(value) if isinstance(value, (int, numpy.integer)) else "{:.4g}".format(value)
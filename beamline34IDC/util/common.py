@@ -45,12 +45,9 @@
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
 import numpy
-from matplotlib import pyplot as plt
-from matplotlib import cm
-from oasys.util.oasys_util import get_sigma, get_fwhm, get_average
 from orangecontrib.ml.util.data_structures import DictionaryWrapper
 
-from beamline34IDC.util.gaussian_fit import calculate_2D_gaussian_fit
+from beamline34IDC.util.gaussian_fit import fast_2D_gaussian_fit
 
 class Histogram():
     def __init__(self, hh, vv, data_2D):
@@ -58,7 +55,12 @@ class Histogram():
         self.vv = vv
         self.data_2D = data_2D
 
+# matplotlib and oasys (Qt) are imported on first use: headless workers do not load them
+
+# z_array[i, j]: intensity at (x_array[i], y_array[j]), as the Shadow histograms, the SRW intensities and plot_2D
 def get_info(x_array, y_array, z_array, xrange=None, yrange=None, do_gaussian_fit=False):
+    from oasys.util.oasys_util import get_sigma, get_fwhm, get_average
+
     ticket = {'error': 0}
     ticket['nbins_h'] = len(x_array)
     ticket['nbins_v'] = len(y_array)
@@ -68,8 +70,8 @@ def get_info(x_array, y_array, z_array, xrange=None, yrange=None, do_gaussian_fi
     pixel_area = (x_array[1] - x_array[0]) * (y_array[1] - y_array[0])
 
     hh = z_array
-    hh_h = hh.sum(axis=0)
-    hh_v = hh.sum(axis=1)
+    hh_h = hh.sum(axis=1)
+    hh_v = hh.sum(axis=0)
     xx = x_array
     yy = y_array
 
@@ -93,7 +95,7 @@ def get_info(x_array, y_array, z_array, xrange=None, yrange=None, do_gaussian_fi
     ticket['centroid_v'] = get_average(ticket['histogram_v'], -ticket['bin_v'])
 
     if do_gaussian_fit:
-        try:    gaussian_fit = calculate_2D_gaussian_fit(data_2D=hh, x=xx, y=yy)
+        try:    gaussian_fit = fast_2D_gaussian_fit(data_2D=hh, x=xx, y=yy)
         except Exception as e:
             print("Gaussian fit failed: ", e)
             gaussian_fit = {}
@@ -112,6 +114,28 @@ def get_info(x_array, y_array, z_array, xrange=None, yrange=None, do_gaussian_fi
                gaussian_fit=gaussian_fit
     )
 
+def get_image_info(image, pixel_size=1.0, roi=None, background=None, do_gaussian_fit=False):
+    '''
+    get_info of a detector image (rows: vertical, columns: horizontal), with coordinates in units of pixel_size
+    from the center of the full image.
+    roi: [first column, last column, first row, last row] in pixels (last excluded), a view on the image
+    background: counts per pixel subtracted (clipped at 0), scalar or image of the same shape
+    '''
+    size_v, size_h = image.shape
+    if roi is None: roi = [0, size_h, 0, size_v]
+
+    z_array = image[roi[2]:roi[3], roi[0]:roi[1]]
+    if z_array.size == 0: raise ValueError("Empty ROI: " + str(roi))
+
+    if not background is None:
+        if not numpy.isscalar(background): background = numpy.asarray(background)[roi[2]:roi[3], roi[0]:roi[1]]
+        z_array = numpy.clip(z_array - background, 0.0, None)
+
+    x_array = (numpy.arange(roi[0], roi[0] + z_array.shape[1]) - 0.5 * (size_h - 1)) * pixel_size
+    y_array = (numpy.arange(roi[2], roi[2] + z_array.shape[0]) - 0.5 * (size_v - 1)) * pixel_size
+
+    return get_info(x_array, y_array, z_array.T, None, None, do_gaussian_fit) # (h, v)
+
 class Flip:
     NO = 0
     HORIZONTAL = 1
@@ -127,14 +151,17 @@ class AspectRatio:
     AUTO = 0
     CARTESIAN = 1
 
-class ColorMap:
-    RAINBOW = cm.rainbow
-    GRAY    = cm.gray
-    VIRIDIS = cm.viridis
+class ColorMap: # matplotlib colormap names
+    RAINBOW = "rainbow"
+    GRAY    = "gray"
+    VIRIDIS = "viridis"
 
 def plot_2D(x_array, y_array, z_array, title="X,Z", xrange=None, yrange=None,
             int_um="$ph/s/0.1\%BW$", peak_um="$ph/s/mm^2/0.1\%BW$",
             flip=Flip.VERTICAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW):
+    from matplotlib import pyplot as plt
+    from oasys.util.oasys_util import get_sigma, get_fwhm, get_average
+
     if xrange is None: xrange = [x_array[0], x_array[-1]]
     if yrange is None: yrange = [y_array[0], y_array[-1]]
 
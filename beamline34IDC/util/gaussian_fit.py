@@ -20,9 +20,9 @@ def generalized_2D_gaussian(xdata_tuple: np.ndarray,  # array consisting of 2d p
                             theta: float,
                             offset: float) -> np.ndarray:
 
-    XX = xdata_tuple[:,0]
-    YY = xdata_tuple[:,1]
+    return _generalized_2D_gaussian_on_grid(xdata_tuple[:,0], xdata_tuple[:,1], amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset)
 
+def _generalized_2D_gaussian_on_grid(XX, YY, amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset):
     a = (np.cos(theta) ** 2) / (2 * sigma_x ** 2) + (np.sin(theta) ** 2) / (2 * sigma_y ** 2)
     b = -(np.sin(2 * theta)) / (4 * sigma_x ** 2) + (np.sin(2 * theta)) / (4 * sigma_y ** 2)
     c = (np.sin(theta) ** 2) / (2 * sigma_x ** 2) + (np.cos(theta) ** 2) / (2 * sigma_y ** 2)
@@ -142,7 +142,7 @@ def differential_evolution_2D_gaussian_fit(data_2D: np.ndarray, x: np.ndarray =
         nx = data_2D.shape[-1]
         ny = data_2D.shape[-2]
         y = np.arange(-ny // 2, ny // 2)
-        x = np.arange(-ny // 2, nx // 2)
+        x = np.arange(-nx // 2, nx // 2)
 
     yy, xx = np.meshgrid(y, x)
     xdata = np.stack((xx.flatten(), yy.flatten()), axis=1)
@@ -150,10 +150,7 @@ def differential_evolution_2D_gaussian_fit(data_2D: np.ndarray, x: np.ndarray =
     bounds_max = [data_2D.sum(), x[-1], y[-1], x[-1] * 2, y[-1] * 2, np.pi / 4, data_2D.max()]
     bounds_min = np.array(bounds_min) + 1e-7
 
-    result = differential_evolution(generalized_2D_gaussian,
-                        xdata,
-                        data_2D.flatten(),
-                        bounds=[bounds_min, bounds_max])
+    result = differential_evolution(squared_loss, bounds=list(zip(bounds_min, bounds_max))).x
     amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset = result
 
     gaussian_fit = {"amplitude": amplitude,
@@ -167,3 +164,227 @@ def differential_evolution_2D_gaussian_fit(data_2D: np.ndarray, x: np.ndarray =
                     "offset": offset}
 
     return gaussian_fit
+
+#############################################################################
+# Fast 2D gaussian fit.
+#
+# Same model, bounds and output of calculate_2D_gaussian_fit, but:
+# - the coordinate grids are cached per bin geometry,
+# - the parameters start from the moments of the image (or from a previous fit),
+# - the Jacobian of the model is analytic,
+# - optionally, a first fit on a downsampled or ROI-cropped image seeds the final one.
+#
+
+_COORDINATE_GRIDS     = {}
+_MAX_COORDINATE_GRIDS = 32
+
+_FIT_PARAMETERS = ["amplitude", "center_x", "center_y", "sigma_x", "sigma_y", "theta", "offset"]
+
+
+def get_coordinate_grid(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Coordinates XX, YY of the image points (same order of data_2D.flatten()), shape (2, n_points), cached."""
+    x = np.ascontiguousarray(x, dtype=float)
+    y = np.ascontiguousarray(y, dtype=float)
+    key = (x.tobytes(), y.tobytes())
+
+    try:
+        return _COORDINATE_GRIDS[key]
+    except KeyError:
+        if len(_COORDINATE_GRIDS) >= _MAX_COORDINATE_GRIDS: _COORDINATE_GRIDS.pop(next(iter(_COORDINATE_GRIDS)))
+
+        grid = np.vstack((np.repeat(x, len(y)), np.tile(y, len(x))))
+        grid.flags.writeable = False
+
+        _COORDINATE_GRIDS[key] = grid
+        return grid
+
+
+def generalized_2D_gaussian_jacobian(XX: np.ndarray, YY: np.ndarray,
+                                     amplitude: float,
+                                     center_x: float,
+                                     center_y: float,
+                                     sigma_x: float,
+                                     sigma_y: float,
+                                     theta: float,
+                                     offset: float) -> np.ndarray:
+    """Derivatives of generalized_2D_gaussian with respect to the 7 parameters, shape (n_points, 7)."""
+    cos2, sin2, sin_2t, cos_2t = np.cos(theta) ** 2, np.sin(theta) ** 2, np.sin(2 * theta), np.cos(2 * theta)
+    sx2, sy2 = sigma_x ** 2, sigma_y ** 2
+    sx3, sy3 = sx2 * sigma_x, sy2 * sigma_y
+
+    a = cos2 / (2 * sx2) + sin2 / (2 * sy2)
+    b = -sin_2t / (4 * sx2) + sin_2t / (4 * sy2)
+    c = sin2 / (2 * sx2) + cos2 / (2 * sy2)
+
+    dx = XX - center_x
+    dy = YY - center_y
+    dx2, dxdy, dy2 = dx * dx, dx * dy, dy * dy
+
+    exponential = np.exp(-(a * dx2 + 2 * b * dxdy + c * dy2))
+    minus_amplitude_exponential = -amplitude * exponential
+
+    jacobian = np.empty((len(dx), 7))
+    jacobian[:, 0] = exponential
+    jacobian[:, 1] = amplitude * exponential * (2 * a * dx + 2 * b * dy)
+    jacobian[:, 2] = amplitude * exponential * (2 * b * dx + 2 * c * dy)
+    jacobian[:, 3] = minus_amplitude_exponential * (-cos2 * dx2 + sin_2t * dxdy - sin2 * dy2) / sx3
+    jacobian[:, 4] = minus_amplitude_exponential * (-sin2 * dx2 - sin_2t * dxdy - cos2 * dy2) / sy3
+    jacobian[:, 5] = minus_amplitude_exponential * (0.5 * sin_2t * (1 / sy2 - 1 / sx2) * (dx2 - dy2) + cos_2t * (1 / sy2 - 1 / sx2) * dxdy)
+    jacobian[:, 6] = 1.0
+
+    return jacobian
+
+
+def get_moments_initial_guess(data_2D: np.ndarray, x: np.ndarray, y: np.ndarray) -> list:
+    """Parameters of the gaussian with the same moments of the image (above the level of its border)."""
+    border = np.concatenate((data_2D[0, :], data_2D[-1, :], data_2D[:, 0], data_2D[:, -1]))
+    offset = max(np.median(border), 0.0)
+    amplitude = data_2D.max() - offset
+    image = data_2D - offset
+    image = np.where(image > 0.05 * amplitude, image, 0.0) # noise around the offset would widen the moments
+    total = image.sum()
+
+    if total <= 0: return [amplitude, 0.5 * (x[0] + x[-1]), 0.5 * (y[0] + y[-1]), abs(x[1] - x[0]), abs(y[1] - y[0]), 0.0, offset]
+
+    profile_x = image.sum(axis=1)
+    profile_y = image.sum(axis=0)
+    center_x = np.dot(profile_x, x) / total
+    center_y = np.dot(profile_y, y) / total
+    var_x = np.dot(profile_x, (x - center_x) ** 2) / total
+    var_y = np.dot(profile_y, (y - center_y) ** 2) / total
+    cov_xy = np.dot(x - center_x, image @ (y - center_y)) / total
+
+    # direction of the major axis, in (-pi/2, pi/2]: folded by pi/2 into the bounds of theta, [-pi/4, pi/4],
+    # the x axis of the gaussian becomes the minor one (sigma_x and sigma_y are swapped by the rotation)
+    angle = 0.5 * np.arctan2(2 * cov_xy, var_x - var_y) if var_x != var_y or cov_xy != 0 else 0.0
+    if angle > np.pi / 4:    angle -= np.pi / 2
+    elif angle < -np.pi / 4: angle += np.pi / 2
+    theta = -angle # clockwise, as in generalized_2D_gaussian
+
+    # variances along the rotated axes
+    cos, sin = np.cos(angle), np.sin(angle)
+    sigma_x = np.sqrt(max(cos ** 2 * var_x + 2 * sin * cos * cov_xy + sin ** 2 * var_y, 0.0))
+    sigma_y = np.sqrt(max(sin ** 2 * var_x - 2 * sin * cos * cov_xy + cos ** 2 * var_y, 0.0))
+
+    return [amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset]
+
+
+def fast_2D_gaussian_fit(data_2D: np.ndarray, x: np.ndarray = None, y: np.ndarray = None,
+                         initial_guess: dict = None, downsampling: int = 1, roi_sigmas: float = None) -> dict:
+    r"""Same fit of calculate_2D_gaussian_fit, faster.
+
+    Parameters
+    ----------
+    initial_guess : dict
+        Warm start, e.g. the fit of the previous image (otherwise the moments of the image are used).
+    downsampling : int
+        If > 1, a first fit on the image binned by this factor seeds the final one.
+    roi_sigmas : float
+        If given, a first fit on the image cropped to center +- roi_sigmas * sigma seeds the final one.
+
+    Returns
+    -------
+    out : dict
+        Dictionary containing the fit parameters (as in calculate_2D_gaussian_fit).
+    """
+    if x is None and y is None:
+        nx = data_2D.shape[-1]
+        ny = data_2D.shape[-2]
+        y = np.arange(-ny // 2, ny // 2)
+        x = np.arange(-nx // 2, nx // 2)
+
+    if initial_guess is None: p0 = get_moments_initial_guess(data_2D, x, y)
+    else:                     p0 = [initial_guess[name] for name in _FIT_PARAMETERS]
+
+    if downsampling > 1 and min(len(x), len(y)) >= 8 * downsampling:
+        nx_d, ny_d = len(x) // downsampling, len(y) // downsampling
+        data_2D_d = data_2D[:nx_d * downsampling, :ny_d * downsampling].reshape(nx_d, downsampling, ny_d, downsampling).mean(axis=(1, 3))
+        x_d = x[:nx_d * downsampling].reshape(nx_d, downsampling).mean(axis=1)
+        y_d = y[:ny_d * downsampling].reshape(ny_d, downsampling).mean(axis=1)
+
+        p0 = _fit(data_2D_d, x_d, y_d, p0, _get_bounds(data_2D, x, y))
+
+    if roi_sigmas is not None:
+        half_width = roi_sigmas * max(p0[3], p0[4])
+        cursor_x = np.flatnonzero(np.abs(x - p0[1]) <= half_width)
+        cursor_y = np.flatnonzero(np.abs(y - p0[2]) <= half_width)
+
+        if len(cursor_x) >= 8 and len(cursor_y) >= 8:
+            p0 = _fit(data_2D[cursor_x[0]:cursor_x[-1] + 1, cursor_y[0]:cursor_y[-1] + 1],
+                      x[cursor_x[0]:cursor_x[-1] + 1], y[cursor_y[0]:cursor_y[-1] + 1], p0, _get_bounds(data_2D, x, y))
+
+    parameters = _fit(data_2D, x, y, p0, _get_bounds(data_2D, x, y))
+
+    # stuck on a bound of theta: the reference fit, if closer to the image
+    if abs(abs(parameters[5]) - np.pi / 4) < 1e-6:
+        reference_fit = calculate_2D_gaussian_fit(data_2D, x, y)
+        reference_parameters = [reference_fit[name] for name in _FIT_PARAMETERS]
+
+        if _get_residual(data_2D, x, y, reference_parameters) < _get_residual(data_2D, x, y, parameters): return reference_fit
+
+    amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset = parameters
+
+    gaussian_fit = {"amplitude": amplitude,
+                    "center_x": center_x,
+                    "center_y": center_y,
+                    "sigma_x": sigma_x,
+                    "fwhm_x": 2.355 * sigma_x,
+                    "sigma_y": sigma_y,
+                    "fwhm_y": 2.355 * sigma_y,
+                    "theta": theta,
+                    "offset": offset}
+
+    return gaussian_fit
+
+
+def fast_2D_gaussian_fits(data_2D_stack: list, x: np.ndarray = None, y: np.ndarray = None,
+                          n_workers: int = None, **kwargs) -> list:
+    """fast_2D_gaussian_fit of a stack of images on a pool of processes.
+
+    Fits that fail return an empty dictionary, as in get_info.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(_fast_2D_gaussian_fit_or_empty, data_2D, x, y, kwargs) for data_2D in data_2D_stack]
+
+        return [future.result() for future in futures]
+
+
+def _fast_2D_gaussian_fit_or_empty(data_2D, x, y, kwargs):
+    try:
+        return fast_2D_gaussian_fit(data_2D, x, y, **kwargs)
+    except Exception as e:
+        print("Gaussian fit failed: ", e)
+        return {}
+
+
+def _get_bounds(data_2D, x, y):
+    bounds_min = [0.0, x[0], y[0], 0.0, 0.0, -np.pi / 4, 0.0]
+    bounds_max = [data_2D.sum(), x[-1], y[-1], x[-1] * 2, y[-1] * 2, np.pi / 4, data_2D.max()]
+
+    return bounds_min, bounds_max
+
+
+def _get_residual(data_2D, x, y, parameters):
+    xdata = get_coordinate_grid(x, y)
+
+    return np.sum((np.ravel(data_2D) - _generalized_2D_gaussian_on_grid(xdata[0], xdata[1], *parameters)) ** 2)
+
+
+def _fit(data_2D, x, y, p0, bounds):
+    xdata = get_coordinate_grid(x, y)
+
+    # the starting point has to be strictly inside the bounds
+    bounds_min, bounds_max = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+    margin = 1e-6 * (bounds_max - bounds_min)
+    p0 = np.clip(np.asarray(p0, dtype=float), bounds_min + margin, bounds_max - margin)
+
+    popt, _ = curve_fit(lambda xdata, *parameters: _generalized_2D_gaussian_on_grid(xdata[0], xdata[1], *parameters),
+                        xdata,
+                        np.ravel(data_2D),
+                        p0=p0,
+                        bounds=[bounds_min, bounds_max],
+                        jac=lambda xdata, *parameters: generalized_2D_gaussian_jacobian(xdata[0], xdata[1], *parameters))
+
+    return list(popt)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import json
+import time
+import threading
+
+import numpy
+
+#############################################################################
+# Lightweight instrumentation of the simulation and optimization pipelines.
+#
+# Code is instrumented with stages:
+#
+#     with get_profiler().stage("hybrid", oe="V-KB", rays_in=n) as stage:
+#         ...
+#         stage.set(rays_out=m, bytes_copied=b)
+#
+# recording wall time, CPU time of the calling thread and the given arguments.
+# Stages are recorded by the profiler made active (per thread) by active_profiler(),
+# by the profiler keyword of get_photon_beam and of the optimizers, or by using
+# the profiler itself as a context manager. Otherwise get_profiler() returns a
+# profiler that records nothing, at the cost of a function call.
+#
+# Events are exported as a Chrome trace (chrome://tracing, Perfetto) or
+# aggregated by stage in a summary table.
+#
+
+class Profiler():
+    def __init__(self):
+        self.__events = []
+        self.__lock   = threading.Lock()
+        self.__origin = time.perf_counter()
+        self.__previous_profilers = []
+
+    def __enter__(self):
+        self.__previous_profilers.append(get_profiler())
+        _active.profiler = self
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active.profiler = self.__previous_profilers.pop()
+
+    def is_enabled(self): return True
+
+    def stage(self, name, category="simulation", **args):
+        '''
+        args: recorded with the stage (rays_in, rays_out, bytes_copied are aggregated in the summary)
+        '''
+        return _Stage(self, name, category, args)
+
+    def clear(self):
+        with self.__lock: self.__events = []
+
+    def get_events(self):
+        '''
+        list of (category, name, start [s], wall time [s], cpu time [s], thread id, args)
+        '''
+        with self.__lock: return list(self.__events)
+
+    def get_summary(self):
+        '''
+        one dictionary per (category, name), in order of first occurrence
+        '''
+        rows = {}
+        for category, name, _, wall_time, cpu_time, _, args in self.get_events():
+            try:
+                row = rows[(category, name)]
+            except KeyError:
+                row = {"category": category, "name": name, "calls": 0, "wall_time": 0.0, "max_wall_time": 0.0, "cpu_time": 0.0,
+                       "rays_in": 0, "rays_out": 0, "bytes_copied": 0}
+                rows[(category, name)] = row
+
+            row["calls"]         += 1
+            row["wall_time"]     += wall_time
+            row["max_wall_time"] = max(row["max_wall_time"], wall_time)
+            row["cpu_time"]      += cpu_time
+            for key in ["rays_in", "rays_out", "bytes_copied"]:
+                try:    row[key] += int(args[key])
+                except: pass
+
+        return list(rows.values())
+
+    def format_summary(self):
+        header = "category".ljust(14) + "stage".ljust(28) + "calls".rjust(7) + "wall [ms]".rjust(12) + "mean [ms]".rjust(11) + \
+                 "max [ms]".rjust(11) + "cpu [ms]".rjust(12) + "rays in".rjust(12) + "rays out".rjust(12) + "copied [MB]".rjust(13)
+        lines = [header, "-" * len(header)]
+
+        for row in self.get_summary():
+            lines.append(row["category"][:13].ljust(14) + row["name"][:27].ljust(28) + str(row["calls"]).rjust(7) +
+                         "{:.2f}".format(1e3*row["wall_time"]).rjust(12) +
+                         "{:.2f}".format(1e3*row["wall_time"]/row["calls"]).rjust(11) +
+                         "{:.2f}".format(1e3*row["max_wall_time"]).rjust(11) +
+                         "{:.2f}".format(1e3*row["cpu_time"]).rjust(12) +
+                         str(row["rays_in"]).rjust(12) + str(row["rays_out"]).rjust(12) +
+                         "{:.2f}".format(row["bytes_copied"]/1024**2).rjust(13))
+
+        return "\n".join(lines)
+
+    def print_summary(self):
+        print(self.format_summary())
+
+    def export_chrome_trace(self, file_name="trace.json"):
+        pid = os.getpid()
+
+        trace_events = [{"name": name,
+                         "cat": category,
+                         "ph": "X", # complete event
+                         "ts": 1e6*start,
+                         "dur": 1e6*wall_time,
+                         "pid": pid,
+                         "tid": thread_id,
+                         "args": dict([(key, _to_json(value)) for key, value in args.items()] + [("cpu_time_ms", 1e3*cpu_time)])}
+                        for category, name, start, wall_time, cpu_time, thread_id, args in self.get_events()]
+
+        with open(file_name, "w") as file: json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+        return file_name
+
+    def _add_event(self, category, name, start, wall_time, cpu_time, args):
+        event = (category, name, start - self.__origin, wall_time, cpu_time, threading.get_ident(), args)
+
+        with self.__lock: self.__events.append(event)
+
+class _Stage():
+    __slots__ = ["__profiler", "__name", "__category", "__args", "__start", "__cpu_start"]
+
+    def __init__(self, profiler, name, category, args):
+        self.__profiler = profiler
+        self.__name     = name
+        self.__category = category
+        self.__args     = args
+
+    def __enter__(self):
+        self.__start     = time.perf_counter()
+        self.__cpu_start = time.thread_time()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.perf_counter() - self.__start
+        cpu_time  = time.thread_time() - self.__cpu_start
+
+        if not exc_type is None: self.__args["exception"] = exc_type.__name__
+
+        self.__profiler._add_event(self.__category, self.__name, self.__start, wall_time, cpu_time, self.__args)
+
+    def set(self, **args):
+        self.__args.update(args)
+
+class _NullStage():
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc_value, traceback): pass
+    def set(self, **args): pass
+
+class _NullProfiler():
+    def is_enabled(self): return False
+    def stage(self, name, category="simulation", **args): return _NULL_STAGE
+
+_NULL_STAGE    = _NullStage()
+_NULL_PROFILER = _NullProfiler()
+
+_active = threading.local()
+
+def get_profiler():
+    '''
+    the active profiler of the thread, or one that records nothing
+    '''
+    return getattr(_active, "profiler", _NULL_PROFILER)
+
+class active_profiler():
+    '''
+    with active_profiler(profiler): ... (None keeps the active one)
+    '''
+    __slots__ = ["__profiler"]
+
+    def __init__(self, profiler):
+        self.__profiler = profiler
+
+    def __enter__(self):
+        if not self.__profiler is None: self.__profiler.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.__profiler is None: self.__profiler.__exit__(exc_type, exc_value, traceback)
+
+#############################################################################
+# Helpers for the stage arguments
+
+def get_ray_count(shadow_beam):
+    try:    return int(shadow_beam._beam.rays.shape[0])
+    except: return 0
+
+def get_bytes_copied(input_beam, output_beam):
+    '''
+    size of the rays of output_beam, if they are not (a view of) the rays of input_beam
+    '''
+    try:
+        output_rays = output_beam._beam.rays
+        return 0 if (not input_beam is None and numpy.may_share_memory(input_beam._beam.rays, output_rays)) else int(output_rays.nbytes)
+    except:
+        return 0
+
+def _to_json(value):
+    if isinstance(value, (bool, int, float, str)) or value is None: return value
+    elif isinstance(value, numpy.generic): return value.item()
+    else: return str(value)
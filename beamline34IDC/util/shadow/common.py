@@ -44,36 +44,121 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
 # POSSIBILITY OF SUCH DAMAGE.                                             #
 # ----------------------------------------------------------------------- #
-import os, numpy
-import Shadow
-from Shadow.ShadowTools import write_shadow_surface
-from Shadow.ShadowPreprocessorsXraylib import prerefl, bragg
-from srxraylib.metrology import dabam
-from oasys.util.error_profile_util import DabamInputParameters, calculate_dabam_profile
-from oasys.widgets import congruence
-from orangecontrib.ml.util.mocks import MockWidget
-from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowSource, ShadowOEHistoryItem
-from orangecontrib.shadow.util.shadow_util import ShadowPhysics
-from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
+import os, sys, numpy
+import ctypes
+import tempfile
+import threading
+import collections
 import scipy.constants as codata
 
 from beamline34IDC.util.common import get_info, plot_2D, Flip, PlotMode, AspectRatio, ColorMap
+from beamline34IDC.util.workspace import make_private_file
+from beamline34IDC.util.shadow.histogram import histogram_2D
+from beamline34IDC.util.shadow.moments import get_ray_moments_statistics
+from beamline34IDC.util.profiling import get_profiler, get_ray_count
 
 m2ev = codata.c * codata.h / codata.e
 
-class TTYInibitor:
+####################################################
+# Shadow3, the OASYS widget modules (orangecontrib.shadow, that load Qt) and Hybrid
+# are imported on first use: the exceptions, the constants and the distributions
+# are used by the SRW and hardware stacks, that do not trace with Shadow.
+
+####################################################
+# Shadow3 and Hybrid (Fortran and C) write to the file descriptor 1, out of
+# reach of sys.stdout: FortranOutputCapture redirects it to an unlinked
+# temporary file for the duration of the block, and keeps the last lines of
+# the output of the block in memory (get_output()). The capture file and the
+# copy of the original stdout are opened once per process (worker processes,
+# forked or spawned, open their own) and reused by every block. Nested blocks
+# share the same redirection. An exception raised in the block with a
+# fortran_output attribute (EmptyBeamException, HybridFailureException)
+# receives the captured output.
+#
+#     with FortranOutputCapture(enabled=not verbose) as fortran_output:
+#         ...
+#
+
+class FortranOutputCapture():
+    def __init__(self, enabled=True, max_lines=200, max_bytes=64*1024):
+        self.__enabled   = enabled
+        self.__max_bytes = max_bytes
+        self.__lines     = collections.deque(maxlen=max_lines) # ring buffer: the last lines of the call
+        self.__start     = 0
+
+    def __enter__(self):
+        if self.__enabled: self.__start = _fortran_redirection.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.__enabled: return
+
+        self.__lines.extend(_fortran_redirection.stop(self.__start, self.__max_bytes).splitlines())
+
+        if not exc_value is None and getattr(exc_value, "fortran_output", "") is None: exc_value.fortran_output = self.get_output()
+
+    def get_output(self):
+        return "\n".join(self.__lines)
+
+class _FortranRedirection():
     def __init__(self):
-        self.__out_stream     = None
-        self.__fortran_stream = None
+        self.__reset()
+        if hasattr(os, "register_at_fork"): os.register_at_fork(after_in_child=self.__reset)
+
+    def __reset(self):
+        # after a fork the child opens its own descriptors: the inherited ones would share the file offset with the parent
+        self.__lock         = threading.Lock()
+        self.__capture_file = None
+        self.__stdout_copy  = None
+        self.__depth        = 0
 
     def start(self):
-        self.__out_stream     = os.open(os.devnull, os.O_RDWR)
-        self.__fortran_stream = os.dup(1)
-        os.dup2(self.__out_stream, 1)
+        '''
+        returns the position in the capture file where the output of the block starts
+        '''
+        with self.__lock:
+            if self.__capture_file is None:
+                self.__capture_file = tempfile.TemporaryFile(prefix="fortran_output_")
+                self.__stdout_copy  = os.dup(1)
+
+            if self.__depth == 0:
+                _flush_stdout()
+                os.ftruncate(self.__capture_file.fileno(), 0)
+                os.lseek(self.__capture_file.fileno(), 0, os.SEEK_SET)
+                os.dup2(self.__capture_file.fileno(), 1)
+
+            self.__depth += 1
+
+            return os.lseek(1, 0, os.SEEK_CUR)
+
+    def stop(self, start, max_bytes):
+        '''
+        returns (the last max_bytes of) the output written after start
+        '''
+        with self.__lock:
+            _flush_stdout()
+
+            end = os.lseek(1, 0, os.SEEK_CUR)
+
+            self.__depth -= 1
+            if self.__depth == 0: os.dup2(self.__stdout_copy, 1)
+
+            start = max(start, end - max_bytes)
+            output = os.pread(self.__capture_file.fileno(), end - start, start) if end > start else b""
 
-    def stop(self):
-        if not self.__fortran_stream: return
-        os.dup2(self.__fortran_stream, 1)
+        return output.decode("utf-8", errors="replace")
+
+try:    _libc = ctypes.CDLL(None)
+except: _libc = None
+
+def _flush_stdout():
+    try:    sys.stdout.flush()
+    except: pass
+    try:    _libc.fflush(None) # C stdio buffers of the extensions
+    except: pass
+
+_fortran_redirection = _FortranRedirection()
 
 
 ####################################################
@@ -90,23 +175,55 @@ def fix_Intensity(beam_out, polarization=0):
 ####################################################
 
 class EmptyBeamException(Exception):
-    def __init__(self, oe="OE"):
+    def __init__(self, oe="OE", fortran_output=None):
         super().__init__("Shadow beam after " + oe + " contains no good rays")
+        self.oe = oe
+        self.fortran_output = fortran_output # set by FortranOutputCapture
+
+    # rebuilt from the OE name when sent back from a worker process
+    def __reduce__(self): return (self.__class__, (self.oe, self.fortran_output))
 
 class HybridFailureException(Exception):
-    def __init__(self, oe="OE"):
+    def __init__(self, oe="OE", fortran_output=None):
         super().__init__("Hybrid Algorithm failed for " + oe)
+        self.oe = oe
+        self.fortran_output = fortran_output # set by FortranOutputCapture
+
+    def __reduce__(self): return (self.__class__, (self.oe, self.fortran_output))
+
 
+def create_shadow_beam(rays, oe_number=0, initial_flux=None):
+    import Shadow
+    from orangecontrib.shadow.util.shadow_objects import ShadowBeam
+
+    shadow_beam = ShadowBeam(oe_number=oe_number, beam=Shadow.Beam())
+    shadow_beam._beam.rays = rays
+    if not initial_flux is None: shadow_beam.set_initial_flux(initial_flux)
+
+    return shadow_beam
 
 def __get_arrays(shadow_beam, var_1, var_2, nbins=201, nolost=1, xrange=None, yrange=None):
-    ticket = shadow_beam._beam.histo2(var_1, var_2, nbins=nbins, nolost=nolost, xrange=xrange, yrange=yrange, calculate_widths=0)
+    # same histogram of Beam.histo2(ref=23), with numpy.bincount
+    ticket = histogram_2D(shadow_beam, var_1, var_2, nbins=nbins, nolost=nolost, xrange=xrange, yrange=yrange)
 
     return ticket['bin_h_center'], ticket['bin_v_center'], ticket["histogram"]
 
-def __get_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False):
-    x_array, y_array, z_array = __get_arrays(shadow_beam, var_1, var_2, nbins, nolost, xrange, yrange)
+class DistributionMode:
+    HISTOGRAM = "histogram"
+    MOMENTS   = "moments"
 
-    return get_info(x_array, y_array, z_array, None, None, do_gaussian_fit)  # ranges already calculated
+def __get_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False, mode=DistributionMode.HISTOGRAM):
+    # moments: statistics from the rays and 1D histograms, no 2D histogram (None) and no gaussian fit
+    if mode == DistributionMode.MOMENTS:
+        with get_profiler().stage("statistics", category="analysis", mode=mode, rays_in=get_ray_count(shadow_beam)):
+            return None, get_ray_moments_statistics(shadow_beam, var_1, var_2, nbins, nolost, xrange, yrange)
+    elif mode != DistributionMode.HISTOGRAM: raise ValueError("Distribution mode not recognized: " + str(mode))
+
+    with get_profiler().stage("histogram", category="analysis", nbins=nbins, rays_in=get_ray_count(shadow_beam)):
+        x_array, y_array, z_array = __get_arrays(shadow_beam, var_1, var_2, nbins, nolost, xrange, yrange)
+
+    with get_profiler().stage("statistics", category="analysis", mode=mode, gaussian_fit=do_gaussian_fit):
+        return get_info(x_array, y_array, z_array, None, None, do_gaussian_fit)  # ranges already calculated
 
 def __plot_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins=201, nolost=1, title="X,Z", xrange=None, yrange=None, plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW):
     if plot_mode in [PlotMode.INTERNAL, PlotMode.BOTH]:
@@ -115,13 +232,15 @@ def __plot_shadow_beam_distribution(shadow_beam, var_1, var_2, nbins=201, nolost
         plot_2D(x_array, y_array, z_array, title, None, None, int_um="", peak_um="", flip=Flip.BOTH, aspect_ratio=aspect_ratio, color_map=color_map)
 
     if plot_mode in [PlotMode.NATIVE, PlotMode.BOTH]:
+        import Shadow.ShadowTools # matplotlib
+
         Shadow.ShadowTools.plotxy(shadow_beam._beam, var_1, var_2, nbins=nbins, nolost=nolost, title=title, xrange=xrange, yrange=yrange)
 
-def get_shadow_beam_spatial_distribution(shadow_beam, nbins=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False):
-    return __get_shadow_beam_distribution(shadow_beam, 1, 3, nbins, nolost, xrange, yrange, do_gaussian_fit)
+def get_shadow_beam_spatial_distribution(shadow_beam, nbins=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False, mode=DistributionMode.HISTOGRAM):
+    return __get_shadow_beam_distribution(shadow_beam, 1, 3, nbins, nolost, xrange, yrange, do_gaussian_fit, mode)
 
-def get_shadow_beam_divergence_distribution(shadow_beam, nbins=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False):
-    return __get_shadow_beam_distribution(shadow_beam, 4, 6, nbins, nolost, xrange, yrange, do_gaussian_fit)
+def get_shadow_beam_divergence_distribution(shadow_beam, nbins=201, nolost=1, xrange=None, yrange=None, do_gaussian_fit=False, mode=DistributionMode.HISTOGRAM):
+    return __get_shadow_beam_distribution(shadow_beam, 4, 6, nbins, nolost, xrange, yrange, do_gaussian_fit, mode)
 
 def plot_shadow_beam_spatial_distribution(shadow_beam, nbins=201, nolost=1, title="X,Z", xrange=None, yrange=None, plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW):
     __plot_shadow_beam_distribution(shadow_beam, 1, 3, nbins, nolost, title, xrange, yrange, plot_mode, aspect_ratio, color_map)
@@ -135,6 +254,9 @@ def save_source_beam(source_beam, file_name="source_beam.dat"):
     source_beam.writeToFile(file_name)
 
 def load_source_beam(file_name="source_beam.dat"):
+    from oasys.widgets import congruence
+    from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowSource, ShadowOEHistoryItem
+
     source_beam = ShadowBeam()
     source_beam.loadFromFile(file_name)
 
@@ -156,6 +278,9 @@ def save_shadow_beam(shadow_beam, file_name="shadow_beam.dat"):
     shadow_beam.writeToFile(file_name)
 
 def load_shadow_beam(file_name="shadow_beam.dat"):
+    from oasys.widgets import congruence
+    from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowOEHistoryItem
+
     shadow_beam = ShadowBeam()
     shadow_beam.loadFromFile(file_name)
 
@@ -200,11 +325,18 @@ class PreProcessorFiles:
     YES_SOURCE_RANGE = 2
 
 ####################################################
+# preprocessors (xraylib, DABAM): imported on first use
 
 def write_reflectivity_file(symbol="Pt", shadow_file_name="Pt.dat", energy_range=[4000, 16000], energy_step=1.0):
+    from Shadow.ShadowPreprocessorsXraylib import prerefl
+    from oasys.widgets import congruence
+    from orangecontrib.shadow.util.shadow_util import ShadowPhysics
+
     symbol = symbol.strip()
     density = ShadowPhysics.getMaterialDensity(symbol)
 
+    make_private_file(shadow_file_name)
+
     prerefl(interactive=False,
             SYMBOL=symbol,
             DENSITY=density,
@@ -216,6 +348,11 @@ def write_reflectivity_file(symbol="Pt", shadow_file_name="Pt.dat", energy_range
     return shadow_file_name
 
 def write_bragg_file(crystal="Si", miller_indexes=[1, 1, 1], shadow_file_name="Si111.dat", energy_range=[4000, 16000], energy_step=1.0):
+    from Shadow.ShadowPreprocessorsXraylib import bragg
+    from oasys.widgets import congruence
+
+    make_private_file(shadow_file_name)
+
     bragg(interactive=False,
           DESCRIPTOR=crystal.strip(),
           H_MILLER_INDEX=miller_indexes[0],
@@ -230,6 +367,10 @@ def write_bragg_file(crystal="Si", miller_indexes=[1, 1, 1], shadow_file_name="S
     return shadow_file_name
 
 def write_dabam_file(figure_error_rms=None, dabam_entry_number=20, heigth_profile_file_name="KB.dat", seed=8787):
+    from Shadow.ShadowTools import write_shadow_surface
+    from srxraylib.metrology import dabam
+    from oasys.util.error_profile_util import DabamInputParameters, calculate_dabam_profile
+
     server = dabam.dabam()
     server.set_input_silent(True)
     server.set_server(dabam.default_server)
@@ -257,6 +398,7 @@ def write_dabam_file(figure_error_rms=None, dabam_entry_number=20, heigth_profil
 
     xx, yy, zz = calculate_dabam_profile(input_parameters)
 
+    make_private_file(heigth_profile_file_name)
     write_shadow_surface(zz, xx, yy, heigth_profile_file_name)
 
     return heigth_profile_file_name
@@ -270,6 +412,9 @@ def write_dabam_file(figure_error_rms=None, dabam_entry_number=20, heigth_profil
 # image_distance: Image Distance of the Beam after the Near Field calculation (-1 for the default)
 #
 def get_hybrid_input_parameters(shadow_beam, diffraction_plane=2, calcType=1, nf=0, focal_length=-1, image_distance=-1, verbose=False, random_seed=None):
+    from orangecontrib.ml.util.mocks import MockWidget
+    from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
+
     input_parameters = hybrid_control.HybridInputParameters()
     input_parameters.ghy_lengthunit = 2
     input_parameters.widget = MockWidget(verbose=verbose)
@@ -289,16 +434,13 @@ def get_hybrid_input_parameters(shadow_beam, diffraction_plane=2, calcType=1, nf
 
     return input_parameters
 
-def rotate_axis_system(input_beam, rotation_angle=270.0):
-    empty_element = Shadow.OE()
+def rotate_axis_system(input_beam, rotation_angle=270.0, native=False):
+    from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement
+    from beamline34IDC.util.shadow.empty_elements import create_empty_element, trace_empty_element
 
-    empty_element.ALPHA = rotation_angle
-    empty_element.DUMMY = 0.1
-    empty_element.FWRITE = 3
-    empty_element.F_REFRAC = 2
-    empty_element.T_IMAGE = 0.0
-    empty_element.T_INCIDENCE = 0.0
-    empty_element.T_REFLECTION = 180.0
-    empty_element.T_SOURCE = 0.0
+    empty_element = ShadowOpticalElement(create_empty_element(rotation_angle=rotation_angle))
 
-    return ShadowBeam.traceFromOE(input_beam.duplicate(), ShadowOpticalElement(empty_element), widget_class_name="EmptyElement")
+    # both trace a duplicate of the input beam: native is numpy. It stays off by default (here, in _trace_hkb and in
+    # PrimaryOptics.get_photon_beam) until scripts/test_empty_elements.py is bit-for-bit on primary_optics_system_beam.dat
+    if native: return trace_empty_element(input_beam, empty_element, widget_class_name="EmptyElement")
+    else:      return ShadowBeam.traceFromOE(input_beam, empty_element, widget_class_name="EmptyElement")
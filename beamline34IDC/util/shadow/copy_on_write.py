@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import numpy
+import Shadow
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam
+
+#############################################################################
+# Copy-on-write Shadow beams.
+#
+# duplicate() does not copy the rays: the new beam is a read-only view on the
+# array, and the owner of the array is marked as shared. The Shadow methods
+# that write the rays in place (traceOE, retrace, rotate, traceIdealLensOE)
+# make a private copy first, so ShadowBeam.traceFromOE works unchanged. Any
+# other writer has to call make_writable() first: writing a view raises
+# ValueError, and the owner copies the array before changing it. The flags of
+# the array of the owner are never changed.
+#
+# Hybrid writes the rays of its duplicates in place: it gets plain beams, from
+# release(). adopt_beam() takes the rays of a plain beam without copying them.
+#
+
+class _CopyOnWriteBeam(Shadow.Beam):
+    def is_shared(self):
+        return hasattr(self, "rays") and (not self.rays.flags.writeable or getattr(self, "_shared", False))
+
+    def make_writable(self):
+        # ShadowLib writes on the array buffer, ignoring the flags: always a private C-contiguous copy
+        if self.is_shared(): self.rays = numpy.array(self.rays, dtype=numpy.float64, order="C", copy=True)
+
+        self._shared = False
+
+    def share(self):
+        beam = _CopyOnWriteBeam()
+        if hasattr(self, "rays"):
+            beam.rays    = _get_read_only_view(self.rays)
+            self._shared = True
+
+        return beam
+
+    def duplicate(self):
+        return self.share()
+
+    def traceOE(self, oe, iCount):
+        self.make_writable()
+        return super().traceOE(oe, iCount)
+
+    def traceIdealLensOE(self, *args, **kwargs):
+        self.make_writable()
+        return super().traceIdealLensOE(*args, **kwargs)
+
+    def retrace(self, *args, **kwargs):
+        self.make_writable()
+        return super().retrace(*args, **kwargs)
+
+    def rotate(self, *args, **kwargs):
+        self.make_writable()
+        return super().rotate(*args, **kwargs)
+
+class CopyOnWriteShadowBeam(ShadowBeam):
+    @classmethod
+    def share_beam(cls, shadow_beam, history=True):
+        '''
+        read-only view on the rays of shadow_beam: a plain ShadowBeam is not told, it must not change the rays afterwards
+        '''
+        if isinstance(shadow_beam._beam, _CopyOnWriteBeam): beam = shadow_beam._beam.share()
+        else:
+            beam = _CopyOnWriteBeam()
+            if hasattr(shadow_beam._beam, "rays"): beam.rays = _get_read_only_view(shadow_beam._beam.rays)
+
+        return cls.__create(shadow_beam, beam, history)
+
+    @classmethod
+    def adopt_beam(cls, shadow_beam, history=True):
+        '''
+        owner of the rays of shadow_beam, not copied: shadow_beam must not be used afterwards
+        '''
+        if isinstance(shadow_beam, CopyOnWriteShadowBeam): return shadow_beam
+
+        beam = _CopyOnWriteBeam()
+        if hasattr(shadow_beam._beam, "rays"): beam.rays = shadow_beam._beam.rays
+
+        return cls.__create(shadow_beam, beam, history)
+
+    @classmethod
+    def copy_beam(cls, shadow_beam, history=True):
+        '''
+        private copy, independent from shadow_beam
+        '''
+        beam = _CopyOnWriteBeam()
+        if hasattr(shadow_beam._beam, "rays"): beam.rays = numpy.array(shadow_beam._beam.rays, dtype=numpy.float64, order="C", copy=True)
+
+        return cls.__create(shadow_beam, beam, history)
+
+    @classmethod
+    def from_rays(cls, rays, oe_number=0, initial_flux=None):
+        '''
+        read-only view on a ray array that is never written
+        '''
+        beam = _CopyOnWriteBeam()
+        beam.rays = _get_read_only_view(rays)
+
+        shadow_beam = cls(oe_number=oe_number, beam=beam)
+        if not initial_flux is None: shadow_beam.set_initial_flux(initial_flux)
+
+        return shadow_beam
+
+    def duplicate(self, copy_rays=True, history=True):
+        if copy_rays: return CopyOnWriteShadowBeam.share_beam(self, history)
+        else:         return CopyOnWriteShadowBeam.__create(self, _CopyOnWriteBeam(), history)
+
+    def is_shared(self):
+        return self._beam.is_shared()
+
+    def make_writable(self):
+        self._beam.make_writable()
+
+        return self
+
+    def release(self, history=True):
+        '''
+        plain ShadowBeam owning the rays, copied only if shared: this beam must not be used afterwards
+        '''
+        self.make_writable()
+
+        beam = Shadow.Beam()
+        if hasattr(self._beam, "rays"): beam.rays = self._beam.rays
+
+        return CopyOnWriteShadowBeam.__create(self, beam, history, shadow_beam_class=ShadowBeam)
+
+    @classmethod
+    def __create(cls, shadow_beam, beam, history, shadow_beam_class=None):
+        new_shadow_beam = (cls if shadow_beam_class is None else shadow_beam_class)(oe_number=shadow_beam._oe_number, beam=beam)
+        new_shadow_beam.setScanningData(shadow_beam.scanned_variable_data)
+        new_shadow_beam.set_initial_flux(shadow_beam.get_initial_flux())
+
+        if history:
+            for history_item in shadow_beam.history: new_shadow_beam.history.append(history_item)
+
+        return new_shadow_beam
+
+def _get_read_only_view(rays):
+    view = rays.view()
+    view.setflags(write=False)
+
+    return view
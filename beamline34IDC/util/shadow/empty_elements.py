@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import math
+import numpy
+import Shadow
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement, ShadowOEHistoryItem
+
+#############################################################################
+# Empty optical elements (F_REFRAC=2: axis rotations, screens, slits, drifts)
+# traced with numpy.
+#
+# The operations of the Shadow3 kernel (SETSOUR, RESTART, SCREEN, IMAGE1) are
+# repeated with the same constants, in the same order and with the same
+# rounding to zero of DOT/VECTOR/SCALAR, so the rays are identical to the ones
+# of Beam.traceOE, without the Fortran call, the file I/O and the stdout
+# redirection. Elements using features not reproduced here are not "empty":
+# they have to be traced with ShadowBeam.traceFromOE.
+#
+
+TORAD = 0.017453292519943295769237
+
+# Shadow zeroes the results of DOT, VECTOR and SCALAR below 1.0E-31 (single precision literal)
+_TINY = float(numpy.float32(1.0e-31))
+_NOT_TRACED = -1.0e6
+
+def is_empty_element(shadow_oe):
+    oe = shadow_oe._oe if isinstance(shadow_oe, ShadowOpticalElement) else shadow_oe
+
+    if oe.F_REFRAC != 2 or oe.FWRITE != 3: return False
+    if oe.FSTAT != 0 or oe.F_KOMA != 0 or oe.FSLIT != 0 or oe.F_PLATE != 0 or oe.N_PLATES != 0: return False
+
+    if oe.F_SCREEN == 1:
+        for i in range(oe.N_SCREEN):
+            if oe.I_ABS[i] != 0 or not oe.I_SCREEN[i] in [0, 1]: return False
+            if oe.I_SLIT[i] == 1 and not oe.K_SLIT[i] in [0, 1]: return False
+
+    return True
+
+def trace_empty_element(input_beam, shadow_oe, history=True, widget_class_name=None, recursive_history=True):
+    '''
+    same as ShadowBeam.traceFromOE, for empty elements only
+    '''
+    if not is_empty_element(shadow_oe): raise ValueError("Optical element is not an empty element")
+
+    shadow_oe.self_repair()
+
+    output_beam = input_beam.duplicate(copy_rays=False)
+    output_beam._oe_number = input_beam._oe_number + 1
+    output_beam._beam.rays = _trace_rays(input_beam._beam.rays, shadow_oe._oe, output_beam._oe_number)
+
+    if history and not output_beam._oe_number == 0:
+        history_item = ShadowOEHistoryItem(oe_number=output_beam._oe_number,
+                                           input_beam=input_beam.duplicate(history=recursive_history),
+                                           shadow_oe_start=shadow_oe.duplicate(),
+                                           shadow_oe_end=shadow_oe.duplicate(),
+                                           widget_class_name=widget_class_name)
+
+        if len(output_beam.history) - 1 < output_beam._oe_number: output_beam.history.append(history_item)
+        else: output_beam.history[output_beam._oe_number] = history_item
+
+    return output_beam
+
+def create_empty_element(distance=0.0, rotation_angle=0.0):
+    empty_element = Shadow.OE()
+
+    empty_element.ALPHA = rotation_angle
+    empty_element.DUMMY = 0.1
+    empty_element.FWRITE = 3
+    empty_element.F_REFRAC = 2
+    empty_element.T_IMAGE = 0.0
+    empty_element.T_INCIDENCE = 0.0
+    empty_element.T_REFLECTION = 180.0
+    empty_element.T_SOURCE = distance
+
+    return empty_element
+
+def create_screen_slit(aperture_x, aperture_z, center_x=0.0, center_z=0.0, distance=0.0):
+    screen_slit = create_empty_element(distance=distance)
+
+    screen_slit.F_SCREEN = 1
+    screen_slit.N_SCREEN = 1
+    screen_slit.I_SLIT = numpy.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+    screen_slit.CX_SLIT = numpy.array([center_x, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    screen_slit.CZ_SLIT = numpy.array([center_z, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    screen_slit.RX_SLIT = numpy.array([aperture_x, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    screen_slit.RZ_SLIT = numpy.array([aperture_z, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+
+    return screen_slit
+
+def drift(input_beam, distance, history=True):
+    return trace_empty_element(input_beam, ShadowOpticalElement(create_empty_element(distance=distance)), history=history, widget_class_name="EmptyElement")
+
+def rectangular_aperture(input_beam, aperture_x, aperture_z, center_x=0.0, center_z=0.0, distance=0.0, history=True):
+    return trace_empty_element(input_beam, ShadowOpticalElement(create_screen_slit(aperture_x, aperture_z, center_x, center_z, distance)), history=history, widget_class_name="ScreenSlits")
+
+#############################################################################
+# Kernel: rays is the (n, 18) ray array, vectors are tuples of columns
+
+def _trace_rays(rays, oe, oe_number):
+    rays = numpy.array(rays, dtype=numpy.float64, order="C", copy=True)
+
+    # SETSOUR: angles in radians
+    cosal, sinal     = math.cos(oe.ALPHA*TORAD), math.sin(oe.ALPHA*TORAD)
+    cosal_s, sinal_s = math.cos(oe.ALPHA_S*TORAD), math.sin(oe.ALPHA_S*TORAD)
+    t_incidence      = oe.T_INCIDENCE*TORAD
+    t_reflection     = oe.T_REFLECTION*TORAD
+    sinthr, costhr   = math.sin(t_incidence), math.cos(t_incidence)
+    psreal           = (0.0, -math.sin(t_incidence)*oe.T_SOURCE, math.cos(t_incidence)*oe.T_SOURCE)
+
+    with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        __restart(rays, cosal, sinal, cosal_s, sinal_s, sinthr, costhr, psreal)
+
+        if oe.F_SCREEN == 1:
+            # screens ahead of the mirror (I_SCREEN=1) first, as in TRACEOE
+            for i_screen in [1, 0]:
+                for i in range(oe.N_SCREEN):
+                    if oe.I_SCREEN[i] == i_screen: __screen(rays, oe, i, i_screen, oe_number, t_incidence, t_reflection)
+
+        __image(rays, oe, t_reflection)
+
+    return rays
+
+def __get_traced(rays):
+    traced = numpy.logical_not(rays[:, 9] < _NOT_TRACED)
+
+    return None if traced.all() else traced
+
+def __store(rays, column, values, traced):
+    if traced is None: rays[:, column] = values
+    else: rays[traced, column] = values[traced]
+
+def __columns(rays, first):
+    return rays[:, first], rays[:, first + 1], rays[:, first + 2]
+
+def __zero_tiny(values):
+    values[numpy.abs(values) < _TINY] = 0.0
+
+    return values
+
+def __dot(vector, versor):
+    return __zero_tiny(vector[0]*versor[0] + vector[1]*versor[1] + vector[2]*versor[2])
+
+def __scalar_zero_tiny(value):
+    return 0.0 if abs(value) < _TINY else value
+
+def __restart(rays, cosal, sinal, cosal_s, sinal_s, sinthr, costhr, psreal):
+    traced = __get_traced(rays)
+
+    for first, offset in [[0, psreal], [3, None], [6, None], [15, None]]:
+        x, y, z = __columns(rays, first)
+
+        temp_1_1 = x*cosal + z*sinal
+        temp_1_2 = y
+        temp_1_3 = -x*sinal + z*cosal
+
+        if offset is None:
+            temp_2_1 = temp_1_1
+            temp_2_2 = temp_1_2*sinthr + temp_1_3*costhr
+            temp_2_3 = -temp_1_2*costhr + temp_1_3*sinthr
+        else:
+            temp_2_1 = temp_1_1 + offset[0]
+            temp_2_2 = temp_1_2*sinthr + temp_1_3*costhr + offset[1]
+            temp_2_3 = -temp_1_2*costhr + temp_1_3*sinthr + offset[2]
+
+        new_x = temp_2_1*cosal_s - temp_2_2*sinal_s
+        new_y = temp_2_1*sinal_s + temp_2_2*cosal_s
+
+        __store(rays, first,     new_x,    traced)
+        __store(rays, first + 1, new_y,    traced)
+        __store(rays, first + 2, temp_2_3, traced)
+
+def __screen(rays, oe, i, i_screen, oe_number, t_incidence, t_reflection):
+    traced = numpy.logical_not(rays[:, 9] < _NOT_TRACED)
+
+    if i_screen == 0:
+        wy_sc = (0.0, math.sin(t_reflection), math.cos(t_reflection))
+        pole  = oe.SL_DIS[i]
+    else:
+        wy_sc = (0.0, math.sin(t_incidence), -math.cos(t_incidence))
+        pole  = -oe.SL_DIS[i]
+
+    ux_sc = (1.0, 0.0, 0.0)
+    vz_sc = __get_normalized(__get_cross_product(ux_sc, wy_sc))
+    scr_cen = tuple(__scalar_zero_tiny(component*pole) for component in wy_sc)
+
+    x, y, z    = __columns(rays, 0)
+    vx, vy, vz = __columns(rays, 3)
+
+    above = pole - x*wy_sc[0] - y*wy_sc[1] - z*wy_sc[2]
+    below = wy_sc[0]*vx + wy_sc[1]*vy + wy_sc[2]*vz
+    dist  = above/below
+
+    p_screen = [__zero_tiny((x + dist*vx) - scr_cen[0]),
+                __zero_tiny((y + dist*vy) - scr_cen[1]),
+                __zero_tiny((z + dist*vz) - scr_cen[2])]
+
+    no_intersection = numpy.logical_and(traced, below == 0.0)
+    rays[no_intersection, 9] = - 1.0e4*oe_number - 1.0e2*(i + 1)
+
+    if oe.I_SLIT[i] == 1:
+        px = __dot(p_screen, ux_sc) - oe.CX_SLIT[i]
+        pz = __dot(p_screen, vz_sc) - oe.CZ_SLIT[i]
+
+        if oe.K_SLIT[i] == 0: # rectangular
+            outside = (px > oe.RX_SLIT[i]/2) | (px < -oe.RX_SLIT[i]/2) | (pz > oe.RZ_SLIT[i]/2) | (pz < -oe.RZ_SLIT[i]/2)
+            lost = numpy.logical_not(outside) if oe.I_STOP[i] == 1 else outside
+        else: # elliptical
+            test = px**2/(oe.RX_SLIT[i]**2/4) + pz**2/(oe.RZ_SLIT[i]**2/4) - 1.0
+            lost = test < 0.0 if oe.I_STOP[i] == 1 else test > 0.0
+
+        rays[numpy.logical_and(numpy.logical_and(traced, below != 0.0), lost), 9] = - 1.0e2*oe_number - 1.0*(i + 1)
+
+def __image(rays, oe, t_reflection):
+    traced = numpy.logical_not(rays[:, 9] < _NOT_TRACED)
+
+    # IMREF
+    vnimag = (0.0, math.sin(t_reflection), math.cos(t_reflection))
+    rimcen = (vnimag[0]*oe.T_IMAGE, vnimag[1]*oe.T_IMAGE, vnimag[2]*oe.T_IMAGE)
+    c_star = vnimag
+    uxim   = (1.0, 0.0, 0.0)
+    vzim   = (0.0, -math.cos(t_reflection), math.sin(t_reflection))
+
+    x, y, z    = __columns(rays, 0)
+    vx, vy, vz = __columns(rays, 3)
+
+    above = oe.T_IMAGE - x*c_star[0] - y*c_star[1] - z*c_star[2]
+    below = c_star[0]*vx + c_star[1]*vy + c_star[2]*vz
+    dist  = above/below
+
+    p_imag = [__zero_tiny((x + dist*vx) - rimcen[0]),
+              __zero_tiny((y + dist*vy) - rimcen[1]),
+              __zero_tiny((z + dist*vz) - rimcen[2])]
+
+    new_columns = {0 : __dot(p_imag, uxim), 1 : __dot(p_imag, vnimag), 2 : __dot(p_imag, vzim)}
+
+    for first in [3, 6, 15]:
+        vector = __columns(rays, first)
+
+        new_columns[first]     = __dot(vector, uxim)
+        new_columns[first + 1] = __dot(vector, vnimag)
+        new_columns[first + 2] = __dot(vector, vzim)
+
+    # optical path: F_REFRAC=2, so the image space index of refraction is used
+    new_columns[12] = rays[:, 12] + numpy.abs(dist)*oe.R_IND_IMA
+
+    no_intersection = numpy.logical_and(traced, below == 0.0)
+    traced          = numpy.logical_and(traced, below != 0.0)
+    if traced.all(): traced = None
+
+    for column, values in new_columns.items(): __store(rays, column, values, traced)
+
+    rays[no_intersection, 9] = -3.0e6
+
+def __get_cross_product(v1, v2):
+    return tuple(__scalar_zero_tiny(component) for component in [v1[1]*v2[2] - v1[2]*v2[1],
+                                                                 - (v1[0]*v2[2] - v1[2]*v2[0]),
+                                                                 v1[0]*v2[1] - v1[1]*v2[0]])
+
+def __get_normalized(v):
+    norm = __scalar_zero_tiny(math.sqrt(v[0]**2 + v[1]**2 + v[2]**2))
+
+    if norm == 0.0: return v
+
+    norm = 1/norm
+
+    return (v[0]*norm, v[1]*norm, v[2]*norm)
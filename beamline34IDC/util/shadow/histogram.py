@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+import numpy
+
+#############################################################################
+# Weighted 2D histograms of Shadow beams with numpy.bincount.
+#
+# Same result of Shadow.Beam.histo2 (ref=23, intensity weights): same bin
+# edges (numpy.linspace of the range), same automatic ranges (get_good_range),
+# same treatment of the rays on the edges and same summation order (histo2
+# ends in numpy.histogram2d, that ends in numpy.bincount). The bin indexes are
+# computed with arithmetic on the cached bin geometry, corrected against the
+# edges, instead of a searchsorted, and only the needed columns of the good
+# rays are read.
+#
+
+_FLAG       = 9 # column 10: flag (>=0 good ray, <0 lost ray)
+_INTENSITY  = 23
+_AMPLITUDES = [6, 7, 8, 15, 16, 17] # columns 7,8,9 (Es) and 16,17,18 (Ep)
+
+class HistogramGeometry():
+    '''
+    fixed bin geometry: edges, centers and index arithmetic are computed once and reused for every beam
+    '''
+    def __init__(self, nbins_h=201, nbins_v=201, xrange=[-1.0, 1.0], yrange=[-1.0, 1.0]):
+        self.nbins_h = int(nbins_h)
+        self.nbins_v = int(nbins_v)
+        self.xrange  = [float(xrange[0]), float(xrange[1])]
+        self.yrange  = [float(yrange[0]), float(yrange[1])]
+
+        self.bin_h_edges  = numpy.linspace(self.xrange[0], self.xrange[1], self.nbins_h + 1)
+        self.bin_v_edges  = numpy.linspace(self.yrange[0], self.yrange[1], self.nbins_v + 1)
+        self.bin_h_center = 0.5*(self.bin_h_edges[:-1] + self.bin_h_edges[1:])
+        self.bin_v_center = 0.5*(self.bin_v_edges[:-1] + self.bin_v_edges[1:])
+
+        self.nbins = self.nbins_h*self.nbins_v
+
+    def get_bin_indexes(self, x, y):
+        '''
+        flat bin index (i_h*nbins_v + i_v) of the points inside the ranges, and the positions of these points
+        '''
+        inside = numpy.flatnonzero((x >= self.xrange[0]) & (x <= self.xrange[1]) & (y >= self.yrange[0]) & (y <= self.yrange[1]))
+        if inside.size < x.size: x, y = x[inside], y[inside]
+        else:                    inside = None # all the points: no gather of the weights
+
+        bin_indexes = _get_bin_indexes(x, self.bin_h_edges, self.nbins_h)
+        bin_indexes *= self.nbins_v
+        bin_indexes += _get_bin_indexes(y, self.bin_v_edges, self.nbins_v)
+
+        return bin_indexes, inside
+
+    @classmethod
+    def get(cls, nbins_h=201, nbins_v=201, xrange=[-1.0, 1.0], yrange=[-1.0, 1.0]):
+        '''
+        cached instance, for fixed ranges
+        '''
+        key = (int(nbins_h), int(nbins_v), float(xrange[0]), float(xrange[1]), float(yrange[0]), float(yrange[1]))
+
+        try: return _GEOMETRIES[key]
+        except KeyError:
+            if len(_GEOMETRIES) >= _MAX_GEOMETRIES: _GEOMETRIES.pop(next(iter(_GEOMETRIES)))
+            geometry = _GEOMETRIES[key] = cls(nbins_h, nbins_v, xrange, yrange)
+
+            return geometry
+
+_GEOMETRIES     = {}
+_MAX_GEOMETRIES = 64
+
+def histogram_2D(shadow_beam, col_h=1, col_v=3, nbins=201, nbins_h=None, nbins_v=None, nolost=1, xrange=None, yrange=None, geometry=None, dtype=numpy.float64):
+    '''
+    same ticket of Shadow.Beam.histo2(col_h, col_v, ref=23, calculate_widths=0), for the keys used here.
+    geometry: HistogramGeometry to be reused (xrange, yrange and nbins are ignored)
+    dtype: of the intensity weights, of the sums and of the histogram (float64, the same of histo2: numpy.bincount)
+    '''
+    rays = _get_rays(shadow_beam)
+    x, y, weights = _get_columns(shadow_beam, rays, col_h, col_v, nolost, dtype)
+
+    if geometry is None:
+        if nbins_h is None: nbins_h = nbins
+        if nbins_v is None: nbins_v = nbins
+        if xrange is None: xrange = get_good_range(x)
+        if yrange is None: yrange = get_good_range(y)
+
+        geometry = HistogramGeometry(nbins_h, nbins_v, xrange, yrange)
+
+    histogram = _histogram(geometry, x, y, weights, dtype)
+
+    return _get_ticket(geometry, histogram)
+
+def histogram_2D_batch(shadow_beams, geometry, col_h=1, col_v=3, nolost=1, dtype=numpy.float64):
+    '''
+    histograms of many beams on the same geometry, with a single bincount: array with shape (n_beams, nbins_h, nbins_v)
+    '''
+    bin_indexes = []
+    weights     = []
+
+    for i, shadow_beam in enumerate(shadow_beams):
+        x, y, beam_weights = _get_columns(shadow_beam, _get_rays(shadow_beam), col_h, col_v, nolost, dtype)
+
+        beam_bin_indexes, inside = geometry.get_bin_indexes(x, y)
+        beam_bin_indexes += i*geometry.nbins
+
+        bin_indexes.append(beam_bin_indexes)
+        weights.append(beam_weights if inside is None else beam_weights[inside])
+
+    n_beams = len(bin_indexes)
+    if n_beams == 0: return numpy.zeros((0, geometry.nbins_h, geometry.nbins_v), dtype=dtype)
+
+    histograms = _accumulate(numpy.concatenate(bin_indexes), numpy.concatenate(weights), n_beams*geometry.nbins, dtype)
+
+    return histograms.reshape((n_beams, geometry.nbins_h, geometry.nbins_v))
+
+def get_good_range(column):
+    '''
+    same as Shadow.Beam.get_good_range, on the (already selected) column
+    '''
+    if column.size == 0: return [-1.0, 1.0]
+
+    rmin = column.min()
+    rmax = column.max()
+
+    if rmin > 0.0: rmin = rmin*0.95
+    else:          rmin = rmin*1.05
+    if rmax < 0.0: rmax = rmax*0.95
+    else:          rmax = rmax*1.05
+
+    if rmin == rmax:
+        rmin = rmin*0.95
+        rmax = rmax*1.05
+        if rmin == 0.0:
+            rmin = -1.0
+            rmax = 1.0
+
+    return [rmin, rmax]
+
+####################################################
+
+def _get_rays(shadow_beam):
+    if isinstance(shadow_beam, numpy.ndarray): return shadow_beam
+    else:                                      return shadow_beam._beam.rays
+
+def _get_columns(shadow_beam, rays, col_h, col_v, nolost, dtype):
+    if   nolost == 1: good = numpy.flatnonzero(rays[:, _FLAG] >= 0)
+    elif nolost == 2: good = numpy.flatnonzero(rays[:, _FLAG] < 0)
+    else:             good = None
+
+    if not good is None and good.size == rays.shape[0]: good = None # no lost rays: no gather
+
+    def get_column(col):
+        if 1 <= col <= 18: column = rays[:, col - 1]
+        elif col == _INTENSITY: # |Es|^2 + |Ep|^2, summed in the same order of Shadow
+            if good is None: amplitudes = rays[:, _AMPLITUDES]
+            else:            amplitudes = rays[good[:, None], _AMPLITUDES]
+
+            amplitudes = amplitudes.astype(dtype, copy=False)
+            amplitudes *= amplitudes
+
+            return (amplitudes[:, 0] + amplitudes[:, 1] + amplitudes[:, 2]) + (amplitudes[:, 3] + amplitudes[:, 4] + amplitudes[:, 5])
+        else: # other Shadow columns are computed by Shadow
+            if isinstance(shadow_beam, numpy.ndarray): raise ValueError("Column " + str(col) + " needs a Shadow beam")
+            column = shadow_beam._beam.getshonecol(col, nolost=0)
+
+        return column if good is None else column[good]
+
+    return get_column(col_h), get_column(col_v), get_column(_INTENSITY)
+
+def _histogram(geometry, x, y, weights, dtype):
+    bin_indexes, inside = geometry.get_bin_indexes(x, y)
+    if not inside is None: weights = weights[inside]
+
+    return _accumulate(bin_indexes, weights, geometry.nbins, dtype).reshape((geometry.nbins_h, geometry.nbins_v))
+
+def _accumulate(bin_indexes, weights, nbins, dtype):
+    # numpy.bincount sums in float64: the other types are summed in a buffer of that type
+    if numpy.dtype(dtype) == numpy.float64: return numpy.bincount(bin_indexes, weights=weights, minlength=nbins)
+
+    histogram = numpy.zeros(nbins, dtype=dtype)
+    numpy.add.at(histogram, bin_indexes, weights)
+
+    return histogram
+
+def _get_bin_indexes(values, edges, nbins):
+    # as in numpy.histogram: index from the uniform bin width, then corrected on the edges, where the rounding can be wrong
+    first_edge = edges[0]
+    last_edge  = edges[-1]
+
+    bin_indexes = ((values - first_edge) / (last_edge - first_edge) * nbins).astype(numpy.intp)
+    bin_indexes[bin_indexes == nbins] -= 1 # values on the last edge are in the last bin
+
+    bin_indexes[values < edges[bin_indexes]] -= 1
+    bin_indexes[(values >= edges[bin_indexes + 1]) & (bin_indexes != nbins - 1)] += 1
+
+    return bin_indexes
+
+def _get_ticket(geometry, histogram):
+    return {'error'        : 0,
+            'nbins_h'      : geometry.nbins_h,
+            'nbins_v'      : geometry.nbins_v,
+            'xrange'       : geometry.xrange,
+            'yrange'       : geometry.yrange,
+            'bin_h_edges'  : geometry.bin_h_edges,
+            'bin_v_edges'  : geometry.bin_v_edges,
+            'bin_h_center' : geometry.bin_h_center,
+            'bin_v_center' : geometry.bin_v_center,
+            'histogram'    : histogram,
+            'histogram_h'  : histogram.sum(axis=1),
+            'histogram_v'  : histogram.sum(axis=0)}
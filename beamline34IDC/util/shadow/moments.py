@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+import numpy
+from orangecontrib.ml.util.data_structures import DictionaryWrapper
+
+from beamline34IDC.util.shadow.histogram import get_good_range, _get_columns, _get_bin_indexes
+
+#############################################################################
+# Beam statistics from the intensity-weighted moments of the rays.
+#
+# Centroid and sigma come from the sums of w, w*x and w*x^2 in O(N), the FWHM
+# from 1D histograms of the two projections: no 2D image is built. The sums
+# are shifted on the centroid of the first chunk, so that sigma does not lose
+# precision when the beam is far from the axis. The rays can be added chunk by
+# chunk, for beams too large to be held at once.
+#
+# The parameters are the ones of get_info, with the same sign of the centroids
+# (h from col_h, v from col_v). Without the 2D image the peak intensity is the
+# separable estimate peak_h * peak_v / total, in the same units (intensity
+# per bin).
+#
+
+class RayMomentsAccumulator():
+    '''
+    xrange, yrange: if None, the good ranges of the first chunk (rays of the next chunks outside them are
+                    counted in the moments but not in the 1D histograms); if given, only the rays inside both
+                    ranges are counted, as in the 2D histogram
+    '''
+    def __init__(self, col_h=1, col_v=3, nbins=201, nbins_h=None, nbins_v=None, nolost=1, xrange=None, yrange=None):
+        self.__col_h   = col_h
+        self.__col_v   = col_v
+        self.__nbins_h = nbins if nbins_h is None else nbins_h
+        self.__nbins_v = nbins if nbins_v is None else nbins_v
+        self.__nolost  = nolost
+        self.__fixed_ranges = not (xrange is None or yrange is None)
+
+        self.__edges_h = None
+        self.__edges_v = None
+        if not xrange is None: self.__edges_h = numpy.linspace(xrange[0], xrange[1], self.__nbins_h + 1)
+        if not yrange is None: self.__edges_v = numpy.linspace(yrange[0], yrange[1], self.__nbins_v + 1)
+
+        self.__histogram_h = numpy.zeros(self.__nbins_h)
+        self.__histogram_v = numpy.zeros(self.__nbins_v)
+        self.__shift       = None
+        self.__sums        = numpy.zeros(5) # w, w*dx, w*dx^2, w*dy, w*dy^2
+
+    def add(self, shadow_beam):
+        '''
+        shadow_beam: ShadowBeam or ray array (chunk of rays)
+        '''
+        rays = shadow_beam if isinstance(shadow_beam, numpy.ndarray) else shadow_beam._beam.rays
+        x, y, weights = _get_columns(shadow_beam, rays, self.__col_h, self.__col_v, self.__nolost, numpy.float64)
+
+        if self.__fixed_ranges:
+            inside = (x >= self.__edges_h[0]) & (x <= self.__edges_h[-1]) & (y >= self.__edges_v[0]) & (y <= self.__edges_v[-1])
+            if not numpy.all(inside): x, y, weights = x[inside], y[inside], weights[inside]
+
+        if x.size == 0: return
+
+        if self.__edges_h is None: self.__edges_h = numpy.linspace(*get_good_range(x), self.__nbins_h + 1)
+        if self.__edges_v is None: self.__edges_v = numpy.linspace(*get_good_range(y), self.__nbins_v + 1)
+
+        self.__histogram_h += _get_histogram_1D(x, weights, self.__edges_h)
+        self.__histogram_v += _get_histogram_1D(y, weights, self.__edges_v)
+
+        total = weights.sum()
+        if self.__shift is None:
+            if total > 0: self.__shift = (numpy.dot(weights, x)/total, numpy.dot(weights, y)/total)
+            else:         self.__shift = (x.mean(), y.mean())
+
+        dx = x - self.__shift[0]
+        dy = y - self.__shift[1]
+        wdx = weights*dx
+        wdy = weights*dy
+
+        self.__sums += [total, wdx.sum(), numpy.dot(wdx, dx), wdy.sum(), numpy.dot(wdy, dy)]
+
+    def get_statistics(self):
+        '''
+        same parameters of the DictionaryWrapper of get_info (gaussian_fit is always empty)
+        '''
+        total, sum_x, sum_x2, sum_y, sum_y2 = self.__sums
+
+        if total <= 0:
+            mean_h = mean_v = numpy.nan
+            sigma_h = sigma_v = numpy.nan
+        else:
+            mean_h  = self.__shift[0] + sum_x/total
+            mean_v  = self.__shift[1] + sum_y/total
+            sigma_h = numpy.sqrt(max(sum_x2/total - (sum_x/total)**2, 0.0))
+            sigma_v = numpy.sqrt(max(sum_y2/total - (sum_y/total)**2, 0.0))
+
+        if self.__edges_h is None:
+            fwhm_h = fwhm_v = None
+            peak_intensity = integral_intensity = 0.0
+        else:
+            bin_h = 0.5*(self.__edges_h[:-1] + self.__edges_h[1:])
+            bin_v = 0.5*(self.__edges_v[:-1] + self.__edges_v[1:])
+
+            from oasys.util.oasys_util import get_fwhm # oasys is loaded on first use, not by the headless imports
+
+            fwhm_h, _, _ = get_fwhm(self.__histogram_h, bin_h)
+            fwhm_v, _, _ = get_fwhm(self.__histogram_v, bin_v)
+
+            total_histogram = self.__histogram_h.sum()
+
+            peak_intensity     = self.__histogram_h.max()*self.__histogram_v.max()/total_histogram if total_histogram > 0 else 0.0
+            integral_intensity = total_histogram*(bin_h[1] - bin_h[0])*(bin_v[1] - bin_v[0])
+
+        return DictionaryWrapper(
+            h_sigma=sigma_h,
+            h_fwhm=fwhm_h,
+            h_centroid=-mean_h,
+            v_sigma=sigma_v,
+            v_fwhm=fwhm_v,
+            v_centroid=-mean_v,
+            integral_intensity=integral_intensity,
+            peak_intensity=peak_intensity,
+            gaussian_fit={}
+        )
+
+def get_ray_moments_statistics(shadow_beam, col_h=1, col_v=3, nbins=201, nolost=1, xrange=None, yrange=None):
+    accumulator = RayMomentsAccumulator(col_h, col_v, nbins=nbins, nolost=nolost, xrange=xrange, yrange=yrange)
+    accumulator.add(shadow_beam)
+
+    return accumulator.get_statistics()
+
+def _get_histogram_1D(values, weights, edges):
+    nbins  = len(edges) - 1
+    inside = (values >= edges[0]) & (values <= edges[-1])
+    if not numpy.all(inside): values, weights = values[inside], weights[inside]
+
+    return numpy.bincount(_get_bin_indexes(values, edges, nbins), weights=weights, minlength=nbins)
@@ -47,15 +47,21 @@
 import os
 import numpy
 import pickle
-from srxraylib.metrology import dabam
-from oasys.util.error_profile_util import DabamInputParameters, calculate_dabam_profile
-from orangecontrib.srw.util.srw_util import write_error_profile_file
-from oasys_srw.uti_plot import uti_plot2d1d, uti_plot_init, uti_plot_show
-from oasys_srw.srwlib import array, srwl, deepcopy
 
 from beamline34IDC.util.common import get_info, plot_2D, Flip, PlotMode, AspectRatio, ColorMap
 
-uti_plot_init(backend="Qt5Agg")
+# SRW, its plotting (Qt5Agg backend) and the DABAM profiles are imported on first use
+
+__uti_plot_initialized = False
+
+def __init_uti_plot():
+    global __uti_plot_initialized
+
+    if not __uti_plot_initialized:
+        from oasys_srw.uti_plot import uti_plot_init
+
+        uti_plot_init(backend="Qt5Agg")
+        __uti_plot_initialized = True
 
 def __get_arrays(srw_wavefront):
     _, x_array, y_array, i = srw_wavefront.get_intensity(multi_electron=False)
@@ -78,6 +84,11 @@ def plot_srw_wavefront_spatial_distribution(srw_wavefront, title="X,Z", xrange=N
         plot_2D(x_array, y_array, z_array, title, xrange, yrange, flip=Flip.VERTICAL, aspect_ratio=aspect_ratio, color_map=color_map)
 
     if plot_mode in [PlotMode.NATIVE, PlotMode.BOTH]:
+        from oasys_srw.uti_plot import uti_plot2d1d, uti_plot_show
+        from oasys_srw.srwlib import array, srwl, deepcopy
+
+        __init_uti_plot()
+
         mesh = deepcopy(srw_wavefront.mesh)
         arI = array('f', [0] * mesh.nx * mesh.ny)  # "flat" 2D array to take intensity data
         srwl.CalcIntFromElecField(arI, srw_wavefront, 6, 0, 3, mesh.eStart, 0, 0)
@@ -102,6 +113,10 @@ def load_srw_wavefront(file_name="srw_wavefront.dat"):
     return srw_wavefront
 
 def write_dabam_file(figure_error_rms=None, dabam_entry_number=20, heigth_profile_file_name="KB.dat", seed=8787):
+    from srxraylib.metrology import dabam
+    from oasys.util.error_profile_util import DabamInputParameters, calculate_dabam_profile
+    from orangecontrib.srw.util.srw_util import write_error_profile_file
+
     server = dabam.dabam()
     server.set_input_silent(True)
     server.set_server(dabam.default_server)
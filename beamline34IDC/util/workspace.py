@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# ----------------------------------------------------------------------- #
+# Copyright (c) 2021, UChicago Argonne, LLC. All rights reserved.         #
+#                                                                         #
+# Copyright 2021. UChicago Argonne, LLC. This software was produced       #
+# under U.S. Government contract DE-AC02-06CH11357 for Argonne National   #
+# Laboratory (ANL), which is operated by UChicago Argonne, LLC for the    #
+# U.S. Department of Energy. The U.S. Government has rights to use,       #
+# reproduce, and distribute this software.  NEITHER THE GOVERNMENT NOR    #
+# UChicago Argonne, LLC MAKES ANY WARRANTY, EXPRESS OR IMPLIED, OR        #
+# ASSUMES ANY LIABILITY FOR THE USE OF THIS SOFTWARE.  If software is     #
+# modified to produce derivative works, such modified software should     #
+# be clearly marked, so as not to confuse it with the version available   #
+# from ANL.                                                               #
+#                                                                         #
+# Additionally, redistribution and use in source and binary forms, with   #
+# or without modification, are permitted provided that the following      #
+# conditions are met:                                                     #
+#                                                                         #
+#     * Redistributions of source code must retain the above copyright    #
+#       notice, this list of conditions and the following disclaimer.     #
+#                                                                         #
+#     * Redistributions in binary form must reproduce the above copyright #
+#       notice, this list of conditions and the following disclaimer in   #
+#       the documentation and/or other materials provided with the        #
+#       distribution.                                                     #
+#                                                                         #
+#     * Neither the name of UChicago Argonne, LLC, Argonne National       #
+#       Laboratory, ANL, the U.S. Government, nor the names of its        #
+#       contributors may be used to endorse or promote products derived   #
+#       from this software without specific prior written permission.     #
+#                                                                         #
+# THIS SOFTWARE IS PROVIDED BY UChicago Argonne, LLC AND CONTRIBUTORS     #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT       #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS       #
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL UChicago     #
+# Argonne, LLC OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,        #
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,    #
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;        #
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER        #
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT      #
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN       #
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE         #
+# POSSIBILITY OF SUCH DAMAGE.                                             #
+# ----------------------------------------------------------------------- #
+import os
+import shutil
+import stat
+import tempfile
+import weakref
+
+from beamline34IDC.util import clean_up
+
+# read-only inputs of the focusing optics simulation
+DEFAULT_INPUT_FILES = ["Pt.dat", "VKB-LTP_shadow.dat", "HKB-LTP_shadow.dat", "benders_calibration.ini"]
+
+#############################################################################
+# Private scratch directory for the files written by Shadow3, Hybrid and the
+# bender calculation, which use fixed names in the current directory.
+#
+# The input files of the source directory are linked (copied read-only where
+# links are not supported). Used as a context manager, it changes the current
+# directory of the process and restores the previous one on exit (re-entrant).
+# The current directory is global to the process: a workspace isolates
+# processes (or sequential instances), not threads. The directory is removed
+# by remove(), or when the workspace is garbage collected.
+#
+
+class Workspace():
+    def __init__(self, source_directory=os.curdir, input_files=DEFAULT_INPUT_FILES, root_directory=None, prefix="workspace_"):
+        self.__source_directory = os.path.abspath(source_directory)
+        self.__directory = tempfile.mkdtemp(prefix=prefix, dir=root_directory)
+        self.__previous_directories = []
+        self.__finalizer = weakref.finalize(self, shutil.rmtree, self.__directory, ignore_errors=True)
+
+        for file_name in input_files: self.link_file(file_name)
+
+    def get_directory(self):
+        return self.__directory
+
+    def get_source_directory(self):
+        return self.__source_directory
+
+    def link_file(self, file_name):
+        source_file = os.path.join(self.__source_directory, file_name)
+        if not os.path.exists(source_file): return
+
+        workspace_file = os.path.join(self.__directory, os.path.basename(file_name))
+        if os.path.lexists(workspace_file): os.remove(workspace_file)
+
+        try:
+            os.symlink(source_file, workspace_file)
+        except (OSError, NotImplementedError):
+            shutil.copyfile(source_file, workspace_file)
+            os.chmod(workspace_file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    def __enter__(self):
+        if self.__directory is None: raise ValueError("Workspace has been removed")
+
+        self.__previous_directories.append(os.path.abspath(os.curdir))
+        os.chdir(self.__directory)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.chdir(self.__previous_directories.pop())
+
+    def clean_up(self):
+        if not self.__directory is None: clean_up(self.__directory)
+
+    def remove(self):
+        if not self.__directory is None:
+            if self.__previous_directories: raise ValueError("Workspace is in use")
+
+            self.__finalizer()
+            self.__directory = None
+
+def make_private_file(file_name):
+    '''
+    files linked into a workspace are shared: they are unlinked before being rewritten
+    '''
+    if os.path.islink(file_name): os.remove(file_name)
+    elif os.path.exists(file_name) and not os.access(file_name, os.W_OK): os.remove(file_name)
@@ -48,14 +48,16 @@
 from beamline34IDC.simulation.facade import Implementors
 from beamline34IDC.util.common import PlotMode, AspectRatio, ColorMap
 
-from beamline34IDC.util.srw.common import get_srw_wavefront_distribution_info, plot_srw_wavefront_spatial_distribution, \
-    load_srw_wavefront, save_srw_wavefront
+# the SRW stack is imported on first use, the Shadow one is needed by every simulation
 from beamline34IDC.util.shadow.common import get_shadow_beam_spatial_distribution, get_shadow_beam_divergence_distribution, \
     plot_shadow_beam_divergence_distribution, plot_shadow_beam_spatial_distribution, \
     load_shadow_beam, load_source_beam, save_shadow_beam, save_source_beam
 
 def load_beam(implementor, file_name, **kwargs):
-    if implementor == Implementors.SRW: return load_srw_wavefront(file_name)
+    if implementor == Implementors.SRW:
+        from beamline34IDC.util.srw.common import load_srw_wavefront
+
+        return load_srw_wavefront(file_name)
     elif implementor == Implementors.SHADOW:
         try:
             if kwargs["which_beam"] == "source": return load_source_beam(file_name)
@@ -63,7 +65,10 @@ def load_beam(implementor, file_name, **kwargs):
         except: return load_shadow_beam(file_name)
 
 def save_beam(beam, file_name, **kwargs):
-    if implementor == Implementors.SRW: save_srw_wavefront(srw_wavefront=beam, file_name=file_name)
+    if implementor == Implementors.SRW:
+        from beamline34IDC.util.srw.common import save_srw_wavefront
+
+        save_srw_wavefront(srw_wavefront=beam, file_name=file_name)
     elif implementor == Implementors.SHADOW:
         try:
             if kwargs["which_beam"] == "source": save_source_beam(source_beam=beam, file_name=file_name)
@@ -71,7 +76,10 @@ def save_beam(beam, file_name, **kwargs):
         except: save_shadow_beam(shadow_beam=beam, file_name=file_name)
 
 def get_distribution_info(implementor, beam, xrange=None, yrange=None, do_gaussian_fit=False):
-    if implementor == Implementors.SRW: return get_srw_wavefront_distribution_info(beam, title, xrange, yrange, do_gaussian_fit)
+    if implementor == Implementors.SRW:
+        from beamline34IDC.util.srw.common import get_srw_wavefront_distribution_info
+
+        return get_srw_wavefront_distribution_info(beam, title, xrange, yrange, do_gaussian_fit)
     elif implementor == Implementors.SHADOW:
         try:    nbins = kwargs["nbins"]
         except: nbins = 201
@@ -84,7 +92,10 @@ def get_distribution_info(implementor, beam, xrange=None, yrange=None, do_gaussi
         except: return get_shadow_beam_spatial_distribution(beam, nbins, nolost, title, xrange, yrange)
 
 def plot_distribution(implementor, beam, title="X,Z", xrange=None, yrange=None, plot_mode=PlotMode.INTERNAL, aspect_ratio=AspectRatio.AUTO, color_map=ColorMap.RAINBOW, **kwargs):
-    if implementor == Implementors.SRW: plot_srw_wavefront_spatial_distribution(beam, title, xrange, yrange, plot_mode, aspect_ratio, color_map)
+    if implementor == Implementors.SRW:
+        from beamline34IDC.util.srw.common import plot_srw_wavefront_spatial_distribution
+
+        plot_srw_wavefront_spatial_distribution(beam, title, xrange, yrange, plot_mode, aspect_ratio, color_map)
     elif implementor == Implementors.SHADOW:
         try: nbins = kwargs["nbins"]
         except: nbins = 201
@@ -172,15 +172,17 @@ if __name__=='__main__':
     input_beam_path = "primary_optics_system_beam.dat"
 
     focusing_system = reinitialize(input_beam_path=input_beam_path)
+    initial_state = focusing_system.snapshot() # back to the initial state without initializing and tracing again
+
     check_vkb_3(focusing_system)
 
-    focusing_system = reinitialize(input_beam_path)
+    focusing_system.restore(initial_state)
     check_hkb_3(focusing_system)
 
-    focusing_system = reinitialize(input_beam_path)
+    focusing_system.restore(initial_state)
     check_vkb_q(focusing_system)
 
-    focusing_system = reinitialize(input_beam_path)
+    focusing_system.restore(initial_state)
     check_hkb_q(focusing_system)
 
     clean_up()
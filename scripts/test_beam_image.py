@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import subprocess
+
+# offline: the virtual beamline served by the simulated IOC, on this host
+os.environ["EPICS_CA_ADDR_LIST"]       = "127.0.0.1"
+os.environ["EPICS_CA_AUTO_ADDR_LIST"]  = "NO"
+os.environ["EPICS_CA_MAX_ARRAY_BYTES"] = "10000000" # image1:ArrayData
+
+from beamline34IDC.hardware.facade import Beamline, Implementors
+from beamline34IDC.hardware.facade.focusing_optics_factory import hardware_focusing_optics_factory_method
+from beamline34IDC.hardware.facade.focusing_optics_interface import Directions, ScanMode
+
+# beam characterization at the sample: scans of the sample stage (H and V) vs a single image of the detector,
+# analyzed as the simulated beams (get_info), with ROI and background subtraction
+
+PARAMETERS    = [[-2, 2, 20], [-2, 2, 20]]
+EXPOSURE_TIME = 0.1
+
+def print_info(name, info):
+    print(name + ": centroid " + str(round(info.get_parameter("h_centroid"), 3)) + ", " + str(round(info.get_parameter("v_centroid"), 3)) +
+          " mm, sigma " + str(round(info.get_parameter("h_sigma"), 3)) + ", " + str(round(info.get_parameter("v_sigma"), 3)) +
+          " mm, fwhm " + str(round(info.get_parameter("h_fwhm"), 3)) + ", " + str(round(info.get_parameter("v_fwhm"), 3)) +
+          " mm, peak " + str(round(info.get_parameter("peak_intensity"), 1)))
+
+if __name__ == "__main__":
+    ioc = subprocess.Popen([sys.executable, "-m", "beamline34IDC.hardware.epics.simulated_ioc", "--interfaces", "127.0.0.1"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(2.0)
+
+        focusing_system = hardware_focusing_optics_factory_method(implementor=Implementors.EPICS, beamline=Beamline.VIRTUAL)
+        focusing_system.initialize(ca_address_list="127.0.0.1")
+
+        t0 = time.perf_counter()
+        focusing_system.get_photon_beam(direction=Directions.BOTH, parameters=PARAMETERS, scan_mode=ScanMode.FLY, exposure_time=EXPOSURE_TIME)
+        scan_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        _, info = focusing_system.get_photon_beam(scan_mode=ScanMode.IMAGE, exposure_time=EXPOSURE_TIME)
+        image_time = time.perf_counter() - t0
+
+        print("fly scans H and V: " + str(round(scan_time, 2)) + " s, image: " + str(round(image_time, 3)) + " s")
+        print_info("full image", info)
+
+        # background rate of the simulated beamline: 1e2 counts/s per pixel
+        _, info = focusing_system.get_photon_beam(scan_mode=ScanMode.IMAGE, exposure_time=EXPOSURE_TIME, roi=[24, 104, 18, 78], background=1e2*EXPOSURE_TIME)
+        print_info("ROI, background subtracted", info)
+    finally:
+        ioc.terminate()
+        ioc.wait()
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import asyncio
+import subprocess
+
+# offline: the virtual beamline served by the simulated IOC, on this host
+os.environ["EPICS_CA_ADDR_LIST"]      = "127.0.0.1"
+os.environ["EPICS_CA_AUTO_ADDR_LIST"] = "NO"
+
+from beamline34IDC.hardware.facade import Beamline
+from beamline34IDC.hardware.epics.pv_names import Scan
+from beamline34IDC.hardware.epics.pv_registry import PVRegistry
+from beamline34IDC.hardware.epics.acquisition import acquire_counts, acquire_frames, async_acquire_counts
+
+# one detector exposure: put Acquire, sleep and poll Acquire (the old scan loop) vs the monitors of Acquire,
+# ArrayCounter and Total; then multi-frame averaging and the asyncio interface
+
+EXPOSURE_TIME = 0.1
+N_CALLS       = 20
+
+DETECTOR = Scan.DETECTOR[Beamline.VIRTUAL]
+COUNTS   = Scan.COUNTS[Beamline.VIRTUAL]
+
+def acquire_with_polling(pvs):
+    pvs.put(DETECTOR + ":Acquire", 1)
+
+    time.sleep(0.2)
+
+    while (pvs.get(DETECTOR + ":Acquire") != 0): time.sleep(0.1)
+
+    return pvs.get(COUNTS)
+
+def time_per_call(function, n_calls=N_CALLS):
+    t0 = time.perf_counter()
+    for _ in range(n_calls): function()
+
+    return (time.perf_counter() - t0) / n_calls
+
+async def acquire_concurrently(pvs):
+    # the event loop stays free during the exposure
+    ticks = 0
+    acquisition = asyncio.ensure_future(async_acquire_counts(pvs, DETECTOR, COUNTS, n_frames=3))
+    while not acquisition.done():
+        await asyncio.sleep(0.01)
+        ticks += 1
+
+    return acquisition.result(), ticks
+
+if __name__ == "__main__":
+    ioc = subprocess.Popen([sys.executable, "-m", "beamline34IDC.hardware.epics.simulated_ioc", "--interfaces", "127.0.0.1"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(2.0)
+
+        pvs = PVRegistry()
+        pvs.add_detector(DETECTOR, COUNTS)
+        pvs.wait_for_connection()
+        pvs.put(Scan.SHUTTER[Beamline.VIRTUAL], 1)
+        pvs.put(DETECTOR + ":AcquireTime", EXPOSURE_TIME)
+
+        polling_time = time_per_call(lambda: acquire_with_polling(pvs))
+        event_time   = time_per_call(lambda: acquire_counts(pvs, DETECTOR, COUNTS))
+        print("exposure " + str(EXPOSURE_TIME) + " s: sleep/poll " + str(round(polling_time, 3)) + " s, monitors " + str(round(event_time, 3)) + " s per point")
+
+        frames = acquire_frames(pvs, DETECTOR, COUNTS, n_frames=5)
+        print("5 frames: " + ", ".join([str(round(frame, 1)) for frame in frames]) + ", average " + str(round(frames.mean(), 1)))
+
+        counts, ticks = asyncio.run(acquire_concurrently(pvs))
+        print("asyncio, 3 frames: average " + str(round(counts, 1)) + ", " + str(ticks) + " event loop ticks during the acquisition")
+    finally:
+        ioc.terminate()
+        ioc.wait()
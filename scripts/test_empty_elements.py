@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import numpy
+
+from orangecontrib.shadow.util.shadow_objects import ShadowBeam, ShadowOpticalElement
+
+from beamline34IDC.util.shadow.common import load_shadow_beam, FortranOutputCapture
+from beamline34IDC.util.shadow.empty_elements import create_empty_element, create_screen_slit, trace_empty_element
+from beamline34IDC.util import clean_up
+
+# empty elements traced with numpy vs Shadow, on the output beam of the primary optics (same rays, same elements):
+# the exit code is 1 if an element is not bit-for-bit identical
+
+def get_elements():
+    elements = []
+
+    for rotation_angle in [270.0, 180.0, 90.0, 33.3]:
+        elements.append(["Rotation " + str(rotation_angle), create_empty_element(rotation_angle=rotation_angle)])
+
+    elements.append(["Drift 1000.0", create_empty_element(distance=1000.0)])
+    elements.append(["Coherence slits", create_screen_slit(aperture_x=0.03, aperture_z=0.07, center_x=0.001, center_z=-0.002)])
+    elements.append(["White beam slits", create_screen_slit(aperture_x=0.1, aperture_z=10.0, distance=26800.0)])
+
+    obstruction = create_screen_slit(aperture_x=0.01, aperture_z=0.01)
+    obstruction.I_STOP = numpy.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+    elements.append(["Rectangular obstruction", obstruction])
+
+    elliptical = create_screen_slit(aperture_x=0.02, aperture_z=0.03, distance=50.0)
+    elliptical.K_SLIT = numpy.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+    elements.append(["Elliptical slit", elliptical])
+
+    tilted = create_empty_element(distance=100.0, rotation_angle=45.0)
+    tilted.T_INCIDENCE = 10.0
+    tilted.T_REFLECTION = 170.0
+    tilted.T_IMAGE = 20.0
+    elements.append(["Tilted drift", tilted])
+
+    return elements
+
+def compare(input_beam, name, oe):
+    with FortranOutputCapture():
+        t0 = time.time()
+        shadow_beam = ShadowBeam.traceFromOE(input_beam, ShadowOpticalElement(oe.duplicate()), widget_class_name="EmptyElement")
+        t1 = time.time()
+        numpy_beam  = trace_empty_element(input_beam, ShadowOpticalElement(oe.duplicate()), widget_class_name="EmptyElement")
+        t2 = time.time()
+
+    shadow_rays = shadow_beam._beam.rays
+    numpy_rays  = numpy_beam._beam.rays
+
+    identical    = shadow_rays.shape == numpy_rays.shape and shadow_rays.tobytes() == numpy_rays.tobytes()
+    max_abs_diff = numpy.nanmax(numpy.abs(shadow_rays - numpy_rays))
+
+    print(name.ljust(25) +
+          " bit-for-bit: " + str(identical).ljust(6) +
+          " max |diff|: " + str(max_abs_diff).ljust(10) +
+          " lost rays: " + str(numpy.sum(shadow_rays[:, 9] < 0)) + "/" + str(numpy.sum(numpy_rays[:, 9] < 0)) +
+          " time (Shadow/numpy): " + str(round(t1 - t0, 4)) + "/" + str(round(t2 - t1, 4)) + " s")
+
+    return identical
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    input_beam = load_shadow_beam("primary_optics_system_beam.dat")
+
+    # some rays lost upstream, to check that the flags are preserved
+    lost_beam = input_beam.duplicate()
+    lost_beam._beam.rays[::7, 9] = -11000.0
+
+    all_identical = True
+    for beam_name, beam in [["Primary optics beam", input_beam], ["With lost rays", lost_beam]]:
+        print(beam_name + ": " + str(beam._beam.rays.shape[0]) + " rays")
+
+        for name, oe in get_elements(): all_identical = compare(beam, name, oe) and all_identical
+
+    print("All bit-for-bit identical: " + str(all_identical))
+
+    clean_up()
+
+    sys.exit(0 if all_identical else 1)
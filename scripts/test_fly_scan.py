@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import subprocess
+
+import numpy
+
+# offline: the virtual beamline served by the simulated IOC, on this host
+os.environ["EPICS_CA_ADDR_LIST"]      = "127.0.0.1"
+os.environ["EPICS_CA_AUTO_ADDR_LIST"] = "NO"
+
+from beamline34IDC.hardware.facade import Beamline, Implementors
+from beamline34IDC.hardware.facade.focusing_optics_factory import hardware_focusing_optics_factory_method
+from beamline34IDC.hardware.facade.focusing_optics_interface import Directions, ScanMode
+
+# beam profile at the sample stage: step scan (move, settle, expose, read per point) vs fly scan (continuous motion
+# and acquisition), same points and exposure time
+
+PARAMETERS    = [[-2, 2, 20], [-2, 2, 20]]
+FLAT_PARAMETERS = [10, 14, 20] # far from the beam: background only, the counts do not change from frame to frame
+EXPOSURE_TIME = 0.1
+
+def get_centroid_and_sigma(data):
+    counts = data[:, 1] - numpy.min(data[:, 1])
+    centroid = numpy.sum(data[:, 0] * counts) / numpy.sum(counts)
+
+    return centroid, numpy.sqrt(numpy.sum((data[:, 0] - centroid) ** 2 * counts) / numpy.sum(counts))
+
+if __name__ == "__main__":
+    ioc = subprocess.Popen([sys.executable, "-m", "beamline34IDC.hardware.epics.simulated_ioc", "--interfaces", "127.0.0.1"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(2.0)
+
+        focusing_system = hardware_focusing_optics_factory_method(implementor=Implementors.EPICS, beamline=Beamline.VIRTUAL)
+        focusing_system.initialize(ca_address_list="127.0.0.1")
+
+        times = {}
+        for scan_mode, name in [(ScanMode.STEP, "step"), (ScanMode.FLY, "fly")]:
+            t0 = time.perf_counter()
+            data_h, data_v = focusing_system.get_photon_beam(direction=Directions.BOTH, parameters=PARAMETERS,
+                                                             scan_mode=scan_mode, exposure_time=EXPOSURE_TIME)
+            times[name] = time.perf_counter() - t0
+
+            for direction, data in [("H", data_h), ("V", data_v)]:
+                centroid, sigma = get_centroid_and_sigma(data)
+                print(name + " " + direction + ": centroid " + str(round(centroid, 3)) + " mm, sigma " + str(round(sigma, 3)) + " mm")
+            print(name + " scan: " + str(round(times[name], 2)) + " s")
+
+        print("speedup: x" + str(round(times["step"] / times["fly"], 1)))
+
+        # frames with the same counts are clocked by the frame counter, not lost
+        flat_step, _ = focusing_system.get_photon_beam(direction=Directions.HORIZONTAL, parameters=FLAT_PARAMETERS,
+                                                       scan_mode=ScanMode.STEP, exposure_time=EXPOSURE_TIME)
+        flat_fly, _  = focusing_system.get_photon_beam(direction=Directions.HORIZONTAL, parameters=FLAT_PARAMETERS,
+                                                       scan_mode=ScanMode.FLY, exposure_time=EXPOSURE_TIME)
+        same_counts = numpy.allclose(flat_step[:, 1], flat_fly[:, 1])
+        print("flat region, fly counts equal to step counts: " + str(same_counts))
+        if not same_counts: sys.exit(1)
+    finally:
+        ioc.terminate()
+        ioc.wait()
@@ -0,0 +1,59 @@
+import os
+import time
+
+from beamline34IDC.optimization.common import reinitialize
+from beamline34IDC.simulation.facade.focusing_optics_pool import FocusingOpticsPool
+from beamline34IDC.util.shadow.common import get_shadow_beam_spatial_distribution
+from beamline34IDC.util import clean_up
+
+# re-initialization vs acquisition from a warm pool, and reset of the state on release
+
+DEFAULT_RANDOM_SEED = 111
+
+def get_sigmas(focusing_system):
+    _, dw = get_shadow_beam_spatial_distribution(focusing_system.get_photon_beam(random_seed=DEFAULT_RANDOM_SEED))
+
+    return dw.get_parameter("h_sigma"), dw.get_parameter("v_sigma")
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    for bender in [False, True]:
+        print("Bender: " + str(bender))
+
+        t0 = time.time()
+        focusing_system = reinitialize("primary_optics_system_beam.dat", bender=bender)
+        print("  reinitialize:      " + str(round(time.time() - t0, 4)) + " s")
+
+        with FocusingOpticsPool(size=2) as pool:
+            t0 = time.time()
+            pool.warm_up(bender=bender)
+            print("  warm up (2):       " + str(round(time.time() - t0, 4)) + " s")
+
+            t0 = time.time()
+            focusing_system = reinitialize("primary_optics_system_beam.dat", bender=bender, pool=pool)
+            print("  acquire:           " + str(round(time.time() - t0, 6)) + " s")
+
+            initial_sigmas = get_sigmas(focusing_system)
+
+            focusing_system.move_vkb_motor_3_pitch(0.01)
+            focusing_system.move_hkb_motor_4_translation(20.0)
+            moved_sigmas = get_sigmas(focusing_system)
+
+            t0 = time.time()
+            pool.release(focusing_system)
+            focusing_system = pool.acquire(bender=bender)
+            print("  release + acquire: " + str(round(time.time() - t0, 6)) + " s")
+
+            t0 = time.time()
+            restored_sigmas = get_sigmas(focusing_system) # served by the stage caches
+            print("  initial state:     " + str(round(time.time() - t0, 6)) + " s")
+
+            print("  sigmas (initial/moved/restored): " + str(initial_sigmas) + " " + str(moved_sigmas) + " " + str(restored_sigmas))
+            print("  restored == initial: " + str(restored_sigmas == initial_sigmas))
+
+            pool.release(focusing_system)
+
+    clean_up()
@@ -0,0 +1,49 @@
+import sys
+import numpy
+
+from beamline34IDC.util.gaussian_fit import generalized_2D_gaussian, get_coordinate_grid, fast_2D_gaussian_fit, calculate_2D_gaussian_fit
+
+# fast 2D gaussian fit vs the reference fit and the true parameters, on rotated anisotropic beams (sigma_y > sigma_x
+# and sigma_x > sigma_y) with noise: the exit code is 1 if a parameter is off by more than the tolerance
+
+PARAMETERS = ["amplitude", "center_x", "center_y", "sigma_x", "sigma_y", "theta"]
+TOLERANCE  = 1e-2 # relative (absolute for centers and theta, in sigma and radians)
+
+X = numpy.linspace(-0.015, 0.015, 101)
+Y = numpy.linspace(-0.02, 0.02, 121)
+
+def get_image(amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset, noise, random_generator):
+    image = generalized_2D_gaussian(get_coordinate_grid(X, Y).T, amplitude, center_x, center_y, sigma_x, sigma_y, theta, offset).reshape(len(X), len(Y))
+
+    return image + noise * random_generator.standard_normal(image.shape)
+
+def get_errors(fit, true_parameters):
+    sigma = min(true_parameters["sigma_x"], true_parameters["sigma_y"])
+
+    return {"amplitude" : abs(fit["amplitude"] / true_parameters["amplitude"] - 1),
+            "center_x"  : abs(fit["center_x"] - true_parameters["center_x"]) / sigma,
+            "center_y"  : abs(fit["center_y"] - true_parameters["center_y"]) / sigma,
+            "sigma_x"   : abs(fit["sigma_x"] / true_parameters["sigma_x"] - 1),
+            "sigma_y"   : abs(fit["sigma_y"] / true_parameters["sigma_y"] - 1),
+            "theta"     : abs(fit["theta"] - true_parameters["theta"])}
+
+if __name__ == "__main__":
+    random_generator = numpy.random.default_rng(4545)
+
+    failed = False
+    for theta in [0.0, 0.3, -0.3, 0.7]:
+        for sigma_x, sigma_y in [[1.5e-3, 4e-3], [4e-3, 1.5e-3]]:
+            true_parameters = {"amplitude" : 100.0, "center_x" : 1e-3, "center_y" : -5e-4, "sigma_x" : sigma_x, "sigma_y" : sigma_y, "theta" : theta}
+            image = get_image(offset=2.0, noise=0.5, random_generator=random_generator, **true_parameters)
+
+            fast_errors      = get_errors(fast_2D_gaussian_fit(image, X, Y), true_parameters)
+            reference_errors = get_errors(calculate_2D_gaussian_fit(image, X, Y), true_parameters)
+
+            passed = max(fast_errors.values()) < TOLERANCE
+            failed = failed or not passed
+
+            print("theta " + str(theta).rjust(4) + ", sigmas " + str(sigma_x) + ", " + str(sigma_y) +
+                  ": max error fast " + str(round(max(fast_errors.values()), 5)) +
+                  ", reference " + str(round(max(reference_errors.values()), 5)) + (" ok" if passed else " FAILED"))
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,84 @@
+import os
+import time
+import numpy
+
+from beamline34IDC.util.shadow.common import load_shadow_beam, create_shadow_beam
+from beamline34IDC.util.shadow.histogram import histogram_2D, histogram_2D_batch, HistogramGeometry
+from beamline34IDC.util import clean_up
+
+# Beam.histo2 vs the numpy.bincount histograms, on 50k, 500k and 5M rays resampled from the primary optics beam
+
+def resample_beam(input_beam, n_rays, lost_fraction=0.1, seed=8787):
+    random_generator = numpy.random.default_rng(seed)
+
+    rays = input_beam._beam.rays[random_generator.integers(0, input_beam._beam.rays.shape[0], n_rays)].copy()
+    rays[:, 0] += random_generator.normal(0.0, 1e-4, n_rays)
+    rays[:, 2] += random_generator.normal(0.0, 1e-4, n_rays)
+    rays[random_generator.random(n_rays) < lost_fraction, 9] = -11000.0
+    rays[:, 11] = numpy.arange(1, n_rays + 1)
+
+    return create_shadow_beam(rays)
+
+def best_time(function, n_repetitions):
+    times = []
+    for _ in range(n_repetitions):
+        t0 = time.time()
+        result = function()
+        times.append(time.time() - t0)
+
+    return min(times), result
+
+def compare(shadow_beam, nbins=201, xrange=None, yrange=None, n_repetitions=5):
+    time_histo2, ticket_histo2 = best_time(lambda: shadow_beam._beam.histo2(1, 3, nbins=nbins, nolost=1, xrange=xrange, yrange=yrange, calculate_widths=0), n_repetitions)
+    time_numpy,  ticket_numpy  = best_time(lambda: histogram_2D(shadow_beam, 1, 3, nbins=nbins, nolost=1, xrange=xrange, yrange=yrange), n_repetitions)
+    time_single, ticket_single = best_time(lambda: histogram_2D(shadow_beam, 1, 3, nbins=nbins, nolost=1, xrange=xrange, yrange=yrange, dtype=numpy.float32), n_repetitions)
+
+    identical    = numpy.array_equal(ticket_histo2["histogram"], ticket_numpy["histogram"]) and \
+                   numpy.array_equal(ticket_histo2["bin_h_center"], ticket_numpy["bin_h_center"]) and \
+                   numpy.array_equal(ticket_histo2["bin_v_center"], ticket_numpy["bin_v_center"])
+    max_rel_diff = numpy.max(numpy.abs(ticket_single["histogram"] - ticket_histo2["histogram"])) / numpy.max(ticket_histo2["histogram"])
+
+    print("  ranges: " + ("automatic" if xrange is None else "fixed    ") +
+          " bit-for-bit: " + str(identical).ljust(6) +
+          " histo2: " + str(round(time_histo2, 4)).ljust(7) + " s" +
+          " bincount: " + str(round(time_numpy, 4)).ljust(7) + " s (x" + str(round(time_histo2/time_numpy, 1)) + ")" +
+          " float32: " + str(round(time_single, 4)).ljust(7) + " s (max rel. diff " + "{:.1e}".format(max_rel_diff) + ")")
+
+    return identical
+
+def compare_batch(shadow_beams, nbins=201, n_repetitions=3):
+    geometry = HistogramGeometry.get(nbins, nbins, [-0.01, 0.01], [-0.01, 0.01])
+
+    time_histo2, histograms_histo2 = best_time(lambda: [shadow_beam._beam.histo2(1, 3, nbins=nbins, nolost=1, xrange=geometry.xrange, yrange=geometry.yrange, calculate_widths=0)["histogram"]
+                                                        for shadow_beam in shadow_beams], n_repetitions)
+    time_batch,  histograms_batch  = best_time(lambda: histogram_2D_batch(shadow_beams, geometry), n_repetitions)
+
+    identical = all([numpy.array_equal(histogram_histo2, histogram_batch) for histogram_histo2, histogram_batch in zip(histograms_histo2, histograms_batch)])
+
+    print("  batch of " + str(len(shadow_beams)) + " beams: bit-for-bit: " + str(identical).ljust(6) +
+          " histo2: " + str(round(time_histo2, 4)).ljust(7) + " s" +
+          " batch: " + str(round(time_batch, 4)).ljust(7) + " s (x" + str(round(time_histo2/time_batch, 1)) + ")")
+
+    return identical
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    input_beam = load_shadow_beam("primary_optics_system_beam.dat")
+
+    all_identical = True
+    for n_rays in [50000, 500000, 5000000]:
+        shadow_beam = resample_beam(input_beam, n_rays)
+
+        print(str(n_rays) + " rays:")
+
+        all_identical = compare(shadow_beam) and all_identical
+        all_identical = compare(shadow_beam, xrange=[-0.01, 0.01], yrange=[-0.01, 0.01]) and all_identical
+
+    all_identical = compare_batch([resample_beam(input_beam, 50000, seed=seed) for seed in range(20)]) and all_identical
+
+    print("All bit-for-bit identical: " + str(all_identical))
+
+    clean_up()
@@ -0,0 +1,52 @@
+import sys
+import numpy
+
+from beamline34IDC.util.common import get_image_info
+
+# statistics and gaussian fit of a non-square detector image (rows: vertical, columns: horizontal), full and ROI:
+# the exit code is 1 if a sigma (or the fit) is off by more than the tolerance
+
+IMAGE_SIZE = [128, 96] # h, v
+PIXEL_SIZE = 0.05      # mm
+TOLERANCE  = 2e-2      # relative (absolute for the fit centers, in sigma)
+
+BEAM = {"center_h" : 0.4, "center_v" : -0.2, "sigma_h" : 0.5, "sigma_v" : 0.3}
+
+def get_image(center_h, center_v, sigma_h, sigma_v, peak=1e4, background=10.0):
+    x = (numpy.arange(IMAGE_SIZE[0]) - 0.5 * (IMAGE_SIZE[0] - 1)) * PIXEL_SIZE
+    z = (numpy.arange(IMAGE_SIZE[1]) - 0.5 * (IMAGE_SIZE[1] - 1)) * PIXEL_SIZE
+
+    return background + peak * numpy.exp(-0.5 * (((x[numpy.newaxis, :] - center_h) / sigma_h) ** 2 + ((z[:, numpy.newaxis] - center_v) / sigma_v) ** 2))
+
+def check(name, value, expected, error):
+    passed = error <= TOLERANCE
+    print(name + ": " + str(round(value, 4)) + " (expected " + str(round(expected, 4)) + ")" + ("" if passed else " FAILED"))
+
+    return passed
+
+if __name__ == "__main__":
+    image = get_image(**BEAM)
+
+    passed = True
+    for roi_name, roi in [("full image", None), ("ROI", [30, 100, 20, 70])]:
+        print(roi_name + ":")
+
+        _, info = get_image_info(image, pixel_size=PIXEL_SIZE, roi=roi, background=10.0, do_gaussian_fit=True)
+        fit     = info.get_parameter("gaussian_fit")
+
+        if len(fit) == 0:
+            print("gaussian fit FAILED")
+            passed = False
+            continue
+
+        # the fit may swap the axes, with theta = +-pi/2
+        fit_sigma_h, fit_sigma_v = (fit["sigma_x"], fit["sigma_y"]) if abs(numpy.cos(fit["theta"])) > 0.5 else (fit["sigma_y"], fit["sigma_x"])
+
+        passed = check("sigma h", info.get_parameter("h_sigma"), BEAM["sigma_h"], abs(info.get_parameter("h_sigma") / BEAM["sigma_h"] - 1)) and passed
+        passed = check("sigma v", info.get_parameter("v_sigma"), BEAM["sigma_v"], abs(info.get_parameter("v_sigma") / BEAM["sigma_v"] - 1)) and passed
+        passed = check("fit center h", fit["center_x"], BEAM["center_h"], abs(fit["center_x"] - BEAM["center_h"]) / BEAM["sigma_v"]) and passed
+        passed = check("fit center v", fit["center_y"], BEAM["center_v"], abs(fit["center_y"] - BEAM["center_v"]) / BEAM["sigma_v"]) and passed
+        passed = check("fit sigma h", fit_sigma_h, BEAM["sigma_h"], abs(fit_sigma_h / BEAM["sigma_h"] - 1)) and passed
+        passed = check("fit sigma v", fit_sigma_v, BEAM["sigma_v"], abs(fit_sigma_v / BEAM["sigma_v"] - 1)) and passed
+
+    sys.exit(0 if passed else 1)
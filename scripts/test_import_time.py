@@ -0,0 +1,67 @@
+import os
+import sys
+import subprocess
+
+# startup of a headless Shadow worker (python -X importtime): plotting, Qt, SRW and the hardware stacks must not be loaded
+
+WORKER_IMPORTS = "import beamline34IDC.optimization.common; " \
+                 "import beamline34IDC.simulation.shadow.parallel; " \
+                 "from beamline34IDC.simulation.facade.focusing_optics_factory import simulated_focusing_optics_factory_method; " \
+                 "simulated_focusing_optics_factory_method(bender=True)"
+
+# what a worker paid before the imports were made lazy
+FULL_STACK_IMPORTS = WORKER_IMPORTS + "; " \
+                     "import matplotlib.pyplot, IPython; " \
+                     "import beamline34IDC.util.srw.common, beamline34IDC.simulation.srw.focusing_optics; " \
+                     "from oasys_srw.uti_plot import uti_plot_init; uti_plot_init(backend='Qt5Agg'); " \
+                     "import beamline34IDC.hardware.epics.focusing_optics"
+
+FORBIDDEN_MODULES = ["matplotlib.pyplot", "PyQt5.QtWidgets", "IPython", "oasys_srw.srwlib", "wofrysrw", "epics"]
+
+# optimization and beam analysis without tracing (hardware, SRW): Shadow and the OASYS widgets must not be loaded
+NO_SHADOW_IMPORTS = "import beamline34IDC.util.shadow.common; " \
+                    "import beamline34IDC.optimization.common; " \
+                    "import beamline34IDC.optimization.scipy_nelder_mead"
+
+NO_SHADOW_FORBIDDEN_MODULES = ["Shadow", "oasys.util.oasys_util", "oasys.widgets.congruence", "orangecontrib.shadow.util.shadow_objects",
+                               "orangecontrib.shadow.widgets.special_elements.bl.hybrid_control", "PyQt5.QtWidgets"]
+
+def get_import_time(statement, n_repetitions=5):
+    '''
+    best total (cumulative, top level modules) of python -X importtime in seconds, and the loaded modules
+    '''
+    times = []
+    for _ in range(n_repetitions):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement + "; import sys; print('\\n'.join(sys.modules.keys()))"],
+                                capture_output=True, text=True, cwd=os.path.abspath(os.curdir))
+        if result.returncode != 0: raise RuntimeError(result.stderr[-2000:])
+
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line: continue
+
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not name.startswith("  "): total += int(cumulative) # top level: not nested in another import
+
+        times.append(total * 1e-6)
+
+    return min(times), set(result.stdout.splitlines())
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    no_shadow_time, no_shadow_modules = get_import_time(NO_SHADOW_IMPORTS)
+
+    print("Optimization without Shadow startup: " + str(round(no_shadow_time, 3)) + " s")
+
+    loaded = [module for module in NO_SHADOW_FORBIDDEN_MODULES if module in no_shadow_modules]
+    print("Shadow modules loaded without tracing: " + (str(loaded) if len(loaded) > 0 else "none"))
+
+    worker_time, worker_modules = get_import_time(WORKER_IMPORTS)
+    full_time, _                = get_import_time(FULL_STACK_IMPORTS)
+
+    print("Shadow worker startup: " + str(round(worker_time, 3)) + " s")
+    print("Full stack startup:    " + str(round(full_time, 3)) + " s (x" + str(round(full_time/worker_time, 1)) + ")")
+
+    loaded = [module for module in FORBIDDEN_MODULES if module in worker_modules]
+    print("Modules loaded by the worker that should not be: " + (str(loaded) if len(loaded) > 0 else "none"))
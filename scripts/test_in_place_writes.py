@@ -0,0 +1,77 @@
+import os
+import sys
+
+import numpy
+import Shadow
+
+from orangecontrib.shadow.util.shadow_objects import ShadowOpticalElement, ShadowBeam
+from orangecontrib.shadow.widgets.special_elements.bl import hybrid_control
+
+from beamline34IDC.simulation.facade import Implementors
+from beamline34IDC.simulation.facade.focusing_optics_factory import simulated_focusing_optics_factory_method
+from beamline34IDC.util.shadow.common import load_shadow_beam, get_hybrid_input_parameters, PreProcessorFiles
+
+# the beams returned by get_photon_beam are written in place by the caller (rays edited, traced through a slit,
+# hybrid): by default, and after make_writable() with copy on write, without changing the next outputs of the
+# focusing optics. The exit code is 1 if a write fails or an output changes
+
+RANDOM_SEED = 2120
+
+def get_slit():
+    slit = Shadow.OE()
+    slit.DUMMY = 0.1
+    slit.FWRITE = 3
+    slit.F_REFRAC = 2
+    slit.F_SCREEN = 1
+    slit.I_SLIT = numpy.array([1, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+    slit.N_SCREEN = 1
+    slit.RX_SLIT = numpy.array([0.01, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    slit.RZ_SLIT = numpy.array([0.01, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+    slit.T_IMAGE = 0.0
+    slit.T_INCIDENCE = 0.0
+    slit.T_REFLECTION = 180.0
+    slit.T_SOURCE = 0.0
+
+    return ShadowOpticalElement(slit)
+
+def write_in_place(photon_beam):
+    photon_beam._beam.rays[:, 0] += 1e-4
+
+    slit_beam = ShadowBeam.traceFromOE(photon_beam, get_slit(), widget_class_name="ScreenSlits", history=True)
+
+    return hybrid_control.hy_run(get_hybrid_input_parameters(slit_beam, diffraction_plane=4, calcType=1, random_seed=RANDOM_SEED)).ff_beam
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    input_beam = load_shadow_beam("primary_optics_system_beam.dat")
+
+    failed = False
+
+    for bender in [False, True]:
+        for copy_on_write in [None, True]: # None: default
+            focusing_system = simulated_focusing_optics_factory_method(implementor=Implementors.SHADOW, bender=bender)
+            parameters      = {} if copy_on_write is None else {"copy_on_write" : copy_on_write}
+            focusing_system.initialize(input_photon_beam=input_beam, rewrite_preprocessor_files=PreProcessorFiles.NO,
+                                       rewrite_height_error_profile_files=False, workspace=True, **parameters)
+
+            photon_beam    = focusing_system.get_photon_beam(random_seed=RANDOM_SEED)
+            reference_rays = numpy.array(photon_beam._beam.rays, copy=True)
+
+            if copy_on_write: photon_beam.make_writable()
+
+            try:
+                write_in_place(photon_beam)
+
+                unchanged = numpy.array_equal(focusing_system.get_photon_beam(random_seed=RANDOM_SEED)._beam.rays, reference_rays)
+                message   = "ok" if unchanged else "next output changed"
+            except Exception as e:
+                unchanged = False
+                message   = "failed: " + str(e)
+
+            print("bender " + str(bender) + ", copy on write " + ("default" if copy_on_write is None else str(copy_on_write)) + ": " + message)
+            failed = failed or not unchanged
+
+            focusing_system.close()
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,60 @@
+import os
+import tracemalloc
+
+from beamline34IDC.simulation.facade import Implementors
+from beamline34IDC.facade.focusing_optics_factory import focusing_optics_factory_method, ExecutionMode
+from beamline34IDC.facade.focusing_optics_interface import Movement, AngularUnits
+
+from beamline34IDC.util.shadow.common import load_shadow_beam, PreProcessorFiles
+from beamline34IDC.util import clean_up
+
+# peak memory allocated by get_photon_beam, with and without copy-on-write beams
+# (numpy allocations are traced by tracemalloc)
+
+def measure_peak_memory(input_beam, bender, copy_on_write, n_iterations=5, random_seed=2120):
+    focusing_system = focusing_optics_factory_method(execution_mode=ExecutionMode.SIMULATION,
+                                                     implementor=Implementors.SHADOW, bender=bender)
+
+    focusing_system.initialize(input_photon_beam=input_beam,
+                               rewrite_preprocessor_files=PreProcessorFiles.NO,
+                               rewrite_height_error_profile_files=False,
+                               copy_on_write=copy_on_write)
+
+    peaks = []
+    for i in range(n_iterations):
+        # a different V-KB pitch at every iteration: V-KB and H-KB are traced
+        focusing_system.move_vkb_motor_3_pitch(0.001, movement=Movement.RELATIVE, units=AngularUnits.MILLIRADIANS)
+
+        tracemalloc.start()
+        output_beam = focusing_system.get_photon_beam(verbose=False, near_field_calculation=False, random_seed=random_seed)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        del output_beam
+
+    return peaks
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    input_beam = load_shadow_beam("primary_optics_system_beam.dat")
+
+    ray_array_size = input_beam._beam.rays.nbytes
+
+    print("Ray array: " + str(input_beam._beam.rays.shape) + ", " + str(round(ray_array_size/1024**2, 1)) + " MB")
+
+    for bender in [False, True]:
+        peaks_copy = measure_peak_memory(input_beam, bender, copy_on_write=False)
+        peaks_cow  = measure_peak_memory(input_beam, bender, copy_on_write=True)
+
+        average_copy = sum(peaks_copy)/len(peaks_copy)
+        average_cow  = sum(peaks_cow)/len(peaks_cow)
+
+        print("Bender: " + str(bender))
+        print("  peak per get_photon_beam, copies         : " + str(round(average_copy/1024**2, 1)) + " MB (" + str(round(average_copy/ray_array_size, 1)) + " ray arrays)")
+        print("  peak per get_photon_beam, copy on write  : " + str(round(average_cow/1024**2, 1)) + " MB (" + str(round(average_cow/ray_array_size, 1)) + " ray arrays)")
+        print("  ratio                                    : " + str(round(average_cow/average_copy, 2)))
+
+    clean_up()
@@ -1,12 +1,23 @@
 import os
+import sys
 
 from beamline34IDC.simulation.facade import Implementors
 from beamline34IDC.facade.focusing_optics_factory import focusing_optics_factory_method, ExecutionMode
 from beamline34IDC.facade.focusing_optics_interface import Movement, AngularUnits, DistanceUnits
 
 from beamline34IDC.util.shadow.common import plot_shadow_beam_spatial_distribution, load_shadow_beam, PreProcessorFiles
+from beamline34IDC.util.benchmark import run_memory_benchmark, MemoryThresholds
 from beamline34IDC.util import clean_up
 
+# leaks and slowdowns of get_photon_beam in a long optimization: the exit code is 1 if a threshold is exceeded
+N_ITERATIONS = 50
+N_WARM_UP    = 5
+THRESHOLDS   = MemoryThresholds(max_rss_leak_per_call=256*1024,   # bytes
+                                max_traced_leak_per_call=16*1024, # bytes
+                                max_fd_leak=0)
+# latencies are measured in a second run, without tracemalloc
+LATENCY_THRESHOLDS = MemoryThresholds(max_latency_p50=None, max_latency_p95=None) # seconds, machine dependent (None: not checked)
+
 if __name__ == "__main__":
     verbose = False
 
@@ -30,10 +41,19 @@ if __name__ == "__main__":
     #print("Initial H-KB bender positions and q (up, down)",
     #      focusing_system.get_hkb_motor_1_2_bender(units=DistanceUnits.MICRON), focusing_system.get_hkb_q_distance())
 
-    for i in range(50):
+    def trace(iteration):
         focusing_system.move_vkb_motor_3_pitch(0.00001, movement=Movement.RELATIVE, units=AngularUnits.MILLIRADIANS)
         output_beam = focusing_system.get_photon_beam(verbose=verbose, near_field_calculation=False, debug_mode=False,
                                                       random_seed=2120)
-        print('iteration', i)
 
-    clean_up()
\ No newline at end of file
+    memory_result  = run_memory_benchmark(trace, n_iterations=N_ITERATIONS, n_warm_up=N_WARM_UP, thresholds=THRESHOLDS,
+                                          name="memory, bender=False", verbose=True)
+    latency_result = run_memory_benchmark(trace, n_iterations=N_ITERATIONS, n_warm_up=0, thresholds=LATENCY_THRESHOLDS,
+                                          trace_python_allocations=False, name="latency, bender=False")
+
+    memory_result.print_report()
+    latency_result.print_report()
+
+    clean_up()
+
+    sys.exit(0 if (memory_result.is_passed() and latency_result.is_passed()) else 1)
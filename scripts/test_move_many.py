@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+import subprocess
+
+# offline: the virtual beamline served by the simulated IOC, on this host
+os.environ["EPICS_CA_ADDR_LIST"]      = "127.0.0.1"
+os.environ["EPICS_CA_AUTO_ADDR_LIST"] = "NO"
+
+from beamline34IDC.hardware.facade import Beamline, Implementors
+from beamline34IDC.hardware.facade.focusing_optics_factory import hardware_focusing_optics_factory_method
+from beamline34IDC.facade.focusing_optics_interface import Movement
+
+# H-KB pitch and translation, one after the other vs together: the concurrent move takes the time of the slowest motor
+
+if __name__ == "__main__":
+    ioc = subprocess.Popen([sys.executable, "-m", "beamline34IDC.hardware.epics.simulated_ioc", "--interfaces", "127.0.0.1"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(2.0)
+
+        focusing_system = hardware_focusing_optics_factory_method(implementor=Implementors.EPICS, beamline=Beamline.VIRTUAL)
+        focusing_system.initialize(ca_address_list="127.0.0.1")
+
+        t0 = time.perf_counter()
+        focusing_system.move_hkb_motor_3_pitch(0.2, movement=Movement.RELATIVE)
+        focusing_system.move_hkb_motor_4_translation(15.0, movement=Movement.RELATIVE)
+        sequential_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        settle_times = focusing_system.move_many({"HKB_MOTOR_3": -0.2, "HKB_MOTOR_4": -15.0}, movement=Movement.RELATIVE)
+        concurrent_time = time.perf_counter() - t0
+
+        print("sequential: " + str(round(sequential_time, 3)) + " s")
+        print("concurrent: " + str(round(concurrent_time, 3)) + " s, settle times: " +
+              ", ".join([motor + " " + str(round(settle_time, 3)) + " s" for motor, settle_time in settle_times.items()]))
+        print("positions back to the start: " + str(focusing_system.get_hkb_motor_3_pitch()) + ", " + str(focusing_system.get_hkb_motor_4_translation()))
+    finally:
+        ioc.terminate()
+        ioc.wait()
@@ -0,0 +1,44 @@
+import os
+import time
+
+from beamline34IDC.optimization.common import reinitialize
+from beamline34IDC.optimization.skopt_gp import SkoptGaussianProcessOptimizer
+from beamline34IDC.simulation.shadow.parallel import ParallelFocusingOptics
+from beamline34IDC.util import clean_up
+
+# wall time of the GP optimization: sequential gp_minimize vs batches of points evaluated in parallel,
+# with the same budget of n_calls evaluations
+
+motor_types = ['hkb_4', 'vkb_4']
+n_calls     = 40
+random_seed = 2120
+
+def run_optimization(parallel_focusing_optics=None):
+    focusing_system = reinitialize("primary_optics_system_beam.dat", bender=False)
+
+    optimizer = SkoptGaussianProcessOptimizer(focusing_system, motor_types=motor_types, random_seed=random_seed, loss_parameters='centroid')
+    optimizer.set_optimizer_options(n_calls=n_calls, random_state=random_seed)
+
+    t0 = time.time()
+    results, guesses, solution, success = optimizer.trials(parallel_focusing_optics=parallel_focusing_optics)
+    wall_time = time.time() - t0
+
+    return wall_time, solution, optimizer._opt_trials_losses, optimizer._opt_fn_call_counter
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    wall_time, solution, losses, n_evaluations = run_optimization()
+    print("Sequential gp_minimize: " + str(round(wall_time, 1)) + " s, " + str(n_evaluations) + " evaluations, best loss " + str(min(losses)) + " at " + str(solution))
+
+    for n_workers in [2, 4, os.cpu_count()]:
+        with ParallelFocusingOptics(input_photon_beam_file_name="primary_optics_system_beam.dat", bender=False, n_workers=n_workers) as parallel_focusing_optics:
+            parallel_focusing_optics.get_photon_beams([{}]*n_workers) # initializes the workers, not timed
+            parallel_time, solution, losses, n_evaluations = run_optimization(parallel_focusing_optics)
+
+        print("Batch of " + str(n_workers) + " points: " + str(round(parallel_time, 1)) + " s (x" + str(round(wall_time/parallel_time, 1)) + "), " +
+              str(n_evaluations) + " evaluations, best loss " + str(min(losses)) + " at " + str(solution))
+
+    clean_up()
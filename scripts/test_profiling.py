@@ -0,0 +1,41 @@
+import os
+
+from beamline34IDC.optimization.common import reinitialize
+from beamline34IDC.optimization.scipy_nelder_mead import ScipyOptimizer
+from beamline34IDC.facade.focusing_optics_interface import Movement
+from beamline34IDC.util.shadow.common import get_shadow_beam_spatial_distribution
+from beamline34IDC.util.profiling import Profiler
+from beamline34IDC.util import clean_up
+
+# per-stage timings of the simulation (traces, hybrid, caches, copies) and of the optimizer calls:
+# summary table on the console, Chrome trace in trace.json (open with chrome://tracing or ui.perfetto.dev)
+
+DEFAULT_RANDOM_SEED = 111
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    profiler = Profiler()
+
+    for bender in [False, True]:
+        focusing_system = reinitialize("primary_optics_system_beam.dat", bender=bender)
+
+        # full trace, then the H-KB stage only, then a beam cache hit
+        get_shadow_beam_spatial_distribution(focusing_system.get_photon_beam(random_seed=DEFAULT_RANDOM_SEED, profiler=profiler))
+        focusing_system.move_hkb_motor_3_pitch(0.001, movement=Movement.RELATIVE)
+        get_shadow_beam_spatial_distribution(focusing_system.get_photon_beam(random_seed=DEFAULT_RANDOM_SEED, profiler=profiler))
+
+        with profiler: # everything in the block, analysis included
+            get_shadow_beam_spatial_distribution(focusing_system.get_photon_beam(random_seed=DEFAULT_RANDOM_SEED))
+
+        optimizer = ScipyOptimizer(focusing_system, motor_types=["hkb_4", "vkb_4"], random_seed=DEFAULT_RANDOM_SEED,
+                                   loss_parameters=["centroid", "fwhm"], profiler=profiler)
+        for positions in [[0.0, 0.0], [0.01, 0.01], [-0.01, 0.01]]:
+            optimizer.absolute_loss_function(positions, verbose=False)
+
+    profiler.print_summary()
+    print("Chrome trace: " + profiler.export_chrome_trace("trace.json"))
+
+    clean_up()
@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy
+from concurrent.futures import ThreadPoolExecutor
+
+from beamline34IDC.optimization.common import reinitialize
+from beamline34IDC.optimization.scipy_nelder_mead import ScipyOptimizer
+from beamline34IDC.util import clean_up
+
+# evaluate() leaves the focusing system as it was: the same positions give the same losses when the
+# evaluations are sequential, interleaved or concurrent on the same optimizer, and the motors do not move
+
+DEFAULT_RANDOM_SEED = 111
+
+POSITIONS = [[0.0, 0.0], [0.01, 0.01], [-0.01, 0.01], [0.005, -0.02]]
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    focusing_system = reinitialize("primary_optics_system_beam.dat", bender=True)
+
+    optimizer = ScipyOptimizer(focusing_system, motor_types=["hkb_4", "vkb_4"], random_seed=DEFAULT_RANDOM_SEED,
+                               loss_parameters=["centroid", "fwhm"])
+
+    motor_state = focusing_system.get_motor_state()
+
+    def evaluate(positions): return optimizer.evaluate(positions).parameter_value
+
+    sequential  = [evaluate(positions) for positions in POSITIONS]
+    interleaved = [evaluate(positions) for positions in reversed(POSITIONS)][::-1]
+    with ThreadPoolExecutor(max_workers=len(POSITIONS)) as executor:
+        concurrent = list(executor.map(evaluate, POSITIONS * 2))
+
+    failed = False
+    for i, positions in enumerate(POSITIONS):
+        losses = [sequential[i], interleaved[i], concurrent[i], concurrent[i + len(POSITIONS)]]
+        same   = all(loss == sequential[i] for loss in losses)
+        failed = failed or not same
+
+        print(positions, "losses:", numpy.round(losses, 6), "OK" if same else "MISMATCH")
+
+    same_state = focusing_system.get_motor_state() == motor_state
+    failed     = failed or not same_state
+    print("motor state unchanged:", same_state)
+
+    focusing_system.close()
+    clean_up()
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import subprocess
+
+# offline: the virtual beamline served by the simulated IOC, on this host
+os.environ["EPICS_CA_ADDR_LIST"]      = "127.0.0.1"
+os.environ["EPICS_CA_AUTO_ADDR_LIST"] = "NO"
+
+from epics import caget, caput
+
+from beamline34IDC.hardware.facade import Beamline, Implementors
+from beamline34IDC.hardware.facade.focusing_optics_factory import hardware_focusing_optics_factory_method
+from beamline34IDC.hardware.epics.pv_names import Motors
+from beamline34IDC.hardware.epics.pv_registry import PVRegistry
+from beamline34IDC.facade.focusing_optics_interface import Movement
+
+# readbacks and puts in an optimization loop: caget/caput per call vs persistent PVs, and the time of a short move
+
+N_CALLS = 500
+
+def time_per_call(function, n_calls=N_CALLS):
+    t0 = time.perf_counter()
+    for i in range(n_calls): function(i)
+
+    return (time.perf_counter() - t0) / n_calls
+
+if __name__ == "__main__":
+    ioc = subprocess.Popen([sys.executable, "-m", "beamline34IDC.hardware.epics.simulated_ioc", "--interfaces", "127.0.0.1"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(2.0)
+
+        focusing_system = hardware_focusing_optics_factory_method(implementor=Implementors.EPICS, beamline=Beamline.VIRTUAL)
+        focusing_system.initialize(ca_address_list="127.0.0.1")
+
+        motor = Motors.HKB_MOTOR_3[Beamline.VIRTUAL]
+
+        caget_time    = time_per_call(lambda i: caget(motor + ".VAL", use_monitor=False))
+        registry_time = time_per_call(lambda i: focusing_system.get_hkb_motor_3_pitch())
+        print("readback: caget " + str(round(1e3*caget_time, 3)) + " ms, persistent PV " + str(round(1e3*registry_time, 3)) + " ms (x" + str(round(caget_time/registry_time, 1)) + ")")
+
+        # both without waiting for the motion: the simulated IOC completes the puts before the end of the motion,
+        # so caput(..., wait=True) would not wait for it either
+        pvs = PVRegistry()
+        pvs.add_motor(motor)
+        pvs.wait_for_connection()
+
+        caput_time    = time_per_call(lambda i: caput(motor + ".RLV", 1e-5))
+        registry_time = time_per_call(lambda i: pvs.put(motor + ".RLV", 1e-5))
+        print("put:      caput " + str(round(1e3*caput_time, 3)) + " ms, persistent PV " + str(round(1e3*registry_time, 3)) + " ms (x" + str(round(caput_time/registry_time, 1)) + ")")
+
+        pvs.disconnect()
+
+        # to the end of the motion (.DMOV monitor)
+        move_time = time_per_call(lambda i: focusing_system.move_hkb_motor_3_pitch(1e-5, movement=Movement.RELATIVE), n_calls=50)
+        print("move to the end of the motion: " + str(round(1e3*move_time, 3)) + " ms")
+
+        # the readback after a put is never older than the put
+        focusing_system.move_hkb_motor_3_pitch(0.02)
+        print("value after put: " + str(focusing_system.get_hkb_motor_3_pitch()) + " (expected 0.02)")
+    finally:
+        ioc.terminate()
+        ioc.wait()
@@ -0,0 +1,80 @@
+import os
+import time
+import threading
+
+from beamline34IDC.simulation.facade import Implementors
+from beamline34IDC.simulation.facade.focusing_optics_factory import simulated_focusing_optics_factory_method
+from beamline34IDC.simulation.shadow.server import SimulationServer
+from beamline34IDC.util.shadow.common import load_shadow_beam, PreProcessorFiles
+from beamline34IDC.util import clean_up
+
+# focusing systems hosted by a simulation server: two clients, the same batch requested at the same time is traced once
+
+DEFAULT_RANDOM_SEED = 111
+
+def get_client(address, authkey):
+    focusing_system = simulated_focusing_optics_factory_method(implementor=Implementors.SHADOW_SERVER, bender=False, address=address, authkey=authkey)
+    focusing_system.initialize(input_photon_beam=load_shadow_beam("primary_optics_system_beam.dat"),
+                               rewrite_preprocessor_files=PreProcessorFiles.NO,
+                               rewrite_height_error_profile_files=False)
+
+    return focusing_system
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    with SimulationServer(address=("localhost", 0), pool_size=2) as server:
+        t0 = time.time()
+        server.warm_up(n_systems=2)
+        print("Warm up: " + str(round(time.time() - t0, 4)) + " s")
+
+        t0 = time.time()
+        client_1 = get_client(server.get_address(), server.get_authkey())
+        client_2 = get_client(server.get_address(), server.get_authkey())
+        print("Clients initialized: " + str(round(time.time() - t0, 4)) + " s")
+
+        client_1.move_vkb_motor_3_pitch(0.01)
+        print("Pitch client 1/2: " + str(client_1.get_vkb_motor_3_pitch()) + "/" + str(client_2.get_vkb_motor_3_pitch()))
+
+        t0 = time.time()
+        client_1.get_photon_beam(random_seed=DEFAULT_RANDOM_SEED)
+        print("Single trace: " + str(round(time.time() - t0, 4)) + " s")
+
+        configurations = [{"vkb_motor_4_translation" : translation} for translation in [-0.02, -0.01, 0.0, 0.01, 0.02]]
+        outputs = {}
+
+        t0 = time.time()
+        threads = [threading.Thread(target=lambda client=client: outputs.__setitem__(client, client.get_photon_beams(configurations, random_seed=DEFAULT_RANDOM_SEED)))
+                   for client in [client_1, client_2]]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        print("Same batch of " + str(len(configurations)) + " from both clients: " + str(round(time.time() - t0, 4)) + " s")
+
+        print("Identical outputs: " + str(all([output_1.photon_beam._beam.rays.tobytes() == output_2.photon_beam._beam.rays.tobytes()
+                                                for output_1, output_2 in zip(outputs[client_1], outputs[client_2])])))
+
+        # a different session state (here the input beam) is not shared, even with the same batch
+        client_2.perturbate_input_photon_beam(shift_h=0.01)
+
+        threads = [threading.Thread(target=lambda client=client: outputs.__setitem__(client, client.get_photon_beams(configurations, random_seed=DEFAULT_RANDOM_SEED)))
+                   for client in [client_1, client_2]]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        print("Different outputs with a perturbed input beam: " + str(all([output_1.photon_beam._beam.rays.tobytes() != output_2.photon_beam._beam.rays.tobytes()
+                                                                           for output_1, output_2 in zip(outputs[client_1], outputs[client_2])])))
+
+        # a client reaches only the sessions opened on its connection
+        foreign_session_id = client_2._ShadowServerFocusingOptics__session_id
+        try:
+            client_1._ShadowServerFocusingOptics__request("call", (foreign_session_id, "get_vkb_motor_3_pitch", (), {}))
+            print("Session of another client rejected: False")
+        except ValueError:
+            print("Session of another client rejected: True")
+
+        client_1.close()
+        client_2.close()
+
+    clean_up()
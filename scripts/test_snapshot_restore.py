@@ -0,0 +1,38 @@
+import os
+import sys
+import numpy
+
+from beamline34IDC.optimization.common import reinitialize
+from beamline34IDC.util import clean_up
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    clean_up()
+
+    focusing_system = reinitialize("primary_optics_system_beam.dat", bender=False)
+
+    # without random seed: a new realization at each call, unless the stage beams have just been restored
+    reference_rays      = numpy.array(focusing_system.get_photon_beam()._beam.rays, copy=True)
+    snapshot            = focusing_system.snapshot()
+    snapshot_input_rays = numpy.array(snapshot.input_beam._beam.rays, copy=True)
+
+    focusing_system.perturbate_input_photon_beam(shift_h=0.01, rotation_v=1e-5)
+    focusing_system.get_photon_beam()
+
+    input_unchanged = numpy.array_equal(snapshot.input_beam._beam.rays, snapshot_input_rays)
+    print("snapshot input beam unchanged by the perturbation:", input_unchanged)
+
+    focusing_system.restore(snapshot)
+
+    restored_rays = focusing_system.get_photon_beam()._beam.rays
+    reused        = numpy.array_equal(restored_rays, reference_rays)
+    print("restored beams returned without tracing:", reused)
+
+    retraced = not numpy.array_equal(focusing_system.get_photon_beam()._beam.rays, reference_rays)
+    print("next call traces a new realization:", retraced)
+
+    focusing_system.close()
+    clean_up()
+
+    sys.exit(0 if (input_unchanged and reused and retraced) else 1)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+from beamline34IDC.optimization.common import reinitialize
+from beamline34IDC.facade.focusing_optics_interface import Movement
+from beamline34IDC.util.profiling import Profiler
+
+# stages traced without random seed, alternating between two V-KB pitches: the coherence slits are traced once,
+# then every call traces the V-KB and the H-KB only. The exit code is 1 if more stages are traced
+
+N_CALLS = 6
+
+if __name__ == "__main__":
+    os.chdir("../work_directory")
+
+    failed = False
+
+    for bender in [False, True]:
+        focusing_system = reinitialize("primary_optics_system_beam.dat", bender=bender)
+        profiler        = Profiler()
+
+        focusing_system.get_photon_beam(profiler=profiler)
+        for i in range(N_CALLS):
+            focusing_system.move_vkb_motor_3_pitch(0.001 if i % 2 == 0 else -0.001, movement=Movement.RELATIVE)
+            focusing_system.get_photon_beam(profiler=profiler)
+
+        calls    = dict([(row["name"], row["calls"]) for row in profiler.get_summary() if row["category"] == "stage"])
+        expected = {"Coherence Slits" : 1, "V-KB" : N_CALLS + 1, "H-KB" : N_CALLS + 1}
+
+        print("bender " + str(bender) + ": traced stages " + str(calls) + ", expected " + str(expected))
+        failed = failed or calls != expected
+
+        focusing_system.close()
+
+    sys.exit(1 if failed else 0)